@@ -4,8 +4,12 @@ reps_blueprint = Blueprint('reps', url_prefix="/reps")
 health_blueprint = Blueprint('health', url_prefix="/health")
 indices_blueprint = Blueprint('indices', url_prefix="/indices")
 monitoring_blueprint = Blueprint('monitoring', url_prefix="/monitoring")
+crawls_blueprint = Blueprint('crawls', url_prefix="/crawls")
+metrics_blueprint = Blueprint('metrics', url_prefix="/metrics")
 
 from . import reps
 from . import health
 from . import indices
 from . import monitoring
+from . import crawls
+from . import metrics
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""Blueprint dedicated to the bookkeeping of the crawls (see crawls.py)
+"""
+
+import logging
+
+import ujson as json
+
+from sanic import response
+from sanic.exceptions import InvalidUsage
+
+from sanicargs import parse_query_args
+
+from . import crawls_blueprint
+
+import crawls
+
+LOGGER = logging.getLogger('app')
+
+
+@crawls_blueprint.route('/', methods=["POST"])
+async def add_crawl(request):
+    """
+    called by the spider when it closes, the payload contains:
+    - 'spider': the name of the spider, which is the catalog of its items
+    - 'zone': the zone crawled
+    - 'stats': the stats of the crawl (start_time, finish_time, finish_reason, item_scraped_count, http_pipeline/delivered...)
+    """
+    json_args = json.loads(request.body)
+
+    catalog = json_args.get('spider', '')
+    zone = json_args.get('zone', '')
+    stats = json_args.get('stats', {})
+
+    if not catalog or not catalog.strip():
+        raise InvalidUsage(f"'spider' param is mandatory")
+
+    if not zone or not zone.strip():
+        raise InvalidUsage(f"'zone' param is mandatory")
+
+    if not isinstance(stats, dict):
+        raise InvalidUsage(f"'stats' must be an object")
+
+    crawl = crawls.record_crawl(catalog, zone, stats)
+
+    return response.json({
+        'success': True,
+        'result': crawl
+    })
+
+
+@crawls_blueprint.route('/', methods=["GET"])
+@parse_query_args
+async def get_crawls(request, zone: str):
+    """
+    the last crawl and the last healthy crawl of each catalog of the zone
+    """
+    return response.json({
+        'success': True,
+        'result': crawls.get_crawls(zone)
+    })
@@ -10,7 +10,7 @@ from sanicargs import parse_query_args
 
 from . import health_blueprint
 
-from search_index import ElasticMonitoring, MonitoringError
+from search_index import AsyncElasticMonitoring, MonitoringError
 import config
 import utils
 
@@ -32,7 +32,7 @@ async def health(request, zone: str):
 
     try:
 
-        result = ElasticMonitoring.monitor(zone)
+        result = await AsyncElasticMonitoring.monitor(zone)
         service_up = True
 
     except MonitoringError as ese:
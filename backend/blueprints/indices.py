@@ -14,7 +14,8 @@ from sanic_babel import gettext
 
 from . import indices_blueprint
 
-from  search_index import ElasticCommand, IndexError
+from search_index import AsyncElasticCommand, IndexError
+from tasks import reindex_zone, backfill_zone, backfill_checkpoint, claim_ingest_session, start_ingest_session, release_ingest_session, close_ingest_session
 import config
 import utils
 
@@ -37,7 +38,7 @@ async def create_index(request):
 
     success = False
     try:
-        ElasticCommand.create_index(zone)
+        await AsyncElasticCommand.create_index(zone)
         success = True
     except IndexError as i:
         LOGGER.critical(f"Index creation error for zone {zone}")
@@ -60,7 +61,7 @@ async def delete_index(request, zone: str):
 
     success = False
     try:
-        ElasticCommand.delete_index(zone)
+        await AsyncElasticCommand.delete_index(zone)
         success = True
     except IndexError as i:
         LOGGER.critical(f"Deletion error for zone {zone}")
@@ -68,3 +69,138 @@ async def delete_index(request, zone: str):
     return response.json({
         'success': success
     })
+
+
+@indices_blueprint.route('/reindex', methods=["POST"])
+async def reindex(request):
+    """
+    rebuilds the index of the zone in background with the current settings and mapping,
+    the zone remains searchable during the reindex, the alias being swapped at the end
+    """
+    json_args = json.loads(request.body)
+    zone = json_args.get('zone', '')
+
+    if not zone or zone.strip()=='':
+        LOGGER.error(f"zone cannot be blank, cannot reindex")
+        raise InvalidUsage(f"Invalid params zone '{zone}'")
+
+    job_id = reindex_zone(zone, keep_previous=bool(json_args.get('keep_previous', False)))
+
+    return response.json({
+        'success': True,
+        'result': {
+            'job_id': job_id
+        }
+    })
+
+
+@indices_blueprint.route('/backfill', methods=["POST"])
+async def backfill(request):
+    """
+    recomputes in background the features, the typed attributes and the quality index of all the documents of the zone,
+    pass 'resume': true to resume an interrupted backfill from its last checkpoint
+    """
+    json_args = json.loads(request.body)
+    zone = json_args.get('zone', '')
+
+    if not zone or zone.strip()=='':
+        LOGGER.error(f"zone cannot be blank, cannot backfill")
+        raise InvalidUsage(f"Invalid params zone '{zone}'")
+
+    job_id = backfill_zone(zone, resume=bool(json_args.get('resume', False)))
+
+    return response.json({
+        'success': True,
+        'result': {
+            'job_id': job_id
+        }
+    })
+
+
+@indices_blueprint.route('/backfill', methods=["GET"])
+@parse_query_args
+async def backfill_progress(request, zone: str):
+    """
+    the checkpoint of the backfill of the zone: {'after', 'processed', 'errors'}, None when no backfill is in progress
+    """
+    return response.json({
+        'success': True,
+        'result': backfill_checkpoint(zone)
+    })
+
+
+@indices_blueprint.route('/ingest', methods=["POST"])
+async def begin_ingest_session(request):
+    """
+    called before feeding a zone with a large amount of items,
+    the index refresh is disabled and its replicas are dropped until the session is closed
+    or until the timeout (in seconds) is reached.
+
+    When a session is already open on the zone, its timeout is postponed
+    """
+    json_args = json.loads(request.body)
+    zone = json_args.get('zone', '')
+
+    if not zone or zone.strip()=='':
+        LOGGER.error(f"zone cannot be blank, cannot begin ingest session")
+        raise InvalidUsage(f"Invalid params zone '{zone}'")
+
+    try:
+        timeout = int(json_args.get('timeout', config.ENV.INGEST_SESSION_TIMEOUT))
+    except (TypeError, ValueError):
+        raise InvalidUsage(f"Invalid params timeout '{json_args.get('timeout')}'")
+
+    if timeout <= 0:
+        raise InvalidUsage(f"Invalid params timeout '{timeout}'")
+
+    if not claim_ingest_session(zone, timeout=timeout):
+        LOGGER.info(f"Ingest session already open on zone {zone}, timeout postponed")
+        return response.json({
+            'success': True,
+            'result': {
+                'already_open': True
+            }
+        })
+
+    success = False
+    job_id = None
+    try:
+        previous = await AsyncElasticCommand.begin_ingest(zone)
+        job_id = start_ingest_session(zone, previous, timeout=timeout)
+        success = True
+    except IndexError as i:
+        LOGGER.critical(f"Ingest session error for zone {zone}")
+        release_ingest_session(zone)
+
+    return response.json({
+        'success': success,
+        'result': {
+            'already_open': False,
+            'timeout_job_id': job_id
+        }
+    })
+
+
+@indices_blueprint.route('/ingest', methods=["DELETE"])
+@parse_query_args
+async def end_ingest_session(request, zone: str, force_merge: bool = False):
+    """
+    restores the settings of the index in background, refreshes it once
+    and force merges its segments if force_merge is set
+    """
+    zone = urllib.parse.unquote(zone)
+
+    if not zone or zone.strip()=='':
+        LOGGER.error(f"zone cannot be blank, cannot end ingest session")
+        raise InvalidUsage(f"Invalid params zone '{zone}'")
+
+    job_id = close_ingest_session(zone, force_merge=force_merge)
+    if job_id is None:
+        LOGGER.warning(f"No ingest session open on zone {zone}")
+
+    return response.json({
+        'success': job_id is not None,
+        'result': {
+            'job_id': job_id
+        }
+    })
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""Blueprint exposing the metrics of the ingestion in the Prometheus text format (see metrics.py)
+"""
+
+import logging
+
+from sanic import response
+
+from . import metrics_blueprint
+
+from tasks import high_q, std_q, low_q
+import metrics
+import streams
+
+LOGGER = logging.getLogger('app')
+
+
+QUEUE_DEPTH = metrics.Gauge(
+    'rq_queue_depth',
+    "Jobs waiting in the RQ queues",
+    collect=lambda: {(q.name, ): len(q) for q in (high_q, std_q, low_q)},
+    labels=('queue',)
+)
+
+STREAM_DEPTH = metrics.Gauge(
+    'stream_depth',
+    "Items waiting to be indexed in the ingestion streams, delivered or not, when INGEST_TRANSPORT is stream",
+    collect=lambda: {(zone, ): depth for zone, depth in streams.depths().items()},
+    labels=('zone',)
+)
+
+
+@metrics_blueprint.route('/', methods=["GET"])
+async def get_metrics(request):
+    """
+    the counters and the histograms of the ingestion, aggregated over all the processes
+    """
+    return response.text(
+        metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -12,6 +12,12 @@ import ujson as json
 
 from . import monitoring_blueprint
 
+from elastic_client import ElasticClientRegistry
+from search_index import AsyncElasticMonitoring, MonitoringError
+from tasks import cleanup_stats
+from dedup import stats as dedup_stats
+import streams
+from metrics import STAGE_DURATION
 import config
 
 LOGGER = logging.getLogger('app')
@@ -77,3 +83,82 @@ async def monitor(request):
         'success': service_up,
         'result': result
     })
+
+
+@monitoring_blueprint.route('/pools', methods=["GET"])
+async def pools(request):
+    """
+    state of the Elasticsearch connections pools of the worker process serving the request
+    """
+    return response.json({
+        'success': True,
+        'result': ElasticClientRegistry.stats()
+    })
+
+
+@monitoring_blueprint.route('/streams', methods=["GET"])
+async def streams_stats(request):
+    """
+    length, lag and pending entries of the ingestion streams of the zones
+    """
+    return response.json({
+        'success': True,
+        'result': streams.stats()
+    })
+
+
+@monitoring_blueprint.route('/dedup', methods=["GET"])
+async def dedup(request):
+    """
+    number of items accepted and suppressed as duplicates, per catalog
+    """
+    return response.json({
+        'success': True,
+        'result': dedup_stats()
+    })
+
+
+@monitoring_blueprint.route('/cleanup', methods=["GET"])
+async def cleanup(request):
+    """
+    the last cleanup of each zone: status, duration, number of ads deleted and throttling, per catalog
+    """
+    return response.json({
+        'success': True,
+        'result': cleanup_stats()
+    })
+
+
+@monitoring_blueprint.route('/latency', methods=["GET"])
+async def latency(request):
+    """
+    percentiles of the time taken by the traced items to be searchable, per catalog and per stage (see tracing.py)
+    """
+    result = {}
+    for (catalog, stage), estimates in STAGE_DURATION.percentiles().items():
+        result.setdefault(catalog, {})[stage] = estimates
+
+    return response.json({
+        'success': True,
+        'result': result
+    })
+
+
+@monitoring_blueprint.route('/caches', methods=["GET"])
+async def caches(request):
+    """
+    hit ratios, evictions and memory of the shard request cache and of the node query cache, per node of the cluster
+    """
+    service_up = False
+    result = {}
+
+    try:
+        result = await AsyncElasticMonitoring.caches()
+        service_up = True
+    except MonitoringError as ese:
+        LOGGER.error(f"Error reading the caches stats", exc_info=True)
+
+    return response.json({
+        'success': service_up,
+        'result': result
+    })
@@ -15,13 +15,17 @@ from sanic.exceptions import abort, ServerError, InvalidUsage
 from sanicargs import parse_query_args, fields
 from sanic_babel import gettext
 
-from tasks import index_items, report_error
+from tasks import index_items, report_error, is_ingestion_throttled
 
 from . import reps_blueprint
 
 import config
 import utils
 import main
+import error_reports
+import tracing
+from redis_client import redis_conn
+from metrics import ITEMS_RECEIVED, ITEMS_VALIDATED, ITEMS_REJECTED, REQUESTS_THROTTLED
 
 """
 Blueprints receive raw data and verify their structure (nature of fields, compliance with mandatory fields)
@@ -30,14 +34,65 @@ However, the field value checking and sanitization is not done here, rather in b
 
 LOGGER = logging.getLogger('app')
 
+ITEM_SCHEMA = {
+    "type": "object",
+    "properties" : {
+        "sku": {"type" : "string"},
+        "title"     : { "type" : "string", "minLength": 0}, # allow blank strings
+        "description": { "type" : "string"},
+        "price"     : { "type" : "number", "minimum": 0},
+        "area"     : { "type" : "number"},
+        "city"    : { "type" : "string"},
+        "media" : {"type": "array", "items": { "type": "string" }},
+        "url" : {"type" : "string"},
+    },
+    "required": ["sku", "title", "price", "city", "url", "media"]
+}
+
+# the validator is stateless, no need to rebuild it for each item
+_VALIDATOR = Draft4Validator(ITEM_SCHEMA)
+
+
+def _validate(item):
+    """returns the sorted list of schema errors of the item, void if the item is valid"""
+    return sorted(_VALIDATOR.iter_errors(item), key=lambda e: e.path)
+
+
+def _signature(errors):
+    """
+    the signature of the schema errors of an item, used to group the errors reported,
+    the messages are not used as they may contain the values of the item
+    """
+    return error_reports.make_signature(
+        [f"{'.'.join([str(p) for p in e.path])}:{e.validator}:{e.message if e.validator == 'required' else ''}" for e in errors]
+    )
+
+
+def _throttled_response():
+    """tells the crawler to send its items later, the ingestion being late"""
+    REQUESTS_THROTTLED.inc()
+    return response.json(
+        {
+            'success': False,
+            'errors': ["Too many items waiting to be indexed, retry later"]
+        },
+        status=429,
+        headers={'Retry-After': str(config.Q.INGEST_RETRY_AFTER)}
+    )
+
 
 @reps_blueprint.route('/', methods=["POST"])
 async def add_rep(request):
     """
     called by the spider when an item has been fetched in order to persist it in ES.
     The item is passed as JSON into the payload
+
+    Answers 429 when the ingestion is late (see is_ingestion_throttled), the spider must send the item again later
     """
 
+    if is_ingestion_throttled():
+        return _throttled_response()
+
     json_args = json.loads(request.body)
 
     short_name = json_args.get('catalog', '')
@@ -51,46 +106,46 @@ async def add_rep(request):
 
     item = json_args.get('item', {})
 
-    ITEM_SCHEMA = {
-        "type": "object",
-        "properties" : {
-            "sku": {"type" : "string"},
-            "title"     : { "type" : "string", "minLength": 0}, # allow blank strings
-            "description": { "type" : "string"},
-            "price"     : { "type" : "number", "minimum": 0},
-            "area"     : { "type" : "number"},
-            "city"    : { "type" : "string"},
-            "media" : {"type": "array", "items": { "type": "string" }},
-            "url" : {"type" : "string"},
-        },
-        "required": ["sku", "title", "price", "city", "url", "media"]
-    }
+    # the trace of the item, if sent by the spider, to measure the time taken by the item to be searchable
+    trace = tracing.receive(json_args.get('trace'))
+    if trace:
+        tracing.observe(short_name, 'http', trace['scraped_at'], trace['received_at'])
 
-    v = Draft4Validator(ITEM_SCHEMA)
-    errors = sorted(v.iter_errors(item), key=lambda e: e.path)
+    errors = _validate(item)
     if errors:
+        ITEMS_RECEIVED.inc(catalog=short_name)
+        ITEMS_REJECTED.inc(catalog=short_name)
         LOGGER.warning(f"Errors receiving item: {errors}, received {item}")
-        # send this business error to sentry
+        # this business error is reported to sentry, grouped with the errors of the same kind
         # so that we can easily be notified and visualize it
         # this will facilitate the fix of the scraping issue
-        job_id = report_error(
+        error_id = report_error(
             [item],
             catalog=short_name,
-            errors=[e.message for e in errors]
+            errors=[e.message for e in errors],
+            signature=_signature(errors)
         )
         return response.json({
             'success': False,
             'errors': [e.message for e in errors],
             'result': {
-                'job_id': job_id
+                # no job is enqueued anymore to report the error, job_id is kept for the crawlers reading it
+                'job_id': None,
+                'error_id': error_id
             }
         })
 
     # data seem to be clean, we can integrate them into elastic
+    # the metrics are sent to Redis with the claim of the item, in a single round trip (see index_items)
+    pipe = redis_conn.pipeline()
+    ITEMS_RECEIVED.inc(catalog=short_name, pipe=pipe)
+    ITEMS_VALIDATED.inc(catalog=short_name, pipe=pipe)
     job_id = index_items(
         [item],
         catalog=short_name,
-        zone=zone
+        zone=zone,
+        traces=[trace] if trace else None,
+        pipe=pipe
     )
 
     return response.json({
@@ -99,3 +154,112 @@ async def add_rep(request):
             'job_id': job_id
         }
     })
+
+
+@reps_blueprint.route('/bulk', methods=["POST"])
+async def add_reps(request):
+    """
+    called by the spider to persist a batch of items of the same catalog and zone in ES.
+
+    The payload is either:
+    - a JSON object with the keys 'catalog', 'zone' and 'items' (a list of items)
+    - a NDJSON body (content-type 'application/x-ndjson'), one item per line, 'catalog' and 'zone' being passed as query args
+
+    All the items are validated at once, valid items are indexed by batches of config.ENV.BULK_BATCH_SIZE,
+    invalid items are reported in a single error report. The status of each item is returned
+    in the same order as the items received
+
+    Answers 429 when the ingestion is late, as add_rep() does
+    """
+
+    if is_ingestion_throttled():
+        return _throttled_response()
+
+    if 'ndjson' in request.headers.get('content-type', ''):
+        short_name = request.args.get('catalog', '')
+        zone = request.args.get('zone', '')
+        try:
+            items = [json.loads(line) for line in request.body.decode('utf-8').splitlines() if line.strip()]
+        except ValueError as ve:
+            raise InvalidUsage(f"Invalid NDJSON body: {ve}")
+    else:
+        try:
+            json_args = json.loads(request.body)
+        except ValueError as ve:
+            raise InvalidUsage(f"Invalid JSON body: {ve}")
+        if not isinstance(json_args, dict):
+            raise InvalidUsage(f"The JSON body must be an object with the keys 'catalog', 'zone' and 'items'")
+        short_name = json_args.get('catalog', '')
+        zone = json_args.get('zone', '')
+        items = json_args.get('items', [])
+
+    if not short_name or not short_name.strip():
+        raise InvalidUsage(f"'catalog' param is mandatory")
+
+    if not zone or not zone.strip():
+        raise InvalidUsage(f"'zone' param is mandatory")
+
+    if not utils.is_list(items) or not items:
+        raise InvalidUsage(f"'items' must be a non-empty list")
+
+    if len(items) > config.ENV.BULK_MAX_ITEMS:
+        raise InvalidUsage(f"Too many items, {len(items)} received, max is {config.ENV.BULK_MAX_ITEMS}")
+
+    statuses = []
+    valid_items = []
+    invalid_items = {}
+
+    for position, item in enumerate(items):
+        errors = _validate(item)
+        sku = item.get('sku') if isinstance(item, dict) else None
+        if errors:
+            messages = [e.message for e in errors]
+            group = invalid_items.setdefault(_signature(errors), ([], set()))
+            group[0].append(item)
+            group[1].update(messages)
+            statuses.append({'sku': sku, 'status': 'rejected', 'errors': messages})
+        else:
+            valid_items.append((position, item))
+            statuses.append({'sku': sku, 'status': 'queued'})
+
+    rejected = sum([len(group_items) for group_items, _ in invalid_items.values()])
+    ITEMS_RECEIVED.inc(len(items), catalog=short_name)
+    ITEMS_VALIDATED.inc(len(valid_items), catalog=short_name)
+    ITEMS_REJECTED.inc(rejected, catalog=short_name)
+    error_ids = []
+    if invalid_items:
+        LOGGER.warning(f"{rejected} invalid items received in bulk for catalog {short_name}")
+        # a single report per kind of error
+        for signature, (group_items, messages) in invalid_items.items():
+            error_ids.append(report_error(
+                group_items,
+                catalog=short_name,
+                errors=sorted(messages),
+                signature=signature
+            ))
+
+    job_ids = []
+    batch_size = config.ENV.BULK_BATCH_SIZE
+    for start in range(0, len(valid_items), batch_size):
+        batch = valid_items[start:start+batch_size]
+        job_id = index_items(
+            [item for _, item in batch],
+            catalog=short_name,
+            zone=zone
+        )
+        job_ids.append(job_id)
+        for position, _ in batch:
+            statuses[position]['job_id'] = job_id
+
+    return response.json({
+        'success': not invalid_items,
+        'result': {
+            'accepted': len(valid_items),
+            'rejected': rejected,
+            'job_ids': job_ids,
+            # no job is enqueued anymore to report the errors, error_job_id is kept for the crawlers reading it
+            'error_job_id': None,
+            'error_ids': error_ids,
+            'items': statuses
+        }
+    })
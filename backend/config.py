@@ -25,6 +25,56 @@ class ElasticsearchConfig(object):
     # default : no replica on the cluster
     ES_REPLICAS = int('0' + os.getenv('ES_REPLICAS', default='0'))
 
+    # the zones using the compact index profile (see search_index.is_compact), ex: "mel,paris"
+    # the profile is applied when the index of the zone is created or reindexed
+    COMPACT_ZONES = [z.strip() for z in os.getenv('COMPACT_ZONES', default='').split(',') if z.strip()]
+
+    # the zones where the ads are routed by catalog (see search_index.is_routed), ex: "mel,paris"
+    # the ads of a catalog are in a single shard, the searches of a single catalog only hit this shard
+    # the routing is applied when the index of the zone is created or reindexed, it must be the same in the web
+    ROUTED_ZONES = [z.strip() for z in os.getenv('ROUTED_ZONES', default='').split(',') if z.strip()]
+
+    # the target size of a shard of a compact zone, in MB, the number of shards being at most ES_SHARDS
+    ES_COMPACT_SHARD_SIZE_MB = max([1, int('0' + os.getenv('ES_COMPACT_SHARD_SIZE_MB', default='10240'))])
+
+    # the Elasticsearch clients are kept per process (see elastic_client.py)
+    # ES_HOST may be a comma separated list of hosts
+    # max number of keep-alive connections per node
+    ES_POOL_MAXSIZE = max([1, int('0' + os.getenv('ES_POOL_MAXSIZE', default='10'))])
+
+    # requests timeout, in seconds
+    ES_TIMEOUT = max([1, int('0' + os.getenv('ES_TIMEOUT', default='10'))])
+
+    # compress the requests bodies (gzip), useful for bulk requests on a remote cluster
+    ES_HTTP_COMPRESS = bool(max([0, int('0' + os.getenv('ES_HTTP_COMPRESS', default='0'))]))
+
+    # discover the nodes of the cluster from the hosts passed, at startup and when a node fails
+    ES_SNIFF = bool(max([0, int('0' + os.getenv('ES_SNIFF', default='0'))]))
+    ES_SNIFFER_TIMEOUT = max([1, int('0' + os.getenv('ES_SNIFFER_TIMEOUT', default='60'))])
+
+    # the number of documents looked up (mget) and written (bulk) in a single request
+    # when indexing real estate ads
+    ES_BULK_CHUNK_SIZE = max([1, int('0' + os.getenv('ES_BULK_CHUNK_SIZE', default='500'))])
+
+    # the documents are written only if they were not changed since they were read (optimistic concurrency control),
+    # so that several workers can index the same products, the writes in conflict are retried ES_CONFLICT_RETRIES times
+    ES_CONFLICT_RETRIES = max([0, int('0' + os.getenv('ES_CONFLICT_RETRIES', default='5'))])
+
+    # timeout of the force merge run at the end of an ingest session, in seconds
+    ES_FORCE_MERGE_TIMEOUT = max([1, int('0' + os.getenv('ES_FORCE_MERGE_TIMEOUT', default='3600'))])
+
+    # a zone is an alias of a versioned index (ex: mel -> mel_v2), reindexing a zone copies its documents
+    # into a new version, the reindex job is stopped after ES_REINDEX_TIMEOUT seconds
+    ES_REINDEX_TIMEOUT = max([1, int('0' + os.getenv('ES_REINDEX_TIMEOUT', default='7200'))])
+
+    # interval between 2 checks of the reindex progress, in seconds
+    ES_REINDEX_POLL_INTERVAL = max([1, int('0' + os.getenv('ES_REINDEX_POLL_INTERVAL', default='5'))])
+
+    # the deletions of the cleanup are run as Elasticsearch tasks, throttled to this number of requests per second,
+    # 0 means no throttling. The tasks are polled every ES_TASK_POLL_INTERVAL seconds
+    ES_DELETE_REQUESTS_PER_SECOND = max([0, int('0' + os.getenv('ES_DELETE_REQUESTS_PER_SECOND', default='0'))])
+    ES_TASK_POLL_INTERVAL = max([1, int('0' + os.getenv('ES_TASK_POLL_INTERVAL', default='5'))])
+
 
 class StandardConfig(object):
 
@@ -42,6 +92,12 @@ class StandardConfig(object):
     # sentry settings
     SENTRY_URL = os.getenv("SENTRY_URL")
 
+    # the vocabulary of the features extracted from the descriptions of the ads (see nlp.py)
+    FEATURES_VOCABULARY = os.getenv(
+        'FEATURES_VOCABULARY',
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf', 'features.json')
+    )
+
     # the list of contexts where obsolete real estate ads will be deleted
     # it is required to define the index names
     CLEANUP_ZONES_LIST = ['mel']
@@ -50,10 +106,101 @@ class StandardConfig(object):
     # from the index
     CLEANUP_REPS_AFTER_X_DAYS = 2
 
+    # the cleanup runs one job per zone, each zone running the deletions of CLEANUP_WORKERS catalogs at most in parallel,
+    # the job of a zone is stopped after CLEANUP_TIMEOUT seconds
+    CLEANUP_WORKERS = max([1, int('0' + os.getenv('CLEANUP_WORKERS', default='4'))])
+    CLEANUP_TIMEOUT = max([1, int('0' + os.getenv('CLEANUP_TIMEOUT', default='7200'))])
+
+    # a crawl is healthy when it finished normally, scraped at least CRAWL_MIN_ITEMS items
+    # and at least CRAWL_MIN_ITEMS_PERCENT % of the items of the previous healthy crawl of the catalog,
+    # the ads of a catalog are only cleaned up after a healthy crawl
+    CRAWL_MIN_ITEMS = max([1, int('0' + os.getenv('CRAWL_MIN_ITEMS', default='1'))])
+    CRAWL_MIN_ITEMS_PERCENT = max([0, int('0' + os.getenv('CRAWL_MIN_ITEMS_PERCENT', default='50'))])
+
+    # comma separated list of zones stored in time based partitions (ex: mel-2020.05.01) behind the zone alias,
+    # the cleanup of these zones drops the obsolete partitions instead of deleting documents one by one
+    # the zones must be created once partitioned, existing zones are not migrated
+    PARTITIONED_ZONES = [z.strip() for z in os.getenv('PARTITIONED_ZONES', default='').split(',') if z.strip()]
+
+    # the number of days covered by a partition
+    PARTITION_PERIOD_DAYS = max([1, int('0' + os.getenv('PARTITION_PERIOD_DAYS', default='1'))])
+
+    # max number of items accepted in a single call to /reps/bulk
+    BULK_MAX_ITEMS = max([1, int('0' + os.getenv('BULK_MAX_ITEMS', default='1000'))])
+
+    # the items received in bulk are indexed by batches of BULK_BATCH_SIZE items, one job per batch
+    BULK_BATCH_SIZE = max([1, int('0' + os.getenv('BULK_BATCH_SIZE', default='100'))])
+
+    # the backfill job recomputes the features, the attributes and the quality index of all the documents of a zone,
+    # the documents are read by batches of BACKFILL_BATCH_SIZE, enriched by BACKFILL_PROCESSES processes
+    # and written back at BACKFILL_RATE documents per second at most, so that the search is not slowed down
+    BACKFILL_BATCH_SIZE = max([1, int('0' + os.getenv('BACKFILL_BATCH_SIZE', default='500'))])
+    BACKFILL_PROCESSES = max([1, int('0' + os.getenv('BACKFILL_PROCESSES', default='2'))])
+    BACKFILL_RATE = max([1, int('0' + os.getenv('BACKFILL_RATE', default='200'))])
+
+    # the backfill job is stopped after BACKFILL_TIMEOUT seconds, it can be resumed from its last checkpoint
+    BACKFILL_TIMEOUT = max([1, int('0' + os.getenv('BACKFILL_TIMEOUT', default='86400'))])
+
+    # the invalid items received are grouped by catalog and by error, one report being sent per group
+    # every ERROR_REPORT_WINDOW seconds with ERROR_REPORT_SAMPLES items at most,
+    # no more than ERROR_REPORT_MAX_PER_HOUR reports are sent per catalog and per hour
+    ERROR_REPORT_WINDOW = max([1, int('0' + os.getenv('ERROR_REPORT_WINDOW', default='300'))])
+    ERROR_REPORT_SAMPLES = max([1, int('0' + os.getenv('ERROR_REPORT_SAMPLES', default='5'))])
+    ERROR_REPORT_MAX_PER_HOUR = max([1, int('0' + os.getenv('ERROR_REPORT_MAX_PER_HOUR', default='10'))])
+
+    # the time taken by a sample of TRACE_SAMPLE_PERCENT % of the new or changed items to become searchable is traced (see tracing.py),
+    # Elasticsearch is polled every TRACE_POLL_INTERVAL_MS milliseconds for TRACE_VISIBILITY_TIMEOUT seconds at most
+    TRACE_SAMPLE_PERCENT = max([0, int('0' + os.getenv('TRACE_SAMPLE_PERCENT', default='10'))])
+    TRACE_POLL_INTERVAL_MS = max([1, int('0' + os.getenv('TRACE_POLL_INTERVAL_MS', default='500'))])
+    TRACE_VISIBILITY_TIMEOUT = max([1, int('0' + os.getenv('TRACE_VISIBILITY_TIMEOUT', default='120'))])
+
+    # an ingest session not closed after this delay (in seconds) is closed automatically
+    # so that an index is not left without refresh nor replicas when a crawl is abandoned
+    INGEST_SESSION_TIMEOUT = max([1, int('0' + os.getenv('INGEST_SESSION_TIMEOUT', default='7200'))])
+
 
 class QueueConfig(object):
     REDIS_URL = os.getenv('REDIS_URL', default='redis://localhost:6379/0')
 
+    # the transport of the items to be indexed:
+    # 'rq' enqueues one RQ job per call to /reps (or per batch of /reps/bulk)
+    # 'stream' appends the items to a Redis Stream per zone, read by the stream consumers (see stream_consumer.py)
+    INGEST_TRANSPORT = os.getenv('INGEST_TRANSPORT', default='rq')
+
+    # the consumer group of the streams
+    STREAM_GROUP = os.getenv('STREAM_GROUP', default='indexers')
+
+    # the number of consumers started by stream_consumer.py
+    STREAM_CONSUMERS = max([1, int('0' + os.getenv('STREAM_CONSUMERS', default='2'))])
+
+    # max number of items read per stream by a consumer in a single call
+    STREAM_BLOCK_SIZE = max([1, int('0' + os.getenv('STREAM_BLOCK_SIZE', default='100'))])
+
+    # max time a consumer waits for new items, in milliseconds
+    STREAM_BLOCK_MS = max([1, int('0' + os.getenv('STREAM_BLOCK_MS', default='5000'))])
+
+    # items not acknowledged after this delay (in milliseconds) are reclaimed by another consumer
+    STREAM_CLAIM_IDLE_MS = max([1, int('0' + os.getenv('STREAM_CLAIM_IDLE_MS', default='60000'))])
+
+    # items delivered this number of times without being acknowledged are moved to the dead letter stream of the zone
+    STREAM_MAX_DELIVERIES = max([1, int('0' + os.getenv('STREAM_MAX_DELIVERIES', default='5'))])
+
+    # the dead letter streams are capped to approximately this number of entries,
+    # the ingestion streams are not capped, their length being bounded by the backpressure (see INGEST_HIGH_WATERMARK)
+    STREAM_DEAD_MAXLEN = max([1, int('0' + os.getenv('STREAM_DEAD_MAXLEN', default='100000'))])
+
+    # backpressure: when the number of items waiting to be indexed reaches the high watermark,
+    # /reps answers 429 until it gets back under the low watermark
+    INGEST_HIGH_WATERMARK = max([1, int('0' + os.getenv('INGEST_HIGH_WATERMARK', default='10000'))])
+    INGEST_LOW_WATERMARK = max([0, int('0' + os.getenv('INGEST_LOW_WATERMARK', default='5000'))])
+
+    # the delay (in seconds) after which the crawlers are invited to send their items again
+    INGEST_RETRY_AFTER = max([1, int('0' + os.getenv('INGEST_RETRY_AFTER', default='30'))])
+
+    # an item received again with the same content within this delay (in seconds) is not indexed again,
+    # 0 disables the deduplication
+    INGEST_DEDUP_WINDOW = max([0, int('0' + os.getenv('INGEST_DEDUP_WINDOW', default='3600'))])
+
 
 # default configuration is DEV
 ES = ElasticsearchConfig
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bookkeeping of the crawls of the catalogs
+
+The spiders report the stats of each crawl when they close (see the OnClosePipeline of the crawlers),
+the last crawl and the last healthy crawl of each catalog are kept per zone in Redis.
+
+A crawl is healthy when it finished normally, scraped at least config.ENV.CRAWL_MIN_ITEMS items,
+and at least config.ENV.CRAWL_MIN_ITEMS_PERCENT % of the items of the previous healthy crawl,
+and when its items were delivered to the backend (the 'http_pipeline/delivered' stat of the HttpPipeline):
+a spider which could not post its items has not refreshed the dates of its ads.
+The cleanup only expires the ads of a catalog not seen since its last healthy crawl,
+so that the ads of a catalog are not deleted when its spider is broken
+"""
+
+import logging
+from datetime import datetime
+
+import ujson as json
+
+from redis_client import redis_conn
+import config
+
+
+LOGGER = logging.getLogger('app')
+
+
+def crawls_key(zone):
+    return f"crawls:{zone}"
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _parse_date(value):
+    """the datetime of an ISO formatted date sent by the spiders, None if it cannot be parsed"""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(str(value)[:26], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def is_healthy(crawl, previous=None):
+    """
+    True when the crawl finished normally, scraped enough items,
+    compared to the previous healthy crawl of the catalog, and delivered items to the backend
+    """
+    if crawl['finish_reason'] != 'finished' or crawl['start_time'] is None:
+        return False
+
+    if not crawl.get('delivered'):
+        return False
+
+    if crawl['items'] < config.ENV.CRAWL_MIN_ITEMS:
+        return False
+
+    if previous and crawl['items'] * 100 < previous['items'] * config.ENV.CRAWL_MIN_ITEMS_PERCENT:
+        return False
+
+    return True
+
+
+def record_crawl(catalog, zone, stats):
+    """
+    registers the crawl of the catalog in the zone from the stats of the spider,
+    returns the crawl registered
+
+    :Example:
+    >>> record_crawl('glv', 'mel', {'start_time': '2020-05-01T02:00:00', 'finish_time': '2020-05-01T03:00:00', 'finish_reason': 'finished', 'item_scraped_count': 1200, 'http_pipeline/delivered': 1195})
+    {'start_time': '2020-05-01T02:00:00', 'finish_time': '2020-05-01T03:00:00', 'finish_reason': 'finished', 'items': 1200, 'delivered': 1195, 'dropped': 0, 'errors': 0, 'healthy': True}
+    """
+    start_time = _parse_date(stats.get('start_time'))
+    finish_time = _parse_date(stats.get('finish_time'))
+    crawl = {
+        'start_time': start_time.isoformat() if start_time else None,
+        'finish_time': finish_time.isoformat() if finish_time else None,
+        'finish_reason': stats.get('finish_reason'),
+        'items': int(stats.get('item_scraped_count') or 0),
+        'delivered': int(stats.get('http_pipeline/delivered') or 0),
+        'dropped': int(stats.get('item_dropped_count') or 0),
+        'errors': int(stats.get('log_count/ERROR') or 0),
+    }
+
+    record = get_crawls(zone).get(catalog, {})
+    crawl['healthy'] = is_healthy(crawl, record.get('last_healthy_crawl'))
+
+    record['last_crawl'] = crawl
+    if crawl['healthy']:
+        record['last_healthy_crawl'] = crawl
+    else:
+        LOGGER.warning(f"Unhealthy crawl of catalog {catalog} in zone {zone}: {crawl}")
+
+    redis_conn.hset(crawls_key(zone), catalog, json.dumps(record))
+    return crawl
+
+
+def get_crawls(zone):
+    """
+    the last crawl and the last healthy crawl of each catalog of the zone
+
+    :Example:
+    >>> get_crawls('mel')
+    {'glv': {'last_crawl': {...}, 'last_healthy_crawl': {...}}}
+    """
+    return {
+        _decode(catalog): json.loads(record)
+        for catalog, record in redis_conn.hgetall(crawls_key(zone)).items()
+    }
+
+
+def healthy_since(zone):
+    """
+    the start date of the last healthy crawl of each catalog of the zone,
+    the catalogs without healthy crawl are not returned
+    """
+    result = {}
+    for catalog, record in get_crawls(zone).items():
+        healthy = record.get('last_healthy_crawl')
+        if healthy and healthy.get('start_time'):
+            result[catalog] = _parse_date(healthy['start_time']).date()
+    return result
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deduplication of the items received from the spiders
+
+Spiders often send the same ad several times within a crawl (when the ad is listed on several pages),
+the copies of an item received within config.Q.INGEST_DEDUP_WINDOW are dropped before being enqueued
+so that a single job indexes the item.
+
+An item is claimed when it is received (see claim), the claim is released when the item could not be enqueued
+or indexed (see release), so that the item is not dropped when the spider sends it again
+"""
+
+import logging
+
+from redis_client import redis_conn
+import config
+import utils
+
+
+LOGGER = logging.getLogger('app')
+
+_STATS_KEY = "ingestion:dedup"
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def dedup_key(product_dict, catalog=''):
+    """
+    the key identifying an item by its catalog, its sku and a hash of its content,
+    the catalog set on the item by the indexing is not part of the hash
+    """
+    return f"dedup:{catalog}:{product_dict.get('sku', '')}:{utils.content_hash(product_dict, exclude=['catalog'])}"
+
+
+def claim(products_list, catalog=''):
+    """
+    returns for each item of the list True if it was not received within config.Q.INGEST_DEDUP_WINDOW,
+    the number of items accepted and suppressed is counted per catalog (see stats)
+    """
+    pipe = redis_conn.pipeline()
+    if not queue_claim(pipe, products_list, catalog=catalog):
+        return claimed(products_list, [], catalog=catalog)
+    return claimed(products_list, pipe.execute(), catalog=catalog)
+
+
+def queue_claim(pipe, products_list, catalog=''):
+    """
+    queues the claim of the items on the pipeline, so that it is sent to Redis with other commands,
+    returns the number of commands queued, whose replies are passed to claimed()
+
+    the items are counted as accepted, the duplicates are counted again as suppressed by claimed()
+    """
+    if not config.Q.INGEST_DEDUP_WINDOW or not products_list:
+        return 0
+
+    for product_dict in products_list:
+        pipe.set(dedup_key(product_dict, catalog=catalog), 1, nx=True, ex=config.Q.INGEST_DEDUP_WINDOW)
+    pipe.hincrby(_STATS_KEY, f"{catalog}:accepted", len(products_list))
+    return len(products_list) + 1
+
+
+def claimed(products_list, replies, catalog=''):
+    """
+    returns for each item of the list True if it was not received within config.Q.INGEST_DEDUP_WINDOW,
+    from the replies of the commands queued by queue_claim(), all the items are new when no command was queued
+    """
+    if not replies:
+        return [True] * len(products_list or [])
+
+    is_new = [bool(new) for new in replies[:len(products_list)]]
+    suppressed = is_new.count(False)
+
+    if suppressed:
+        pipe = redis_conn.pipeline()
+        pipe.hincrby(_STATS_KEY, f"{catalog}:accepted", -suppressed)
+        pipe.hincrby(_STATS_KEY, f"{catalog}:suppressed", suppressed)
+        pipe.execute()
+        LOGGER.debug(f"{suppressed} duplicate items of catalog {catalog} suppressed")
+    return is_new
+
+
+def release(products_list, catalog=''):
+    """releases the claim of the items, which were not enqueued or not indexed"""
+    keys = [dedup_key(product_dict, catalog=catalog) for product_dict in products_list if isinstance(product_dict, dict)]
+    if config.Q.INGEST_DEDUP_WINDOW and keys:
+        redis_conn.delete(*keys)
+        LOGGER.debug(f"{len(keys)} items of catalog {catalog} released")
+
+
+def stats():
+    """
+    the number of items accepted and suppressed per catalog
+
+    :Example:
+    >>> stats()
+    {'glv': {'accepted': 1200, 'suppressed': 300}}
+    """
+    result = {}
+    for field, value in redis_conn.hgetall(_STATS_KEY).items():
+        catalog, _, counter = _decode(field).rpartition(':')
+        result.setdefault(catalog, {'accepted': 0, 'suppressed': 0})[counter] = int(value)
+    return result
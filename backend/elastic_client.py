@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process-wide registry of Elasticsearch clients
+
+Creating an Elasticsearch client for each operation opens a new TCP connection each time,
+the registry keeps one client per (hosts, options) so that the keep-alive connections
+of its pool are reused between operations
+
+This module is copied as-is in the backend (backend/elastic_client.py) and in the web (web/services/elastic_client.py),
+each image being built from its own directory: a change must be made in both copies,
+the tests of the backend fail when they differ
+"""
+
+import os
+import asyncio
+import logging
+from threading import Lock
+
+from elasticsearch import Elasticsearch
+from elasticsearch_async import AsyncElasticsearch
+
+import config
+
+
+LOGGER = logging.getLogger('app')
+
+
+def _split_hosts(hosts):
+    """hosts may be a string or a list of strings, each string being possibly a comma separated list of hosts"""
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    return [h.strip() for host in hosts for h in host.split(',') if h.strip()]
+
+
+class ElasticClientRegistry():
+    """
+    Keeps one Elasticsearch client per (hosts, options) and per process.
+
+    The registry is reset when the process id changes, i.e. in a process forked after clients have been created
+    (gunicorn --preload, rq work horses), the sockets of the parent process must not be shared with its children
+
+    :Example:
+    >>> client = ElasticClientRegistry.get_client([config.ES.ES_HOST])
+    >>> client is ElasticClientRegistry.get_client([config.ES.ES_HOST])
+    True
+    """
+
+    _clients = {}
+    _async_clients = {}
+    _pid = os.getpid()
+    _lock = Lock()
+
+
+    @staticmethod
+    def default_options():
+        """the client options set in the configuration"""
+        options = {
+            'maxsize': config.ES.ES_POOL_MAXSIZE,
+            'timeout': config.ES.ES_TIMEOUT,
+            'http_compress': config.ES.ES_HTTP_COMPRESS,
+        }
+        if config.ES.ES_SNIFF:
+            options.update({
+                'sniff_on_start': True,
+                'sniff_on_connection_fail': True,
+                'sniffer_timeout': config.ES.ES_SNIFFER_TIMEOUT,
+            })
+        return options
+
+
+    @classmethod
+    def _check_pid(cls):
+        """drops the clients inherited from the parent process after a fork"""
+        pid = os.getpid()
+        if pid != cls._pid:
+            LOGGER.debug(f"Process forked ({cls._pid} -> {pid}), resetting the Elasticsearch clients")
+            cls._clients = {}
+            cls._async_clients = {}
+            cls._pid = pid
+            cls._lock = Lock()
+
+
+    @classmethod
+    def get_client(cls, hosts, **options):
+        """
+        returns the client of the process for the given hosts and options,
+        options override the default options of the configuration
+
+        :param hosts: a host or a list of hosts, each one possibly being a comma separated list of hosts
+        """
+        hosts = tuple(_split_hosts(hosts))
+        options = dict(cls.default_options(), **options)
+        key = (hosts, tuple(sorted(options.items())))
+
+        cls._check_pid()
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = Elasticsearch(hosts=list(hosts), **options)
+                cls._clients[key] = client
+                LOGGER.debug(f"Created an Elasticsearch client for {hosts} with options {options}")
+            return client
+
+
+    @classmethod
+    def get_async_client(cls, hosts, loop=None, **options):
+        """
+        asyncio counterpart of get_client(), the client is bound to the event loop passed
+        (the current event loop by default), thus one client is kept per event loop
+
+        :param hosts: a host or a list of hosts, each one possibly being a comma separated list of hosts
+        :param loop: optional event loop
+        """
+        loop = loop or asyncio.get_event_loop()
+        hosts = tuple(_split_hosts(hosts))
+        options = dict(cls.default_options(), **options)
+        key = (hosts, tuple(sorted(options.items())), id(loop))
+
+        cls._check_pid()
+        with cls._lock:
+            client = cls._async_clients.get(key)
+            if client is None:
+                client = AsyncElasticsearch(hosts=list(hosts), loop=loop, **options)
+                cls._async_clients[key] = client
+                LOGGER.debug(f"Created an async Elasticsearch client for {hosts} with options {options}")
+            return client
+
+
+    @classmethod
+    async def close_async_clients(cls, loop=None):
+        """closes the async clients bound to the event loop passed (the current event loop by default)"""
+        loop = loop or asyncio.get_event_loop()
+        with cls._lock:
+            keys = [key for key in cls._async_clients.keys() if key[2] == id(loop)]
+            clients = [cls._async_clients.pop(key) for key in keys]
+        for client in clients:
+            await client.transport.close()
+
+
+    @classmethod
+    def stats(cls):
+        """
+        returns the state of the connections pools of the process
+
+        :Example:
+        >>> ElasticClientRegistry.stats()
+        {
+            'pid': 12,
+            'clients': [{
+                'hosts': ['http://localhost:9200'],
+                'options': {...},
+                'dead': 0,
+                'connections': [{'host': 'http://localhost:9200', 'opened': 2, 'requests': 153, 'idle': 2}]
+            }],
+            'async_clients': 1
+        }
+        """
+        cls._check_pid()
+        clients = []
+        with cls._lock:
+            for (hosts, options), client in cls._clients.items():
+                connection_pool = client.transport.connection_pool
+                connections = []
+                for connection in connection_pool.connections:
+                    # urllib3 pool of the connection
+                    http_pool = getattr(connection, 'pool', None)
+                    connections.append({
+                        'host': connection.host,
+                        'opened': getattr(http_pool, 'num_connections', None),
+                        'requests': getattr(http_pool, 'num_requests', None),
+                        'idle': http_pool.pool.qsize() if http_pool is not None and http_pool.pool is not None else None,
+                    })
+                clients.append({
+                    'hosts': list(hosts),
+                    'options': dict(options),
+                    'dead': len(getattr(connection_pool, 'dead_count', {})),
+                    'connections': connections
+                })
+
+        return {
+            'pid': cls._pid,
+            'clients': clients,
+            'async_clients': len(cls._async_clients)
+        }
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Aggregation of the validation errors of the items received from the spiders
+
+A broken spider sends thousands of invalid items in a few minutes, reporting each one of them would flood Sentry:
+the invalid items are grouped in Redis by catalog and by error signature, a group counts its items
+and keeps a few samples. The groups are flushed every config.ENV.ERROR_REPORT_WINDOW seconds
+(see jobs.alerting_task.do_flush_errors), one summary being sent per group.
+
+No more than config.ENV.ERROR_REPORT_MAX_PER_HOUR summaries are sent per catalog and per hour,
+the groups over this cap keep aggregating until the next hour
+"""
+
+import time
+import hashlib
+import logging
+
+import ujson as json
+
+from redis_client import redis_conn
+import config
+
+
+LOGGER = logging.getLogger('app')
+
+# the set of the groups not flushed yet
+_GROUPS_KEY = "errors:groups"
+
+
+def group_key(catalog, signature):
+    return f"errors:{catalog}:{signature}"
+
+
+def _samples_key(key):
+    return f"{key}:samples"
+
+
+def _sent_key(catalog, hour):
+    return f"errors:sent:{catalog}:{hour}"
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def make_signature(parts):
+    """a short hash of the parts describing an error, whatever their order"""
+    return hashlib.sha1('|'.join(sorted(set(parts))).encode('utf-8')).hexdigest()[:12]
+
+
+def record(items, catalog='', errors=[], signature=None):
+    """
+    adds the invalid items to the group of their catalog and of their signature,
+    the signature is computed from the errors when not passed. Returns the key of the group
+
+    :Example:
+    >>> record([item], catalog='glv', errors=["'price' is a required property"])
+    'errors:glv:6b1d2c8e0f3a'
+    """
+    signature = signature or make_signature(errors)
+    key = group_key(catalog, signature)
+    samples_key = _samples_key(key)
+    now = int(time.time())
+
+    pipe = redis_conn.pipeline()
+    pipe.sadd(_GROUPS_KEY, key)
+    pipe.hsetnx(key, 'catalog', catalog)
+    pipe.hsetnx(key, 'signature', signature)
+    pipe.hsetnx(key, 'errors', json.dumps(sorted(set(errors))))
+    pipe.hsetnx(key, 'first_seen', now)
+    pipe.hset(key, 'last_seen', now)
+    pipe.hincrby(key, 'count', len(items))
+    for item in items[:config.ENV.ERROR_REPORT_SAMPLES]:
+        pipe.rpush(samples_key, json.dumps(item))
+    pipe.ltrim(samples_key, 0, config.ENV.ERROR_REPORT_SAMPLES - 1)
+    pipe.execute()
+
+    return key
+
+
+def groups():
+    """the keys of the groups not flushed yet"""
+    return sorted([_decode(k) for k in redis_conn.smembers(_GROUPS_KEY)])
+
+
+def take(key):
+    """
+    reads and deletes the group in a single transaction, so that the items recorded meanwhile go to a new group,
+    returns the summary of the group, None if the group does not exist anymore
+    """
+    pipe = redis_conn.pipeline()
+    pipe.hgetall(key)
+    pipe.lrange(_samples_key(key), 0, -1)
+    pipe.delete(key, _samples_key(key))
+    pipe.srem(_GROUPS_KEY, key)
+    fields, samples, _, _ = pipe.execute()
+
+    if not fields:
+        return None
+
+    fields = {_decode(k): _decode(v) for k, v in fields.items()}
+    return {
+        'catalog': fields.get('catalog', ''),
+        'signature': fields.get('signature', ''),
+        'errors': json.loads(fields.get('errors', '[]')),
+        'count': int(fields.get('count', 0)),
+        'first_seen': int(fields.get('first_seen', 0)),
+        'last_seen': int(fields.get('last_seen', 0)),
+        'samples': [json.loads(s) for s in samples]
+    }
+
+
+def flush(send, now=None):
+    """
+    passes the summary of each group to the function send, and deletes the group,
+    unless config.ENV.ERROR_REPORT_MAX_PER_HOUR summaries have already been sent for the catalog this hour
+
+    returns the number of summaries sent and the number of groups held until the next hour
+    """
+    hour = int((now or time.time()) // 3600)
+    sent = 0
+    held = 0
+
+    for key in groups():
+        catalog = _decode(redis_conn.hget(key, 'catalog') or '')
+        sent_key = _sent_key(catalog, hour)
+
+        # the count is reserved before sending, so that concurrent flushes cannot exceed the cap
+        pipe = redis_conn.pipeline()
+        pipe.incr(sent_key)
+        pipe.expire(sent_key, 3600)
+        count, _ = pipe.execute()
+
+        if count > config.ENV.ERROR_REPORT_MAX_PER_HOUR:
+            held += 1
+            continue
+
+        summary = take(key)
+        if summary is None:
+            redis_conn.decr(sent_key)
+            continue
+
+        send(summary)
+        sent += 1
+
+    if held:
+        LOGGER.warning(f"{held} groups of errors held until the next hour, too many reports sent")
+
+    return {'sent': sent, 'held': held}
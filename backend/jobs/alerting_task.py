@@ -1,34 +1,41 @@
 import logging
-import ujson as json
 
 import sentry_sdk
 from sentry_sdk import configure_scope
 
 import config
-import utils
 import settings
+import error_reports
+import utils
 
 
 LOGGER = logging.getLogger("app")
 
 
 def do_send_to_sentry(items, catalog, errors):
-    """each item in the list of items is enriched with the catalog info, then
-    the items are sent to sentry to keep track of errors
     """
-    if utils.is_list(items):
-        send_it = {
-            "catalog": catalog,
-            "items": items,
-            "errors": errors
-        }
-        with configure_scope() as scope:
-            # setting a tag "spider" enables in sentry to retrieve issues coming from spiders
-            scope.set_tag("origin", "spider")
-            scope.set_tag("catalog", catalog)
-            sentry_sdk.capture_message(json.dumps(send_it))
-        LOGGER.info(f"{len(items)} items sent to sentry on catalog {catalog}")
-    else:
-        LOGGER.error(f"Items passed are not a valid list")
-
-    return True
+    records the invalid items in the error reports (see error_reports.py), they are sent to sentry by do_flush_errors.
+
+    Kept for the jobs enqueued by the previous releases, the errors are not reported by jobs anymore,
+    to be removed once the queues do not hold such jobs
+    """
+    return error_reports.record(items if utils.is_list(items) else [], catalog=catalog, errors=errors)
+
+
+def _send_summary(summary):
+    """sends the summary of a group of errors to sentry, the issues are grouped by catalog and by signature"""
+    with configure_scope() as scope:
+        scope.set_tag("origin", "spider")
+        scope.set_tag("catalog", summary['catalog'])
+        scope.set_extra("summary", summary)
+        scope.fingerprint = ["spider", summary['catalog'], summary['signature']]
+        sentry_sdk.capture_message(
+            f"{summary['count']} invalid items received on catalog {summary['catalog']}: {'; '.join(summary['errors'])}"
+        )
+
+
+def do_flush_errors():
+    """sends a summary of each group of validation errors recorded since the last flush (see error_reports.py)"""
+    result = error_reports.flush(_send_summary)
+    LOGGER.info(f"Errors flushed: {result}")
+    return result
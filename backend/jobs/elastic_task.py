@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
 import math
+import time
 import numbers
-from datetime import datetime
+from datetime import datetime, date
+from multiprocessing import Pool
 import logging
 
-from search_index import ElasticCommand, IndexError
-from nlp import FeaturesExtractor
+from rq import Queue, get_current_job
+import ujson as json
+
+from search_index import ElasticCommand, IndexError, SearchError, is_partitioned, is_conflict, catalog_routing
+from nlp import FeaturesExtractor, ATTRIBUTE_FIELDS
+from redis_client import redis_conn
+from metrics import JOB_DURATION, DOCUMENTS_INDEXED, CLEANUP_DELETED
+import crawls
+import tracing
+import dedup
 
 import config
 import utils
@@ -15,13 +25,98 @@ import settings
 
 LOGGER = logging.getLogger("app")
 
+# the background jobs launched by the jobs: the cleanup of each zone on the low queue,
+# the checks of the visibility of the traces on their own queue, so that they never delay the other jobs
+_low_q = Queue("low", connection=redis_conn)
+_traces_q = Queue("traces", connection=redis_conn)
+
+# fields which are not part of the content sent by the spiders,
+# they are not taken into account in the fingerprint of a product
+_FINGERPRINT_EXCLUDED_FIELDS = [
+    'catalog', 'features', 'quality_index', 'is_new',
+    'scraping_start_date', 'scraping_end_date', 'content_hash'
+]
+
+
+def quality_index(doc):
+    """Computes an index to promote data with good quality
+    """
+    standard_fields = ['title', 'description']
+    # high_value_fields = ['area', 'media', 'features']
+    qi = 0
+
+    for f in standard_fields:
+        # for string, check it's not blank
+        if f in doc and doc[f] and isinstance(doc[f], str) and doc[f].strip():
+            qi += 1
+
+    if 'area' in doc and doc['area'] and doc['area']>0:
+        qi += 2
+
+    if 'media' in doc and doc['media'] and utils.is_list(doc['media']) and len(doc['media'])>=3:
+        qi += 2
+
+    if 'features' in doc and doc['features'] and utils.is_list(doc['features']):
+        qi += 2
+
+    return qi
+
+
+def enrich(products):
+    """computes the attributes derived from the content of the products, in batch"""
+
+    # identify features
+    described = [p for p in products if 'description' in p]
+    for product_dict, features in zip(described, FeaturesExtractor.extract_many([p['description'] for p in described])):
+        product_dict['features'] = features
+
+    # typed attributes (bedrooms, rooms...), the values sent by the spider are kept
+    texts = [' '.join([p.get('title') or '', p.get('description') or '']) for p in products]
+    for product_dict, attributes in zip(products, FeaturesExtractor.extract_attributes_many(texts)):
+        for attribute, value in attributes.items():
+            product_dict.setdefault(attribute, value)
+
+    # quality index
+    for product_dict in products:
+        product_dict['quality_index'] = quality_index(product_dict)
+
+
+# the last cleanup of each zone, see cleanup_stats
+_CLEANUP_KEY = "cleanup:zones"
+
+
+
+def cleanup_stats():
+    """
+    the last cleanup of each zone, in progress or completed
+
+    :Example:
+    >>> cleanup_stats()
+    {
+        'mel': {
+            'status': 'completed', 'started_at': '...', 'finished_at': '...', 'duration': 120,
+            'deleted': 1500, 'throttled_millis': 0, 'skipped': ['broken_spider'],
+            'catalogs': {'glv': {'completed': True, 'total': 1500, 'deleted': 1500, ...}}
+        }
+    }
+    """
+    return {
+        zone.decode('utf-8') if isinstance(zone, bytes) else zone: json.loads(run)
+        for zone, run in redis_conn.hgetall(_CLEANUP_KEY).items()
+    }
+
+
+def _save_cleanup(zone, run):
+    redis_conn.hset(_CLEANUP_KEY, zone, json.dumps(run))
+
 
 def do_cleanup(zones_list, max_days):
     """
     fetches real estate ads of the given zones list and deletes the ones where scraping_end_date-now() > max_days
     this enables to maintain an index without obsolete ads
 
-    Items without scraping_end_date are deleted automatically
+    One job is enqueued per zone (see do_cleanup_zone), so that the cleanup of a large zone does not delay the other ones,
+    returns the id of the job of each zone
     """
     LOGGER.info(f"*** Cleanup task triggered for zones_list={zones_list}, max_days={max_days}")
 
@@ -35,14 +130,407 @@ def do_cleanup(zones_list, max_days):
 
     result = {}
     for _zone in zones_list:
-        res = ElasticCommand.delete_date_range(_zone, "scraping_end_date", max_days)
-        LOGGER.info(f"Cleanup task deleted {res} documents on zone {_zone}")
-        result[_zone] = res
+        job = _low_q.enqueue(
+            'jobs.elastic_task.do_cleanup_zone',
+            _zone,
+            max_days,
+            job_timeout=config.ENV.CLEANUP_TIMEOUT
+        )
+        result[_zone] = job.id
 
     return result
 
 
-def do_index(products_list, catalog, zone):
+def do_cleanup_zone(zone, max_days):
+    """
+    deletes the obsolete ads of the zone
+
+    The ads of a catalog are only deleted when they have not been seen by the last healthy crawl of the catalog (see crawls.py),
+    the catalogs without healthy crawl are left untouched, so that a broken spider does not cause the deletion of its whole catalog.
+    A zone where no crawl has been reported at all is cleaned up on the dates only, the ads not seen for max_days being deleted.
+    The deletions are run as Elasticsearch tasks, config.ENV.CLEANUP_WORKERS catalogs at most at the same time,
+    their progress is polled and recorded (see cleanup_stats)
+
+    The partitions of a partitioned zone hold the ads of all its catalogs, they are dropped once
+    all the catalogs of the zone have been crawled successfully since their period
+
+    Returns the number of ads deleted in the zone, and per catalog
+    """
+    started = time.time()
+    crawled = crawls.get_crawls(zone)
+    healthy_since = crawls.healthy_since(zone)
+    unhealthy = sorted(set(crawled) - set(healthy_since))
+    if unhealthy:
+        LOGGER.warning(f"No healthy crawl of catalogs {unhealthy} in zone {zone}, their ads are kept")
+
+    run = {
+        'status': 'running',
+        'started_at': datetime.utcnow().isoformat(),
+        'finished_at': None,
+        'duration': None,
+        'deleted': 0,
+        'throttled_millis': 0,
+        'skipped': unhealthy,
+        'catalogs': {}
+    }
+    _save_cleanup(zone, run)
+
+    try:
+        if not crawled:
+            LOGGER.warning(f"No crawl reported in zone {zone}, the ads not seen for {max_days} days are deleted")
+            if is_partitioned(zone):
+                run['deleted'] = ElasticCommand.drop_expired_partitions(zone, max_days)
+            else:
+                run['deleted'] = ElasticCommand.delete_date_range(zone, "scraping_end_date", max_days)
+
+        elif not healthy_since:
+            LOGGER.warning(f"No healthy crawl reported in zone {zone}, no cleanup performed")
+
+        elif is_partitioned(zone):
+            # the partitions overlapping the oldest healthy crawl are kept
+            oldest = min(healthy_since.values())
+            run['deleted'] = ElasticCommand.drop_expired_partitions(zone, max([max_days, (date.today() - oldest).days + 1]))
+
+        else:
+            pending = sorted(healthy_since.items())
+            running = {}
+            while pending or running:
+                while pending and len(running) < config.ENV.CLEANUP_WORKERS:
+                    catalog, since = pending.pop(0)
+                    try:
+                        running[catalog] = ElasticCommand.start_delete_date_range(zone, "scraping_end_date", max_days, catalog=catalog, before=since)
+                    except SearchError as e:
+                        LOGGER.error(f"Cleanup of catalog {catalog} in zone {zone} failed: {e}")
+                        run['catalogs'][catalog] = {'completed': True, 'error': str(e)}
+
+                for catalog, task_id in list(running.items()):
+                    status = ElasticCommand.task_status(zone, task_id)
+                    run['catalogs'][catalog] = status
+                    if status['completed']:
+                        del running[catalog]
+                        if status['error']:
+                            LOGGER.error(f"Cleanup of catalog {catalog} in zone {zone} failed: {status['error']}")
+
+                run['deleted'] = sum([c.get('deleted', 0) for c in run['catalogs'].values()])
+                run['throttled_millis'] = sum([c.get('throttled_millis', 0) for c in run['catalogs'].values()])
+                run['duration'] = round(time.time() - started, 1)
+                _save_cleanup(zone, run)
+
+                if running:
+                    time.sleep(config.ES.ES_TASK_POLL_INTERVAL)
+
+        run['status'] = 'completed'
+
+    except SearchError as e:
+        LOGGER.error(f"Cleanup of zone {zone} failed: {e}")
+        run['status'] = 'failed'
+        raise
+
+    finally:
+        run['finished_at'] = datetime.utcnow().isoformat()
+        run['duration'] = round(time.time() - started, 1)
+        _save_cleanup(zone, run)
+        JOB_DURATION.observe(time.time() - started, job='do_cleanup_zone')
+        CLEANUP_DELETED.inc(run['deleted'], zone=zone)
+
+    LOGGER.info(f"Cleanup task deleted {run['deleted']} documents on zone {zone} in {run['duration']}s")
+    return {
+        'deleted': run['deleted'],
+        'catalogs': {catalog: c.get('deleted', 0) for catalog, c in run['catalogs'].items()},
+        'skipped': unhealthy
+    }
+
+
+def do_reindex(zone, keep_previous=False):
+    """
+    copies the zone documents into a new version of its index, built with the current settings and mapping,
+    the zone alias is swapped to the new version once the copy is completed
+    """
+    LOGGER.info(f"*** Reindex task triggered for zone {zone}")
+    new_index = ElasticCommand.reindex(zone, keep_previous=keep_previous)
+    LOGGER.info(f"Zone {zone} now served by {new_index}")
+    return new_index
+
+
+# the fields read by the backfill job to recompute the derived attributes
+# the catalog gives the routing of the documents of a routed zone
+_BACKFILL_SOURCE_FIELDS = ['title', 'description', 'area', 'media', 'catalog']
+
+
+def backfill_checkpoint_key(zone):
+    return f"backfill:{zone}"
+
+
+def _backfill_batch(hits):
+    """
+    recomputes the derived attributes of a batch of documents [(id, index, _source)],
+    returns the partial updates by index {index: {id: partial_doc}}
+
+    run in the processes of the backfill pool
+    """
+    docs = [dict(source) for _, _, source in hits]
+    enrich(docs)
+
+    updates = {}
+    for (doc_id, index, _), doc in zip(hits, docs):
+        # attributes not found anymore are reset
+        updates.setdefault(index, {})[doc_id] = {
+            field: doc.get(field) for field in ['features', 'quality_index'] + ATTRIBUTE_FIELDS
+        }
+    return updates
+
+
+def _backfill_write(zone, hits, pool, processes):
+    """
+    enriches the documents [(id, index, _source, _version)] and writes back their partial updates,
+    each one only if the document was not changed since it was read.
+    Returns the documents in conflict and the number of documents which could not be updated
+    """
+    if not hits:
+        return [], 0
+
+    if pool:
+        batches = pool.map(_backfill_batch, list(utils.chunks([hit[:3] for hit in hits], math.ceil(len(hits) / processes))))
+    else:
+        batches = [_backfill_batch([hit[:3] for hit in hits])]
+
+    # one bulk request per index
+    updates = {}
+    for batch in batches:
+        for index, index_updates in batch.items():
+            updates.setdefault(index, {}).update(index_updates)
+
+    versions = {doc_id: version for doc_id, _, _, version in hits}
+    routings = {doc_id: catalog_routing(zone, source.get('catalog')) for doc_id, _, source, _ in hits}
+
+    conflicts = set()
+    errors = 0
+    for index, index_updates in updates.items():
+        failures = ElasticCommand.bulk_save(zone, {}, index=index, updates=index_updates, versions=versions, routings=routings)
+        for doc_id, error in failures.items():
+            if is_conflict(error):
+                conflicts.add(doc_id)
+            else:
+                LOGGER.error(f"Unable to backfill {doc_id}: {error}")
+                errors += 1
+
+    return [hit for hit in hits if hit[0] in conflicts], errors
+
+
+def _backfill_read(zone, hits):
+    """
+    reads again the documents [(id, index, _source, _version)] changed meanwhile, with their new version,
+    the documents deleted meanwhile are left out
+    """
+    by_routing = {}
+    for doc_id, index, source, _ in hits:
+        by_routing.setdefault(catalog_routing(zone, source.get('catalog')), []).append((doc_id, index))
+
+    read = []
+    for routing, ids in by_routing.items():
+        found = ElasticCommand.mget(zone, [doc_id for doc_id, _ in ids], source_fields=_BACKFILL_SOURCE_FIELDS, with_version=True, routing=routing)
+        read.extend([(doc_id, index, found[doc_id][1], found[doc_id][0]) for doc_id, index in ids if doc_id in found])
+    return read
+
+
+def do_backfill(zone, resume=False):
+    """
+    recomputes the features, the typed attributes and the quality index of all the documents of the zone,
+    to be run after a change of the extraction or of the scoring, only new or changed ads being enriched by do_index
+
+    the documents are read by pages sorted by _id, enriched by a pool of config.ENV.BACKFILL_PROCESSES processes,
+    and written back with partial updates at config.ENV.BACKFILL_RATE documents per second at most.
+    A document is only updated if it was not changed since it was read, the documents changed meanwhile
+    (by do_index) are read again and updated again, config.ES.ES_CONFLICT_RETRIES times at most.
+    The last _id written is checkpointed in redis and in the meta of the job, so that an interrupted backfill
+    can be resumed (resume=True)
+    """
+    LOGGER.info(f"*** Backfill task triggered for zone {zone}, resume={resume}")
+
+    key = backfill_checkpoint_key(zone)
+    checkpoint = {'after': None, 'processed': 0, 'errors': 0}
+    if resume and redis_conn.get(key):
+        checkpoint.update(json.loads(redis_conn.get(key)))
+        LOGGER.info(f"Backfill of zone {zone} resumed after {checkpoint['after']}")
+
+    job = get_current_job()
+    processes = config.ENV.BACKFILL_PROCESSES
+    pool = Pool(processes) if processes > 1 else None
+
+    try:
+        while True:
+            started = time.time()
+
+            page = ElasticCommand.scan_page(
+                zone,
+                after=checkpoint['after'],
+                size=config.ENV.BACKFILL_BATCH_SIZE,
+                source_fields=_BACKFILL_SOURCE_FIELDS,
+                with_version=True
+            )
+            if not page:
+                break
+
+            hits, errors = _backfill_write(zone, page, pool, processes)
+            checkpoint['errors'] += errors
+
+            # the documents in conflict are read again and updated again right away
+            for attempt in range(config.ES.ES_CONFLICT_RETRIES):
+                if not hits:
+                    break
+                hits, errors = _backfill_write(zone, _backfill_read(zone, hits), pool, processes)
+                checkpoint['errors'] += errors
+
+            if hits:
+                LOGGER.error(f"Unable to backfill {len(hits)} documents of zone {zone}, too many conflicts")
+                checkpoint['errors'] += len(hits)
+
+            checkpoint['after'] = page[-1][0]
+            checkpoint['processed'] += len(page)
+            redis_conn.set(key, json.dumps(checkpoint))
+            if job is not None:
+                job.meta['backfill'] = checkpoint
+                job.save_meta()
+
+            # rate limit
+            delay = len(page) / config.ENV.BACKFILL_RATE - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        # completed, the next backfill starts from the beginning
+        redis_conn.delete(key)
+        LOGGER.info(f"Backfill of zone {zone} completed: {checkpoint}")
+
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return checkpoint
+
+
+def ingest_session_key(zone):
+    """the key of the ingest session of the zone, see the ingest sessions in tasks.py"""
+    return f"ingest_session:{zone}"
+
+
+def is_ingest_session_open(zone):
+    return bool(zone) and redis_conn.exists(ingest_session_key(zone)) > 0
+
+
+def do_end_ingest_session(zone, previous, force_merge=False):
+    """
+    restores the settings of the zone index, changed at the beginning of the ingest session,
+    called when the session is closed or when it times out
+    """
+    LOGGER.info(f"*** End of ingest session on zone {zone}, force_merge={force_merge}")
+    ElasticCommand.end_ingest(zone, previous, force_merge=force_merge)
+    return previous
+
+
+def _traces_key(zone):
+    """the traces of the zone waiting to be searchable, by doc id"""
+    return f"traces:{zone}"
+
+
+def _traces_checker_key(zone):
+    """set while a job checks the traces of the zone"""
+    return f"traces:checker:{zone}"
+
+
+def _claim_traces_checker(zone):
+    """
+    reserves the check of the traces of the zone, returns False if a job already checks them
+
+    the reservation expires if the job dies, so that the traces of the zone are checked again by the next batch
+    """
+    return bool(redis_conn.set(_traces_checker_key(zone), 1, nx=True, ex=config.ENV.TRACE_VISIBILITY_TIMEOUT * 2))
+
+
+def _trace_visibility(catalog, zone, written_traces, force_refresh):
+    """
+    observes the refresh stage of the traces of the products written:
+    when the index is refreshed by the write, the products are visible right away,
+    otherwise a sample of them is checked in background by do_trace_visibility, one job per zone.
+    The products written during an ingest session are not checked, the index is only refreshed at the end of the session
+    """
+    if force_refresh:
+        for trace in written_traces:
+            tracing.observe(catalog, 'refresh', trace['indexed_at'], trace['indexed_at'])
+            tracing.observe(catalog, 'total', trace['scraped_at'], trace['indexed_at'])
+        return
+
+    sampled = [trace for trace in written_traces if tracing.is_sampled(trace)]
+    if not sampled or is_ingest_session_open(zone):
+        return
+
+    pipe = redis_conn.pipeline()
+    for trace in sampled:
+        pipe.hset(_traces_key(zone), trace['doc_id'], json.dumps(dict(trace, catalog=catalog)))
+    pipe.execute()
+    if _claim_traces_checker(zone):
+        _traces_q.enqueue('jobs.elastic_task.do_trace_visibility', zone, job_timeout=config.ENV.TRACE_VISIBILITY_TIMEOUT * 2)
+
+
+def do_trace_visibility(zone):
+    """
+    checks the traces of the zone every config.ENV.TRACE_POLL_INTERVAL_MS milliseconds, with a single search of their doc ids,
+    until the products are returned with the content written, and observes the duration of their refresh and of their whole ingestion.
+    The products not visible config.ENV.TRACE_VISIBILITY_TIMEOUT seconds after their indexing are ignored
+
+    The job stops after config.ENV.TRACE_VISIBILITY_TIMEOUT seconds, and is enqueued again if traces are still pending,
+    so that the traces of the other zones are checked in the meantime
+
+    returns the number of products visible
+    """
+    key = _traces_key(zone)
+    deadline = time.time() + config.ENV.TRACE_VISIBILITY_TIMEOUT
+    visible = 0
+
+    try:
+        while time.time() < deadline:
+            pending = {
+                doc_id.decode('utf-8') if isinstance(doc_id, bytes) else doc_id: json.loads(trace)
+                for doc_id, trace in redis_conn.hgetall(key).items()
+            }
+            if not pending:
+                break
+
+            try:
+                found = ElasticCommand.search_ids(zone, list(pending.keys()), source_fields=['content_hash'])
+            except SearchError:
+                # the traces are dropped once they time out
+                LOGGER.warning(f"Unable to check the traces of zone {zone}", exc_info=True)
+                found = {}
+            visible_at = time.time()
+            done = []
+            for doc_id, trace in pending.items():
+                source = found.get(doc_id)
+                if source is not None and source.get('content_hash') == trace['content_hash']:
+                    tracing.observe(trace['catalog'], 'refresh', trace['indexed_at'], visible_at)
+                    tracing.observe(trace['catalog'], 'total', trace['scraped_at'], visible_at)
+                    LOGGER.debug(f"Trace {trace['id']}: {doc_id} searchable {visible_at - trace['indexed_at']:.2f}s after its indexing")
+                    visible += 1
+                    done.append(doc_id)
+                elif visible_at - trace['indexed_at'] > config.ENV.TRACE_VISIBILITY_TIMEOUT:
+                    LOGGER.warning(f"Trace {trace['id']}: {doc_id} of zone {zone} not searchable after {config.ENV.TRACE_VISIBILITY_TIMEOUT}s")
+                    done.append(doc_id)
+
+            if done:
+                redis_conn.hdel(key, *done)
+            if len(done) < len(pending):
+                time.sleep(config.ENV.TRACE_POLL_INTERVAL_MS / 1000)
+
+    finally:
+        redis_conn.delete(_traces_checker_key(zone))
+        # the traces written meanwhile would not be checked until the next batch
+        if redis_conn.exists(key) and _claim_traces_checker(zone):
+            _traces_q.enqueue('jobs.elastic_task.do_trace_visibility', zone, job_timeout=config.ENV.TRACE_VISIBILITY_TIMEOUT * 2)
+
+    return visible
+
+
+def do_index(products_list, catalog, zone, force_refresh=None, traces=None, failures=None):
     """
     performs async indexation of real estate properties.
 
@@ -50,6 +538,15 @@ def do_index(products_list, catalog, zone):
     so that a max of data is scraped and users can fix data issues later.
 
     'zone' is required, because it is used to define the index name in elastic
+
+    force_refresh defaults to config.ENV.FORCE_REFRESH,
+    it is False while an ingest session is open on the zone
+
+    traces is an optional list of the traces of the products (see tracing.py), in the same order as the products,
+    the duration of the stages of the ingestion of the traced products is observed
+
+    failures is an optional list, the positions in products_list of the products not indexed are appended to it,
+    the claims of these products are released (see dedup.py)
     """
 
     class TaskResult:
@@ -57,6 +554,8 @@ def do_index(products_list, catalog, zone):
         def __init__(self):
             self.created = 0
             self.updated = 0
+            self.unchanged = 0
+            self.changed = 0
             self.errors = 0
 
         def increment_errors(self, value):
@@ -65,40 +564,36 @@ def do_index(products_list, catalog, zone):
         def increment_created(self, value):
             self.created += value
 
-        def increment_updated(self, value):
+        def increment_updated(self, value, changed=True):
+            """updated documents are either changed (rewritten) or unchanged (only their dates are updated)"""
             self.updated += value
+            if changed:
+                self.changed += value
+            else:
+                self.unchanged += value
 
         def values(self):
             return {
                 'created': self.created,
                 'updated': self.updated,
+                'unchanged': self.unchanged,
+                'changed': self.changed,
                 'errors': self.errors
             }
 
-    def quality_index(doc):
-        """Computes an index to promote data with good quality
-        """
-        standard_fields = ['title', 'description']
-        # high_value_fields = ['area', 'media', 'features']
-        qi = 0
-
-        for f in standard_fields:
-            # for string, check it's not blank
-            if f in doc and doc[f] and isinstance(doc[f], str) and doc[f].strip():
-                qi += 1
-
-        if 'area' in doc and doc['area']>0:
-            qi += 2
-
-        if 'media' in doc and doc['media'] and utils.is_list(doc['media']) and len(doc['media'])>=3:
-            qi += 2
-
-        if 'features' in doc and doc['features'] and utils.is_list(doc['features']):
-            qi += 2
+    result = TaskResult()
+    started = time.time()
 
-        return qi
+    # the traces of the products by doc id
+    doc_traces = {}
+    # the positions of the products by doc id, and the positions of the products not indexed
+    doc_positions = {}
+    failed_positions = set()
+    # the traces of the new or changed products written, to be checked for visibility
+    written_traces = []
 
-    result = TaskResult()
+    if force_refresh is None:
+        force_refresh = config.ENV.FORCE_REFRESH
 
     try:
 
@@ -112,83 +607,237 @@ def do_index(products_list, catalog, zone):
             result.increment_errors(len(products_list))
             raise ValueError("zone cannot be blank")
 
-        for product_dict in products_list:
+        # list of tuples (doc_id, product_dict, fingerprint) to be indexed
+        to_index = []
+
+        traces = traces if utils.is_list(traces) and len(traces) == len(products_list) else [None] * len(products_list)
+
+        for position, (product_dict, trace) in enumerate(zip(products_list, traces)):
+
+            if trace:
+                tracing.observe(catalog, 'queue', trace.get('received_at'), started)
 
             if not isinstance(product_dict, dict):
                 LOGGER.error(f"Dictionnary expected, provided {type(product_dict)}")
                 result.increment_errors(1)
+                failed_positions.add(position)
                 continue
 
             if "sku" not in product_dict or product_dict["sku"].strip()=="":
                 LOGGER.error(f"SKU required to save {product_dict}, skipped")
                 result.increment_errors(1)
+                failed_positions.add(position)
                 continue
 
+            # the fingerprint of the content sent by the spider
+            # enables to detect the products that did not change since their last indexation
+            fingerprint = utils.content_hash(product_dict, exclude=_FINGERPRINT_EXCLUDED_FIELDS)
+
             # enrich the product with mandatory attributes
             product_dict['catalog'] = catalog
 
-            # identify features
-            if 'description' in product_dict:
-                extractor = FeaturesExtractor(product_dict['description'])
-                product_dict['features'] = extractor.extract()
-
-            # quality index
-            product_dict['quality_index'] = quality_index(product_dict)
-
             # sanitize some fields, because scraping leads to unclean data
             # for fields that are used in faceting
             # replace special chars with a blank space, redundant blank spaces will be removed afterwards
             # product_dict['city'] = utils.safe_text(product_dict['city'], replace_with=" ", strict=False)
 
-            try:
-
-                # ensure uniqueness of the doc id
-                # two properties of 2 different catalogs may have the same sku
-                # need to have a safe id,
-                #   because some chars like ':' are used to associate the id with user prefs in the frontend
-                doc_id = utils.safe_text(f"{catalog}_{product_dict['sku']}", accept=["_"])  # do not remove "_" from the id
-
-                # keep track of updates
-                # will be usefull for the frontend to highlight "new" properties scraped
-                existing_doc = ElasticCommand.get(zone, doc_id)
-
-                today = datetime.today().strftime('%Y-%m-%d')
-
-                if existing_doc is not None:
+            # ensure uniqueness of the doc id
+            # two properties of 2 different catalogs may have the same sku
+            # need to have a safe id,
+            #   because some chars like ':' are used to associate the id with user prefs in the frontend
+            doc_id = utils.safe_text(f"{catalog}_{product_dict['sku']}", accept=["_"])  # do not remove "_" from the id
+
+            to_index.append((doc_id, product_dict, fingerprint))
+            doc_positions.setdefault(doc_id, []).append(position)
+            if trace:
+                doc_traces[doc_id] = trace
+
+        # a product sent twice is written once, with the content of its last occurrence:
+        # two writes of the same document in a bulk request conflict with each other
+        deduplicated = {doc_id: (doc_id, product_dict, fingerprint) for doc_id, product_dict, fingerprint in to_index}
+        if len(deduplicated) < len(to_index):
+            LOGGER.debug(f"{len(to_index) - len(deduplicated)} products sent twice, only their last occurrence is indexed")
+        to_index = list(deduplicated.values())
+
+        today = datetime.today().strftime('%Y-%m-%d')
+
+        # documents of a partitioned zone are written in the current partition
+        # and their copy in a previous partition is deleted
+        partition = ElasticCommand.ensure_partition(zone) if is_partitioned(zone) else None
+
+        # the products of a routed zone are all in the shard of their catalog
+        routing = catalog_routing(zone, catalog)
+
+        def save_chunk(chunk):
+            """
+            looks up and writes a chunk of products, returns the products of the chunk
+            which were written meanwhile by another worker, to be saved again
+
+            the documents are written only if they were not changed since they were read:
+            new documents are created only if they do not exist, existing documents are written only if their version did not change
+            """
+            ids = [doc_id for doc_id, _, _ in chunk]
+
+            # keep track of updates
+            # will be usefull for the frontend to highlight "new" properties scraped
+            moved = {}
+            if partition:
+                # the whole document is fetched, an unchanged document to be moved
+                # to the current partition is written as-is
+                located = ElasticCommand.locate(zone, ids, with_version=True, routing=routing)
+                existing_docs = {doc_id: source for doc_id, (index, source, version) in located.items()}
+                moved = {doc_id: index for doc_id, (index, source, version) in located.items() if index != partition}
+                # the documents moved to the current partition are created there
+                known_versions = {doc_id: version for doc_id, (index, source, version) in located.items() if index == partition}
+            else:
+                found = ElasticCommand.mget(
+                    zone,
+                    ids,
+                    source_fields=['scraping_start_date', 'content_hash'],
+                    with_version=True,
+                    routing=routing
+                )
+                existing_docs = {doc_id: source for doc_id, (version, source) in found.items()}
+                known_versions = {doc_id: version for doc_id, (version, source) in found.items()}
+
+            # full documents to be (re)written
+            docs = {}
+            # partial updates of the unchanged documents
+            updates = {}
+            unchanged = set()
+            created = set()
+            for doc_id, product_dict, fingerprint in chunk:
+
+                existing = existing_docs.get(doc_id)
+
+                # the product sent by the spider is left untouched, it may have to be saved again after a conflict
+                product_dict = dict(product_dict)
+
+                if existing is not None and existing.get('content_hash') == fingerprint and not config.ENV.FORCE_REFRESH:
+                    LOGGER.debug(f"Unchanged {doc_id}, only its dates will be updated")
+                    unchanged.add(doc_id)
+                    if doc_id in moved:
+                        docs[doc_id] = dict(existing, scraping_end_date=today, is_new=False)
+                    else:
+                        updates[doc_id] = {'scraping_end_date': today, 'is_new': False}
+                    continue
+
+                product_dict['content_hash'] = fingerprint
+
+                if existing is not None:
                     LOGGER.debug(f"Existing {doc_id} will be updated")
                     product_dict['is_new'] = False
                     # update the scraping_end_date
                     # the scraping_start_date remains unchanged
+                    if not product_dict.get('scraping_start_date'):
+                        product_dict['scraping_start_date'] = existing.get('scraping_start_date') or today
                     product_dict['scraping_end_date'] = today
                 else:
                     product_dict['is_new'] = True
+                    created.add(doc_id)
                     # Initiate the dates
                     product_dict['scraping_start_date'] = today
                     # at thee beginning, the scraping_end_date is the scraping_start_date
                     product_dict['scraping_end_date'] = today
 
-                ElasticCommand.save(zone, doc_id, product_dict, force_refresh=config.ENV.FORCE_REFRESH)
-
-                if product_dict['is_new']:
+                docs[doc_id] = product_dict
+
+            # the unchanged documents are not enriched again
+            enrichment_start = time.time()
+            enrich([product_dict for doc_id, product_dict in docs.items() if doc_id not in unchanged])
+            indexing_start = time.time()
+
+            # a version None means that the document must not exist
+            versions = {doc_id: known_versions.get(doc_id) for doc_id in docs}
+            routings = {doc_id: routing for doc_id in ids} if routing else None
+
+            if partition:
+                failures = ElasticCommand.bulk_save(
+                    zone,
+                    docs,
+                    force_refresh=force_refresh,
+                    index=partition,
+                    deletes={doc_id: index for doc_id, index in moved.items() if doc_id in docs},
+                    updates=updates,
+                    versions=versions,
+                    routings=routings
+                )
+            else:
+                failures = ElasticCommand.bulk_save(zone, docs, force_refresh=force_refresh, updates=updates, versions=versions, routings=routings)
+
+            indexed_at = time.time()
+
+            conflicts = []
+            for doc_id, product_dict, fingerprint in chunk:
+                trace = doc_traces.get(doc_id)
+                if trace and doc_id not in failures:
+                    if doc_id not in unchanged:
+                        tracing.observe(catalog, 'enrichment', enrichment_start, indexing_start)
+                        written_traces.append(dict(trace, doc_id=doc_id, content_hash=fingerprint, indexed_at=indexed_at))
+                    tracing.observe(catalog, 'indexing', indexing_start, indexed_at)
+
+                if doc_id in failures and is_conflict(failures[doc_id]):
+                    LOGGER.debug(f"{doc_id} written meanwhile by another worker")
+                    conflicts.append((doc_id, product_dict, fingerprint))
+                elif doc_id in failures:
+                    LOGGER.error(f"Unable to save {product_dict}: {failures[doc_id]}")
+                    result.increment_errors(1)
+                    failed_positions.update(doc_positions[doc_id])
+                elif doc_id in created:
                     result.increment_created(1)
                 else:
-                    result.increment_updated(1)
+                    result.increment_updated(1, changed=doc_id not in unchanged)
 
-                LOGGER.debug(f"Saved {product_dict['sku']} in zone {zone}")
+            LOGGER.debug(f"Saved {len(chunk) - len(failures)} products in zone {zone}")
+            return conflicts
 
-            except IndexError as ve:
-                # some required fields may haven't been provided
+        # one lookup and one bulk write per chunk instead of 2 requests per product
+        for chunk in utils.chunks(to_index, config.ES.ES_BULK_CHUNK_SIZE):
+
+            try:
+
+                # the products in conflict are read again and saved again right away
+                for attempt in range(config.ES.ES_CONFLICT_RETRIES + 1):
+                    chunk = save_chunk(chunk)
+                    if not chunk:
+                        break
+
+                if chunk:
+                    LOGGER.error(f"Unable to save {len(chunk)} products in zone {zone}, too many conflicts")
+                    result.increment_errors(len(chunk))
+                    for doc_id, _, _ in chunk:
+                        failed_positions.update(doc_positions[doc_id])
+
+            except (SearchError, IndexError) as ve:
                 # always check to avoid uncatched exceptions which would
-                # cause celery to retry the task
-                LOGGER.error(f"Unable to save {product_dict}", exc_info=True)
-                result.increment_errors(1)
+                # cause the queue to retry the task
+                LOGGER.error(f"Unable to save {len(chunk)} products in zone {zone}", exc_info=True)
+                result.increment_errors(len(chunk))
+                for doc_id, _, _ in chunk:
+                    failed_positions.update(doc_positions[doc_id])
+
+        _trace_visibility(catalog, zone, written_traces, force_refresh)
 
     except Exception as se:
 
         # other technical error raised during classification
         # LOGGER.critical(f"Error occured in task {self.request.id}, {se}", exc_info=True)
         LOGGER.critical(f"Error occured in task : {se}", exc_info=True)
+        # the products indexed before the error cannot be told apart from the others
+        failed_positions.update(range(len(products_list or [])) if utils.is_list(products_list) else [])
 
     finally:
 
+        JOB_DURATION.observe(time.time() - started, job='do_index')
+        # the updated documents are either changed or unchanged
+        DOCUMENTS_INDEXED.inc(result.created, catalog=catalog, zone=zone, result='created')
+        DOCUMENTS_INDEXED.inc(result.changed, catalog=catalog, zone=zone, result='updated')
+        DOCUMENTS_INDEXED.inc(result.unchanged, catalog=catalog, zone=zone, result='unchanged')
+        DOCUMENTS_INDEXED.inc(result.errors, catalog=catalog, zone=zone, result='errors')
+
+        # the products not indexed are not dropped when they are sent again
+        dedup.release([products_list[position] for position in sorted(failed_positions)], catalog)
+        if failures is not None:
+            failures.extend(sorted(failed_positions))
+
         return result.values()
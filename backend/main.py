@@ -5,8 +5,10 @@ import logging
 from sanic import Sanic
 
 from blueprints import (health_blueprint, indices_blueprint,
-                        reps_blueprint, monitoring_blueprint)
+                        reps_blueprint, monitoring_blueprint, crawls_blueprint,
+                        metrics_blueprint)
 
+from elastic_client import ElasticClientRegistry
 import config
 import settings
 
@@ -20,6 +22,14 @@ app.register_blueprint(reps_blueprint)
 app.register_blueprint(health_blueprint)
 app.register_blueprint(indices_blueprint)
 app.register_blueprint(monitoring_blueprint)
+app.register_blueprint(crawls_blueprint)
+app.register_blueprint(metrics_blueprint)
+
+
+@app.listener('after_server_stop')
+async def close_elastic_clients(sanic_app, loop) -> None:
+    await ElasticClientRegistry.close_async_clients(loop)
+
 
 LOGGER = logging.getLogger('app')
 LOGGER.info("----- App started ------")
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""
+Metrics of the ingestion, exposed in the Prometheus text format on GET /metrics
+
+The values are kept in Redis, so that the metrics of all the processes (the app, the rq workers, the stream consumers)
+are aggregated: a metric is a Redis hash, one field per combination of label values.
+A failure of Redis is logged and does not prevent the ingestion
+
+:Example:
+>>> ITEMS_RECEIVED.inc(catalog='glv')
+>>> with ES_REQUEST_DURATION.time(operation='mget'):
+...     client.mget(...)
+>>> print(render())
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+
+import ujson as json
+from redis.exceptions import RedisError
+
+from redis_client import redis_conn
+
+
+LOGGER = logging.getLogger('app')
+
+# the metrics rendered by render(), in their order of declaration
+REGISTRY = []
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join([f'{name}="{_escape(value)}"' for name, value in pairs]) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(object):
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+
+    @property
+    def key(self):
+        return f"metrics:{self.name}"
+
+
+    def _field(self, labels):
+        """the field of the hash holding the values of the labels passed, the labels missing are blank"""
+        return json.dumps([str(labels.get(name, '')) for name in self.labels])
+
+
+    def _read(self):
+        """the values stored, as a dict {field: value}"""
+        try:
+            return {_decode(k): float(v) for k, v in redis_conn.hgetall(self.key).items()}
+        except RedisError as e:
+            LOGGER.warning(f"Unable to read the metric {self.name}: {e}")
+            return {}
+
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+    def reset(self):
+        redis_conn.delete(self.key)
+
+
+class Counter(_Metric):
+    """a value which only increases, ex: the number of items received"""
+
+    type = 'counter'
+
+    def inc(self, value=1, pipe=None, **labels):
+        """increments the counter, or queues the increment on the Redis pipeline passed, executed by the caller"""
+        if not value:
+            return
+        if pipe is not None:
+            pipe.hincrbyfloat(self.key, self._field(labels), value)
+            return
+        try:
+            redis_conn.hincrbyfloat(self.key, self._field(labels), value)
+        except RedisError as e:
+            LOGGER.warning(f"Unable to increment the metric {self.name}: {e}")
+
+
+    def render(self):
+        lines = self.header()
+        for field, value in sorted(self._read().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, json.loads(field))} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """the distribution of observed values in buckets, ex: the duration of the requests"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels=labels)
+        self.buckets = tuple(sorted(buckets))
+
+
+    def observe(self, value, **labels):
+        """counts the value in the first bucket it fits in, the buckets are made cumulative when rendered"""
+        field = self._field(labels)
+        bucket = next((b for b in self.buckets if value <= b), '+Inf')
+        try:
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.hincrby(self.key, f"{field}|{bucket}", 1)
+            pipe.hincrbyfloat(self.key, f"{field}|sum", value)
+            pipe.execute()
+        except RedisError as e:
+            LOGGER.warning(f"Unable to update the metric {self.name}: {e}")
+
+
+    @contextmanager
+    def time(self, **labels):
+        """observes the duration of the block, in seconds"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+
+    def _series(self):
+        """the values stored per label values, as a dict {labels field: {bucket or 'sum': value}}"""
+        series = {}
+        for field, value in self._read().items():
+            labels, _, suffix = field.rpartition('|')
+            series.setdefault(labels, {})[suffix] = value
+        return series
+
+
+    def percentiles(self, percentiles=(50, 90, 99)):
+        """
+        estimates the percentiles of the observed values per label values, interpolating linearly within the buckets
+        as the histogram_quantile function of Prometheus, the values over the last bucket are estimated as the last bucket
+
+        :Example:
+        >>> STAGE_DURATION.percentiles()
+        {('glv', 'queue'): {'count': 120, 'p50': 0.8, 'p90': 4.2, 'p99': 9.5}}
+        """
+        result = {}
+        for labels, values in self._series().items():
+            counts = [values.get(str(b), 0) for b in self.buckets] + [values.get('+Inf', 0)]
+            total = sum(counts)
+            if not total:
+                continue
+
+            estimates = {'count': int(total)}
+            for p in percentiles:
+                rank = total * p / 100
+                cumulated = 0
+                for i, count in enumerate(counts):
+                    if count and cumulated + count >= rank:
+                        if i == len(self.buckets):
+                            estimate = self.buckets[-1]
+                        else:
+                            lower = self.buckets[i - 1] if i > 0 else 0
+                            estimate = lower + (self.buckets[i] - lower) * (rank - cumulated) / count
+                        break
+                    cumulated += count
+                estimates[f"p{p}"] = round(estimate, 3)
+
+            result[tuple(json.loads(labels))] = estimates
+        return result
+
+
+    def render(self):
+        series = self._series()
+
+        lines = self.header()
+        for labels, values in sorted(series.items()):
+            label_values = json.loads(labels)
+            cumulated = 0
+            for bucket in [str(b) for b in self.buckets] + ['+Inf']:
+                cumulated += values.get(bucket, 0)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, ('le', bucket))} {_format_value(cumulated)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(values.get('sum', 0))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {_format_value(cumulated)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """a value computed when the metrics are rendered, ex: the depth of a queue"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, collect, labels=()):
+        """collect returns the current values, as a dict {tuple of label values: value}"""
+        super().__init__(name, documentation, labels=labels)
+        self.collect = collect
+
+
+    def render(self):
+        lines = self.header()
+        try:
+            values = self.collect()
+        except Exception as e:
+            LOGGER.warning(f"Unable to collect the metric {self.name}: {e}")
+            values = {}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+def render():
+    """the metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+"""
+Metrics of the ingestion
+"""
+
+ITEMS_RECEIVED = Counter('reps_items_received_total', "Items received from the spiders", labels=('catalog',))
+ITEMS_VALIDATED = Counter('reps_items_validated_total', "Items received and valid", labels=('catalog',))
+ITEMS_REJECTED = Counter('reps_items_rejected_total', "Items received and rejected by the validation", labels=('catalog',))
+REQUESTS_THROTTLED = Counter('reps_requests_throttled_total', "Calls to /reps answered with HTTP 429")
+
+JOB_DURATION = Histogram('job_duration_seconds', "Duration of the background jobs", labels=('job',))
+
+ES_REQUEST_DURATION = Histogram('es_request_duration_seconds', "Duration of the Elasticsearch requests of the ingestion", labels=('operation',))
+
+DOCUMENTS_INDEXED = Counter(
+    'index_documents_total',
+    "Products indexed, by result (created, updated, unchanged, errors)",
+    labels=('catalog', 'zone', 'result')
+)
+
+STAGE_DURATION = Histogram(
+    'ingest_stage_duration_seconds',
+    "Duration of the stages of the ingestion of the traced items (http, queue, enrichment, indexing, refresh, total)",
+    labels=('catalog', 'stage'),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 14400)
+)
+
+CLEANUP_DELETED = Counter('cleanup_deleted_total', "Obsolete ads deleted by the cleanup", labels=('zone',))
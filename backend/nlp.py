@@ -1,6 +1,178 @@
 # -*- coding: utf-8 -*-
 
+"""
+Extraction of the features (chambres, jardin, garage...) of the real estate ads
+
+The features are defined in a vocabulary file (config.ENV.FEATURES_VOCABULARY), a JSON list of entries:
+- {"feature": "jardin", "terms": ["jardin", "jardinet"]}: the feature is found when one of the terms is found,
+    the name of the feature is extracted
+- {"feature": "chambres", "pattern": "\\d{1,3}\\s+chambres?"}: the feature is found when the regex matches,
+    the text matched is extracted (ex: '3 chambres'). The pattern must not contain named groups
+
+The entries are compiled into a single regex, so that all the features are found in one pass over the text,
+the regex is compiled once per process
+
+The typed attributes of the ads (bedrooms, rooms, land_area, energy_class, floor) are extracted the same way,
+using the patterns of _ATTRIBUTES
+"""
+
 import re
+import logging
+from threading import Lock
+
+import ujson as json
+
+import config
+
+
+LOGGER = logging.getLogger('app')
+
+
+class FeaturesEngine(object):
+    """
+    Finds all the features of a vocabulary in a single pass over a text
+
+    :Example:
+    >>> engine = FeaturesEngine([{'feature': 'jardin', 'terms': ['jardin']}, {'feature': 'chambres', 'pattern': r'\\d+\\s+chambres?'}])
+    >>> engine.extract("Maison de 3 chambres avec jardin")
+    ['jardin', '3 chambres']
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+
+        alternatives = []
+        for i, entry in enumerate(vocabulary):
+            if entry.get('pattern'):
+                pattern = entry['pattern']
+            else:
+                # longest terms first so that 'plain-pieds' is not matched as 'plain-pied'
+                # blanks of the terms match any sequence of blanks
+                terms = sorted(entry.get('terms') or [entry['feature']], key=len, reverse=True)
+                pattern = '|'.join([r'\s+'.join([re.escape(w) for w in t.split()]) for t in terms])
+            alternatives.append(f"(?P<f{i}>{pattern})")
+
+        self.regex = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+
+    def extract(self, text):
+        """the features found in the text, in the order of the vocabulary, each feature being extracted once"""
+        found = {}
+        if not text:
+            return []
+
+        for m in self.regex.finditer(text):
+            i = int(m.lastgroup[1:])
+            if i in found:
+                continue
+            entry = self.vocabulary[i]
+            found[i] = ' '.join(m.group().lower().split()) if entry.get('pattern') else entry['feature']
+            if len(found) == len(self.vocabulary):
+                break
+
+        return [found[i] for i in sorted(found)]
+
+
+    def extract_many(self, texts):
+        """the features of each text, in the same order as the texts"""
+        return [self.extract(text) for text in texts]
+
+
+_engine = None
+_lock = Lock()
+
+
+def get_engine():
+    """the engine of the process, compiled from config.ENV.FEATURES_VOCABULARY on first use"""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = FeaturesEngine.from_file(config.ENV.FEATURES_VOCABULARY)
+            LOGGER.debug(f"Features engine compiled from {config.ENV.FEATURES_VOCABULARY}")
+        return _engine
+
+
+def _to_int(max_value):
+    """converts a number of the text, values over max_value are considered as wrong"""
+    def convert(value):
+        value = int(value)
+        return value if value <= max_value else None
+    return convert
+
+
+def _to_area(value):
+    """converts an area of the text (ex: '1 200,5') into a float"""
+    try:
+        return float(re.sub(r'\s', '', value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+# the typed attributes extracted from the ads: (attribute, pattern, conversion of the value)
+# the first group of the pattern captures the value, the first match of each attribute is kept
+_ATTRIBUTES = [
+    ('bedrooms', r'(\d{1,2})\s+chambres?', _to_int(50)),
+    ('rooms', r'(\d{1,2})\s+pi[eè]ces?', _to_int(100)),
+    ('rooms', r'(?:appartement|maison|type)\s+[TF](\d{1,2})', _to_int(100)),
+    ('rooms', r'[TF](\d{1,2})(?=\s+de\s+\d)', _to_int(100)),
+    ('land_area', r'terrain\s+(?:clos\s+|arboré\s+|arbore\s+)?(?:de\s+|d\'environ\s+)?(\d{1,3}(?:[ .]?\d{3})*(?:,\d+)?)\s*m(?:²|2)', _to_area),
+    ('land_area', r'(\d{1,3}(?:[ .]?\d{3})*(?:,\d+)?)\s*m(?:²|2)\s+de\s+terrain', _to_area),
+    ('energy_class', r'(?:dpe|classe\s+[ée]nergie|classe\s+[ée]nerg[ée]tique|[ée]tiquette\s+[ée]nergie)\s*:?\s*([a-g])', lambda v: v.upper()),
+    ('floor', r'(\d{1,2})\s*(?:er|ère|ere|e|è|ème|eme)\s+étage', _to_int(60)),
+    ('floor', r'(rez[\s-]de[\s-]chauss[ée]e)', lambda v: 0),
+]
+
+
+class AttributesEngine(object):
+    """
+    Extracts typed attributes from a text in a single pass
+
+    :Example:
+    >>> AttributesEngine(_ATTRIBUTES).extract("Appartement T3 au 2ème étage, 2 chambres, DPE : C")
+    {'bedrooms': 2, 'rooms': 3, 'energy_class': 'C', 'floor': 2}
+    """
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        alternatives = [f"(?P<a{i}>{pattern})" for i, (_, pattern, _) in enumerate(attributes)]
+        self.regex = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+        # the group capturing the value follows the group of the alternative
+        self.value_groups = [self.regex.groupindex[f"a{i}"] + 1 for i in range(len(attributes))]
+
+
+    def extract(self, text):
+        """the attributes found in the text, as a dict {attribute: value}"""
+        found = {}
+        if not text:
+            return found
+
+        for m in self.regex.finditer(text):
+            i = int(m.lastgroup[1:])
+            attribute, _, convert = self.attributes[i]
+            if attribute in found:
+                continue
+            value = convert(m.group(self.value_groups[i]))
+            if value is not None:
+                found[attribute] = value
+
+        return {attribute: found[attribute] for attribute, _, _ in self.attributes if attribute in found}
+
+
+    def extract_many(self, texts):
+        """the attributes of each text, in the same order as the texts"""
+        return [self.extract(text) for text in texts]
+
+
+_attributes_engine = AttributesEngine(_ATTRIBUTES)
+
+# the names of the typed attributes
+ATTRIBUTE_FIELDS = list(dict.fromkeys([attribute for attribute, _, _ in _ATTRIBUTES]))
 
 
 class FeaturesExtractor(object):
@@ -14,18 +186,16 @@ class FeaturesExtractor(object):
 
     def extract(self):
         """"""
-        features = []
+        return get_engine().extract(self.document)
 
-        m = re.search(r'.*(?P<chambres>\d{1,}\s{1,}\bchambre(s)?\b).*', self.document, re.IGNORECASE)
-        if m:
-            features.append(m.group('chambres'))
 
-        m = re.search(r'.*(?P<jardin>\bjardin\b).*', self.document, re.IGNORECASE)
-        if m:
-            features.append(m.group('jardin'))
+    @staticmethod
+    def extract_many(texts):
+        """extracts the features of a batch of texts"""
+        return get_engine().extract_many(texts)
 
-        m = re.search(r'.*(?P<garage>\bgarage\b).*', self.document, re.IGNORECASE)
-        if m:
-            features.append(m.group('garage'))
 
-        return features
+    @staticmethod
+    def extract_attributes_many(texts):
+        """extracts the typed attributes (bedrooms, rooms, land_area, energy_class, floor) of a batch of texts"""
+        return _attributes_engine.extract_many(texts)
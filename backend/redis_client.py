@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""
+The Redis connection shared by the RQ queues and the ingestion streams
+"""
+
+from urllib.parse import urlparse
+
+from redis import Redis
+
+import config
+
+
+# Tell RQ what Redis connection to use
+# urlparse.uses_netloc.append('redis')
+url = urlparse(config.Q.REDIS_URL)
+redis_conn = Redis(
+    host=url.hostname,
+    port=url.port,
+    db=0,
+    password=url.password
+)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the throughput of the features extraction with the former implementation,
+which ran one regex per feature, each regex starting and ending with '.*'
+(the former implementation backtracks quadratically with the length of the texts, keep the texts short)
+
+Run from the backend directory:
+    python scripts/benchmark_features.py --texts 200 --length 2000
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nlp import FeaturesExtractor
+
+
+_WORDS = (
+    "maison appartement lumineux proche commerces séjour cuisine équipée salle de bain étage "
+    "exposé sud quartier calme idéal investissement locatif rénové double vitrage chauffage gaz"
+).split()
+
+_FEATURES = ["3 chambres", "jardin", "garage", "piscine", "terrasse", "cave", "parking", "ascenseur", "plain-pied"]
+
+
+def legacy_extract(document):
+    """the former implementation of FeaturesExtractor.extract()"""
+    features = []
+
+    m = re.search(r'.*(?P<chambres>\d{1,}\s{1,}\bchambre(s)?\b).*', document, re.IGNORECASE)
+    if m:
+        features.append(m.group('chambres'))
+
+    m = re.search(r'.*(?P<jardin>\bjardin\b).*', document, re.IGNORECASE)
+    if m:
+        features.append(m.group('jardin'))
+
+    m = re.search(r'.*(?P<garage>\bgarage\b).*', document, re.IGNORECASE)
+    if m:
+        features.append(m.group('garage'))
+
+    return features
+
+
+def generate_texts(count, length):
+    """random ads descriptions of approximately 'length' chars, containing a few features"""
+    texts = []
+    for _ in range(count):
+        words = []
+        while sum([len(w) + 1 for w in words]) < length:
+            words.append(random.choice(_WORDS) if random.random() > 0.01 else random.choice(_FEATURES))
+        texts.append(' '.join(words))
+    return texts
+
+
+def measure(label, func, texts):
+    start = time.perf_counter()
+    func(texts)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<30} {elapsed:8.3f}s {len(texts) / elapsed:10.0f} texts/s")
+    return elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="features extraction benchmark")
+    parser.add_argument('--texts', type=int, default=200, help="number of texts")
+    parser.add_argument('--length', type=int, default=2000, help="approximate length of the texts")
+    args = parser.parse_args()
+
+    random.seed(0)
+    texts = generate_texts(args.texts, args.length)
+
+    # compile the engine before measuring
+    FeaturesExtractor.extract_many(texts[:1])
+
+    legacy = measure("legacy (3 features)", lambda t: [legacy_extract(x) for x in t], texts)
+    engine = measure(f"engine (vocabulary)", FeaturesExtractor.extract_many, texts)
+    print(f"speedup: x{legacy / engine:.1f}")
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the latency of the first page of the listing of the web on a zone of generated ads,
+with and without the index sort of the zone (see _SETTINGS in search_index.py)
+
+The page query of the web is sorted on (is_new, quality_index) and does not count the hits (track_total_hits),
+so that Elasticsearch stops collecting the documents of a segment once the page is full when the index is sorted the same way.
+The benchmark indices are deleted at the end of the run
+
+Run from the backend directory, against a test cluster:
+    ES_HOST=http://localhost:9200 python scripts/benchmark_listing.py --ads 100000 --queries 200
+"""
+
+import os
+import sys
+import copy
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+
+from search_index import _SETTINGS, _MAPPING, _DOCUMENT_TYPE
+import config
+
+
+_CITIES = ["lille", "roubaix", "tourcoing", "villeneuve d'ascq", "marcq en baroeul", "lambersart", "wasquehal", "croix"]
+
+_FEATURES = ["3 chambres", "jardin", "garage", "piscine", "terrasse", "cave", "parking", "ascenseur", "plain-pied"]
+
+# the fields returned by the listing of the web
+_SOURCE = [
+    'sku', 'title', 'description', 'city', 'features', 'price', 'media', 'url', 'catalog', 'is_new', 'area',
+    'bedrooms', 'rooms', 'land_area', 'energy_class', 'floor'
+]
+
+
+def generate_ads(count):
+    """random ads, a few % of them are new"""
+    for i in range(count):
+        yield {
+            '_id': f"bench_{i}",
+            '_source': {
+                'sku': str(i),
+                'catalog': f"catalog_{i % 20}",
+                'title': f"Maison {random.randint(2, 8)} pièces",
+                'description': "maison lumineuse proche commerces " + ' '.join(random.sample(_FEATURES, 3)),
+                'city': random.choice(_CITIES),
+                'features': random.sample(_FEATURES, 3),
+                'price': random.randint(80, 900) * 1000,
+                'area': random.randint(30, 250),
+                'bedrooms': random.randint(1, 6),
+                'is_new': random.random() < 0.05,
+                'quality_index': round(random.random(), 4),
+                'scraping_start_date': '2020-05-01',
+                'scraping_end_date': '2020-05-01',
+            }
+        }
+
+
+def create_index(client, name, sorted_index):
+    settings = copy.deepcopy(_SETTINGS)
+    if not sorted_index:
+        for key in [k for k in settings if k.startswith('sort.')]:
+            del settings[key]
+    client.indices.create(index=name, body={'settings': settings, 'mappings': _MAPPING})
+
+
+def load(client, name, ads):
+    bulk(client, ({**ad, '_index': name, '_type': _DOCUMENT_TYPE} for ad in ads), chunk_size=5000, refresh=False)
+    client.indices.refresh(index=name)
+    # a zone is merged over time, a few segments are left as in production
+    client.indices.forcemerge(index=name, max_num_segments=5)
+
+
+def page_query(track_total_hits, size, max_price=0):
+    """the page 1 query of the listing of the web (see _ObjectQuery._prepare_find of the web)"""
+    body = {
+        'query': {'bool': {'filter': [{'range': {'price': {'gte': 0.0, 'lte': float(max_price)}}}]}} if max_price else {'match_all': {}},
+        'sort': [
+            {'is_new': {'order': 'desc', 'missing': '_last'}},
+            {'quality_index': {'order': 'desc', 'missing': '_last'}}
+        ],
+        '_source': _SOURCE,
+        'from': 0,
+        'size': size,
+    }
+    if not track_total_hits:
+        body['track_total_hits'] = False
+    return body
+
+
+def measure(label, client, name, body, queries):
+    """runs the query, returns the latencies in ms, as measured by Elasticsearch (took)"""
+    # warm up the caches
+    for _ in range(10):
+        client.search(index=name, body=body, request_cache=False)
+
+    took = sorted([client.search(index=name, body=body, request_cache=False)['took'] for _ in range(queries)])
+    p50 = took[len(took) // 2]
+    p95 = took[int(len(took) * 0.95) - 1]
+    print(f"{label:<45} p50 {p50:5d}ms   p95 {p95:5d}ms")
+    return p50
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="listing page 1 latency benchmark")
+    parser.add_argument('--ads', type=int, default=100000, help="number of ads of the zone")
+    parser.add_argument('--queries', type=int, default=200, help="number of queries per measure")
+    parser.add_argument('--size', type=int, default=20, help="number of ads per page (ES_PAGE_SIZE of the web)")
+    parser.add_argument('--max-price', type=int, default=0, help="filter the listing on a max price, as a user would")
+    args = parser.parse_args()
+
+    client = Elasticsearch(hosts=[config.ES.ES_HOST], timeout=300)
+    indices = {'unsorted': 'bench_listing_unsorted', 'sorted': 'bench_listing_sorted'}
+
+    try:
+        for key, name in indices.items():
+            random.seed(0)
+            create_index(client, name, sorted_index=(key == 'sorted'))
+            load(client, name, generate_ads(args.ads))
+
+        before = measure("before: unsorted index, total hits counted", client, indices['unsorted'], page_query(True, args.size, args.max_price), args.queries)
+        measure("unsorted index, total hits not counted", client, indices['unsorted'], page_query(False, args.size, args.max_price), args.queries)
+        measure("sorted index, total hits counted", client, indices['sorted'], page_query(True, args.size, args.max_price), args.queries)
+        after = measure("after: sorted index, total hits not counted", client, indices['sorted'], page_query(False, args.size, args.max_price), args.queries)
+        print(f"speedup: x{before / max([after, 1]):.1f}")
+
+    finally:
+        client.indices.delete(index=','.join(indices.values()), ignore=[404])
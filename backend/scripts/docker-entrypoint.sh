@@ -2,7 +2,8 @@
 
 
 # wait for for Elastic to be started
-scripts/wait-for-elastic.sh $ES_HOST -- echo "----- Starting gunicorn -----"
+# ES_HOST may be a comma separated list of hosts, wait for the first one
+scripts/wait-for-elastic.sh ${ES_HOST%%,*} -- echo "----- Starting gunicorn -----"
 
 # start the server after data has been initialized
 # the gunicorn params can be passed as environment variables prefixed with GUNICORN_ and UPPERCASE
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reports the size on disk of each field of a zone, with the default index profile and with the compact profile
+(see is_compact in search_index.py)
+
+Elasticsearch 6 does not report the disk usage per field: a sample of the zone is copied into a temporary index
+per profile, then once per field with the values of the field removed, the size of a field being the difference.
+Each index is merged into a single segment before being measured, the temporary indices are deleted at the end of the run
+
+Run from the backend directory, preferably against a test cluster holding a copy of the zone:
+    ES_HOST=http://localhost:9200 python scripts/index_size_report.py --zone mel --sample 20000
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from elasticsearch import Elasticsearch
+
+from search_index import _SETTINGS, _MAPPING, _COMPACT_SETTINGS, _COMPACT_FIELDS, _DOCUMENT_TYPE
+import config
+
+
+_PREFIX = "size_report"
+
+
+def profiles():
+    """the settings and the mapping of each profile, with a single shard so that the sizes can be compared"""
+    compact_properties = {
+        field: dict(definition, **_COMPACT_FIELDS.get(field, {}))
+        for field, definition in _MAPPING[_DOCUMENT_TYPE]['properties'].items()
+    }
+    return {
+        'default': (dict(_SETTINGS, number_of_shards=1, number_of_replicas=0), _MAPPING),
+        'compact': (
+            dict(_SETTINGS, **_COMPACT_SETTINGS, number_of_shards=1, number_of_replicas=0),
+            {_DOCUMENT_TYPE: {'properties': compact_properties}}
+        ),
+    }
+
+
+def measure(client, zone, name, settings, mapping, sample, without=None):
+    """copies the sample of the zone into a new index, without the values of the field passed, returns the size of the index in bytes"""
+    client.indices.create(index=name, body={'settings': settings, 'mappings': mapping})
+    try:
+        body = {'source': {'index': zone}, 'dest': {'index': name}}
+        if sample:
+            # the same documents are copied for each measure
+            body['size'] = sample
+            body['source']['sort'] = [{'_id': 'asc'}]
+        if without:
+            body['script'] = {'source': "ctx._source.remove(params.field)", 'params': {'field': without}}
+        client.reindex(body=body, wait_for_completion=True, request_timeout=3600)
+
+        client.indices.refresh(index=name)
+        client.indices.forcemerge(index=name, max_num_segments=1, request_timeout=3600)
+        stats = client.indices.stats(index=name, metric='store')
+        return stats['_all']['primaries']['store']['size_in_bytes']
+    finally:
+        client.indices.delete(index=name, ignore=[404])
+
+
+def human(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="size per field of a zone, default and compact profiles")
+    parser.add_argument('--zone', required=True, help="the zone to measure")
+    parser.add_argument('--sample', type=int, default=20000, help="number of documents copied, 0 for the whole zone")
+    args = parser.parse_args()
+
+    client = Elasticsearch(hosts=[config.ES.ES_HOST], timeout=300)
+    fields = sorted(_MAPPING[_DOCUMENT_TYPE]['properties'].keys())
+
+    sizes = {}
+    for profile, (settings, mapping) in profiles().items():
+        total = measure(client, args.zone, f"{_PREFIX}_{profile}", settings, mapping, args.sample)
+        sizes[profile] = {'total': total}
+        for field in fields:
+            without = measure(client, args.zone, f"{_PREFIX}_{profile}_{field}", settings, mapping, args.sample, without=field)
+            sizes[profile][field] = total - without
+            print(f"measured {field} ({profile})", file=sys.stderr)
+
+    print(f"{'field':<22} {'default':>10} {'compact':>10} {'saved':>10}")
+    for field in fields + ['total']:
+        default, compact = sizes['default'][field], sizes['compact'][field]
+        saved = f"{100 * (default - compact) / default:.0f}%" if default > 0 else '-'
+        print(f"{field:<22} {human(default):>10} {human(compact):>10} {saved:>10}")
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
+import re
+import math
+import time
 import logging
+from datetime import datetime, date, timedelta
 from numbers import Integral
 
-from elasticsearch import Elasticsearch, ElasticsearchException, NotFoundError
+from elasticsearch import Elasticsearch, ElasticsearchException, NotFoundError, RequestError
+import elasticsearch.helpers as helpers
 
+from elastic_client import ElasticClientRegistry
+from metrics import ES_REQUEST_DURATION
 import config
 
 
@@ -37,7 +44,13 @@ _SETTINGS = {
         }
     },
     "number_of_shards": config.ES.ES_SHARDS,
-    "number_of_replicas": config.ES.ES_REPLICAS
+    "number_of_replicas": config.ES.ES_REPLICAS,
+    # the segments are sorted as the listings of the web (new products first, then by quality_index),
+    # so that the search of a page stops once the page is collected (see the web data_provider)
+    # the index sort is set when the index is created, the existing zones get it when reindexed
+    "sort.field": ["is_new", "quality_index"],
+    "sort.order": ["desc", "desc"],
+    "sort.missing": ["_last", "_last"]
 }
 
 _MAPPING = {
@@ -56,12 +69,214 @@ _MAPPING = {
             "area" : {"type" : "scaled_float", "scaling_factor": 100},
             "media" :  {"type" : "text", "index": "false"},
             "url" : {"type" : "text", "index": "false"},
+            # typed attributes extracted from the title and the description, used in range filters
+            "bedrooms" : {"type" : "short"},
+            "rooms" : {"type" : "short"},
+            "land_area" : {"type" : "scaled_float", "scaling_factor": 100},
+            "energy_class" : {"type" : "keyword"}, # A to G
+            "floor" : {"type" : "short"},
             "quality_index": {"type" : "float"}, # computed, used for ranking & highlights
+            "content_hash": {"type" : "keyword", "index": "false", "doc_values": "false"}, # fingerprint of the content sent by the spider
         }
     }
 }
 
 
+# the compact index profile trades a little CPU for less disk and page cache (see is_compact)
+_COMPACT_SETTINGS = {
+    "codec": "best_compression"
+}
+
+# the fields of the compact profile which are never sorted nor aggregated do not need doc_values,
+# the range filters use the points of the numbers and of the dates, the sku is never searched by relevance.
+# catalog, city and features are aggregated (monitoring, facets), is_new and quality_index are used by the index sort
+_COMPACT_FIELDS = {
+    "scraping_start_date" : {"doc_values": "false"},
+    "scraping_end_date" : {"doc_values": "false"},
+    "sku" : {"norms": "false", "index_options": "docs"},
+    "price" : {"doc_values": "false"},
+    "area" : {"doc_values": "false"},
+    "bedrooms" : {"doc_values": "false"},
+    "rooms" : {"doc_values": "false"},
+    "land_area" : {"doc_values": "false"},
+    "energy_class" : {"doc_values": "false"},
+    "floor" : {"doc_values": "false"},
+}
+
+
+# settings applied while an ingest session is open on an index
+# the refresh is disabled and the replicas are dropped, so that bulk writes are faster
+_INGEST_SETTINGS = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0
+}
+
+
+def _ingest_settings(get_settings_response):
+    """
+    extracts the current values of the ingest settings from a get_settings response (flat settings),
+    the settings which are not explicitly set on the index are None, so that their default value is restored afterwards
+    """
+    previous = {k: None for k in _INGEST_SETTINGS.keys()}
+    # the zone may be an alias, the response is keyed by the concrete index name
+    for index_settings in get_settings_response.values():
+        for k in _INGEST_SETTINGS.keys():
+            value = index_settings.get('settings', {}).get(k)
+            if value is not None:
+                previous[k] = value
+    return previous
+
+
+def _index_name(zone, version):
+    """name of the physical index of the given version of a zone, the zone itself being an alias"""
+    return f"{zone}_v{version}"
+
+
+def _index_version(zone, index_name):
+    """version of a physical index of the zone, 0 for a legacy index named after the zone, None if not an index of the zone"""
+    if index_name == zone:
+        return 0
+    match = re.fullmatch(re.escape(zone) + r"_v(\d+)", index_name)
+    return int(match.group(1)) if match else None
+
+
+def _aliased_indices(get_alias_response):
+    """names of the indices returned by indices.get_alias()"""
+    return list(get_alias_response.keys())
+
+
+def is_partitioned(zone):
+    """
+    a partitioned zone is an alias of time based indices (partitions) named {zone}-YYYY.MM.DD,
+    each partition contains the documents last seen during its period (see config.ENV.PARTITION_PERIOD_DAYS),
+    thus obsolete documents are deleted by dropping whole partitions
+    """
+    return zone in config.ENV.PARTITIONED_ZONES
+
+
+def is_compact(zone):
+    """
+    a compact zone is indexed with the compact profile: the stored fields are compressed with best_compression,
+    the doc_values and the norms not used by any query are disabled, and the number of shards fits the volume of the zone
+    """
+    return zone in config.ES.COMPACT_ZONES
+
+
+def is_routed(zone):
+    """
+    the ads of a routed zone are routed by catalog: all the ads of a catalog are in the same shard,
+    so that the searches and the deletions of a single catalog hit a single shard.
+    The routing is required by the mapping, the reads of a document pass the routing of its catalog
+    """
+    return zone in config.ES.ROUTED_ZONES
+
+
+def catalog_routing(zone, catalog):
+    """the routing of the ads of the catalog in the zone, None when the zone is not routed"""
+    if not is_routed(zone) or not catalog:
+        return None
+    return catalog.strip().lower()
+
+
+def _compact_shards(size_in_bytes):
+    """the number of shards for the volume of data passed, see config.ES.ES_COMPACT_SHARD_SIZE_MB"""
+    shard_size = config.ES.ES_COMPACT_SHARD_SIZE_MB * 1024 * 1024
+    return min([config.ES.ES_SHARDS, max([1, math.ceil(size_in_bytes / shard_size)])])
+
+
+def _index_settings(zone, size_in_bytes=0):
+    """the settings of a new index of the zone, size_in_bytes is the volume of the documents to be copied into it, if any"""
+    if not is_compact(zone):
+        return _SETTINGS
+    return dict(_SETTINGS, **_COMPACT_SETTINGS, number_of_shards=_compact_shards(size_in_bytes))
+
+
+def _index_mapping(zone):
+    """the mapping of a new index of the zone"""
+    mapping = _MAPPING[_DOCUMENT_TYPE]
+    if is_compact(zone):
+        mapping = dict(mapping, properties={
+            field: dict(definition, **_COMPACT_FIELDS.get(field, {})) for field, definition in mapping['properties'].items()
+        })
+    if is_routed(zone):
+        # an ad written without routing would be duplicated in another shard
+        mapping = dict(mapping, _routing={"required": True})
+    return {_DOCUMENT_TYPE: mapping}
+
+
+# the routing of the documents copied into a routed zone, see catalog_routing()
+_ROUTING_SCRIPT = "ctx._routing = ctx._source.catalog == null ? null : ctx._source.catalog.trim().toLowerCase()"
+
+
+def _partition_start(day):
+    """first day of the period of the given day, periods are counted from the epoch"""
+    epoch = date(1970, 1, 1)
+    period = config.ENV.PARTITION_PERIOD_DAYS
+    return epoch + timedelta(days=((day - epoch).days // period) * period)
+
+
+def _partition_name(zone, day=None):
+    """name of the partition of the zone containing the documents seen on the given day (today by default)"""
+    return f"{zone}-{_partition_start(day or date.today()).strftime('%Y.%m.%d')}"
+
+
+def _partition_date(zone, index_name):
+    """first day of the period of a partition of the zone, None if the index is not a partition of the zone"""
+    match = re.fullmatch(re.escape(zone) + r"-(\d{4}\.\d{2}\.\d{2})", index_name)
+    return datetime.strptime(match.group(1), '%Y.%m.%d').date() if match else None
+
+
+def _date_range_query(date_field, max_days, catalog=None, before=None):
+    """
+    the query of the documents where the date_field is older than max_days,
+    of the catalog and where the date_field is before the given date, if passed
+
+    raises SearchError
+    """
+    if not date_field or date_field.strip()=='':
+        raise SearchError("Cannot delete without a date_field")
+
+    if not max_days or not isinstance(max_days, Integral):
+        raise SearchError("Cannot delete without max_days")
+
+    query = {"range": {date_field: {"lte": f"now-{max_days}d"}}}
+    filters = []
+    if catalog:
+        filters.append({"term": {"catalog": catalog}})
+    if before:
+        filters.append({"range": {date_field: {"lt": before.isoformat()}}})
+    if filters:
+        query = {"bool": {"filter": [query] + filters}}
+    return query
+
+
+def _task_status(get_task_response):
+    """
+    the progress of a delete by query task, from the response of the tasks API:
+    the counters are read in the response of the task once completed, in its status otherwise
+    """
+    completed = bool(get_task_response.get('completed'))
+    task = get_task_response.get('task', {})
+    status = get_task_response.get('response', {}) if completed else task.get('status', {})
+
+    return {
+        'completed': completed,
+        'total': status.get('total', 0),
+        'deleted': status.get('deleted', 0),
+        'batches': status.get('batches', 0),
+        'version_conflicts': status.get('version_conflicts', 0),
+        'throttled_millis': status.get('throttled_millis', 0),
+        'requests_per_second': status.get('requests_per_second'),
+        'running_time_ms': int(task.get('running_time_in_nanos', 0) / 1000000),
+        'error': get_task_response.get('error') or (status.get('failures') or None)
+    }
+
+
+def is_conflict(error):
+    """True when the error returned by bulk_save() is due to a concurrent write of the document"""
+    return isinstance(error, dict) and error.get('type') == 'version_conflict_engine_exception'
+
+
 class MonitoringError(Exception):
     """To be raised at Monitoring time
     """
@@ -99,23 +314,36 @@ class ElasticSession():
     def health(self):
         """health of the index"""
         try:
-            client = Elasticsearch(hosts=self.hosts)
+            client = ElasticClientRegistry.get_client(self.hosts)
             return client.cluster.health(index=self.zone)
         except ElasticsearchException as ese:
             raise MonitoringError(ese)
 
 
-    def get(self, id):
-        """raise SearchError"""
+    def get(self, id, routing=None):
+        """
+        the routing of the catalog of the document is to be passed in a routed zone (see catalog_routing),
+        the document is searched in all the shards otherwise
+
+        raise SearchError
+        """
         if not id or id.strip()=='':
             raise SearchError("Cannot get data without an id")
 
+        if is_partitioned(self.zone) or (is_routed(self.zone) and not routing):
+            # a get is not possible on an alias of several indices, nor without the routing of the document
+            located = self.locate([id])
+            return located[id][1] if id in located else None
+
+        params = {'routing': routing} if routing else {}
+
         try:
-            client = Elasticsearch(hosts=self.hosts)
+            client = ElasticClientRegistry.get_client(self.hosts)
             res = client.get(
                     index=self.zone,
                     id=id,
-                    doc_type=_DOCUMENT_TYPE
+                    doc_type=_DOCUMENT_TYPE,
+                    **params
                 )
             if res and res['found']:
                 return res['_source']
@@ -127,33 +355,175 @@ class ElasticSession():
             raise SearchError(err)
 
 
-    def delete_date_range(self, date_field, max_days):
+    def mget(self, ids, source_fields=None, with_version=False, routing=None):
+        """
+        fetches the documents of the given ids in a single request,
+        returns a dict {id: _source} of the documents found, missing ids are not in the dict
+
+        :param source_fields: optional list of fields to be returned in the _source, all fields are returned if None
+        :param with_version: returns a dict {id: (_version, _source)}, the version being used for optimistic concurrency control
+        :param routing: the routing of the documents, in a routed zone all the documents must have the same routing
+
+        raise SearchError
+        """
+        ids = [_id for _id in ids if _id and _id.strip()]
+        if not ids:
+            return {}
+
+        if is_partitioned(self.zone):
+            # a mget is not possible on an alias of several indices
+            return {
+                _id: (version, source) if with_version else source
+                for _id, (index, source, version) in self.locate(ids, source_fields=source_fields, with_version=True, routing=routing).items()
+            }
+
+        params = {'routing': routing} if routing else {}
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            with ES_REQUEST_DURATION.time(operation='mget'):
+                res = client.mget(
+                        index=self.zone,
+                        doc_type=_DOCUMENT_TYPE,
+                        body={'ids': ids},
+                        _source=source_fields if source_fields is not None else True,
+                        **params
+                    )
+            return {
+                doc['_id']: (doc.get('_version'), doc.get('_source', {})) if with_version else doc.get('_source', {})
+                for doc in res['docs'] if doc.get('found')
+            }
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    def locate(self, ids, source_fields=None, with_version=False, routing=None):
+        """
+        finds the documents of the given ids with an ids query, which works on an alias of several indices,
+        returns a dict {id: (index, _source)}, when a document is found in several indices the most recent index is kept
+
+        :param with_version: returns a dict {id: (index, _source, _version)}
+        :param routing: the routing of the documents, only the shard of the routing is searched
+
+        raise SearchError
+        """
+        ids = [_id for _id in ids if _id and _id.strip()]
+        if not ids:
+            return {}
+
+        params = {'routing': routing} if routing else {}
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            with ES_REQUEST_DURATION.time(operation='locate'):
+                res = client.search(
+                        index=self.zone,
+                        body={
+                            'query': {'ids': {'values': ids}},
+                            'size': len(ids) * 2,
+                            '_source': source_fields if source_fields is not None else True,
+                            'version': with_version
+                        },
+                        **params
+                    )
+            located = {}
+            for hit in res['hits']['hits']:
+                if hit['_id'] not in located or hit['_index'] > located[hit['_id']][0]:
+                    located[hit['_id']] = (hit['_index'], hit.get('_source', {}))
+                    if with_version:
+                        located[hit['_id']] += (hit.get('_version'), )
+            return located
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    def search_ids(self, ids, source_fields=None, routing=None):
+        """
+        the documents of the given ids returned by a search, thus visible to the users once the index is refreshed,
+        as a dict {id: _source}
+
+        raise SearchError
+        """
+        ids = [_id for _id in ids if _id and _id.strip()]
+        if not ids:
+            return {}
+
+        params = {'routing': routing} if routing else {}
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            res = client.search(
+                    index=self.zone,
+                    body={
+                        'query': {'ids': {'values': ids}},
+                        'size': len(ids) * 2,
+                        '_source': source_fields if source_fields is not None else True
+                    },
+                    request_cache=False,
+                    **params
+                )
+            return {hit['_id']: hit.get('_source', {}) for hit in res['hits']['hits']}
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    def scan_page(self, after=None, size=500, source_fields=None, with_version=False):
+        """
+        reads a page of the documents of the zone, sorted by _id, starting after the _id passed,
+        so that a scan can be resumed from the last _id read (the scroll contexts of ES 6 cannot be kept for hours)
+
+        returns a list of tuples (id, index, _source), the page is empty at the end of the scan
+
+        :param with_version: returns a list of tuples (id, index, _source, _version)
+
+        raise SearchError
+        """
+        body = {
+            'query': {'match_all': {}},
+            'size': size,
+            'sort': [{'_id': 'asc'}],
+            '_source': source_fields if source_fields is not None else True,
+            'version': with_version
+        }
+        if after:
+            body['search_after'] = [after]
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            res = client.search(index=self.zone, body=body, request_cache=False)
+            return [
+                (hit['_id'], hit['_index'], hit.get('_source', {})) + ((hit.get('_version'), ) if with_version else ())
+                for hit in res['hits']['hits']
+            ]
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    def delete_date_range(self, date_field, max_days, catalog=None, before=None):
         """
         deletes documents where the date_field is older than the given range,
         returns the number of docs deleted
 
+        when a catalog is passed, only the documents of the catalog are deleted (in the shard of the catalog in a routed zone),
+        when a date is passed as before, only the documents where the date_field is before this date are deleted
+
         raises SearchError
         """
-        if not date_field or date_field.strip()=='':
-            raise SearchError("Cannot delete without a date_field")
+        query = _date_range_query(date_field, max_days, catalog=catalog, before=before)
 
-        if not max_days or not isinstance(max_days, Integral):
-            raise SearchError("Cannot delete without max_days")
+        params = {}
+        if catalog_routing(self.zone, catalog):
+            params['routing'] = catalog_routing(self.zone, catalog)
 
         try:
-            client = Elasticsearch(hosts=self.hosts)
+            client = ElasticClientRegistry.get_client(self.hosts)
             res = client.delete_by_query(
                         index=self.zone,
                         doc_type=_DOCUMENT_TYPE,
                         body={
-                            "query": {
-                                "range": {
-                                    date_field: {
-                                        "lte": f"now-{max_days}d"
-                                    }
-                                }
-                            }
-                        }
+                            "query": query
+                        },
+                        **params
                     )
 
             return res['deleted']
@@ -162,6 +532,57 @@ class ElasticSession():
             raise SearchError(err)
 
 
+    def start_delete_date_range(self, date_field, max_days, catalog=None, before=None):
+        """
+        starts the deletion of the documents matched as in delete_date_range as an Elasticsearch task,
+        run in parallel slices and throttled to config.ES.ES_DELETE_REQUESTS_PER_SECOND if set
+
+        returns the id of the task, to be polled with task_status
+
+        raises SearchError
+        """
+        query = _date_range_query(date_field, max_days, catalog=catalog, before=before)
+
+        params = {}
+        if config.ES.ES_DELETE_REQUESTS_PER_SECOND:
+            params['requests_per_second'] = config.ES.ES_DELETE_REQUESTS_PER_SECOND
+        if catalog_routing(self.zone, catalog):
+            params['routing'] = catalog_routing(self.zone, catalog)
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            res = client.delete_by_query(
+                        index=self.zone,
+                        doc_type=_DOCUMENT_TYPE,
+                        body={
+                            "query": query
+                        },
+                        slices='auto',
+                        conflicts='proceed',
+                        wait_for_completion=False,
+                        **params
+                    )
+
+            return res['task']
+
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    def task_status(self, task_id):
+        """
+        the progress of an Elasticsearch task started by start_delete_date_range (see _task_status)
+
+        raises SearchError
+        """
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            return _task_status(client.tasks.get(task_id=task_id))
+
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
     def save(self, id, dict_of_data, force_refresh=False):
         """raise IndexError"""
 
@@ -169,7 +590,7 @@ class ElasticSession():
             raise IndexError("Cannot index data without an id")
 
         try:
-            client = Elasticsearch(hosts=self.hosts)
+            client = ElasticClientRegistry.get_client(self.hosts)
             response = client.index(
                     index=self.zone,
                     doc_type=_DOCUMENT_TYPE,
@@ -182,116 +603,931 @@ class ElasticSession():
             raise IndexError(err)
 
 
-    def create_index(self):
-        """raise IndexError"""
-        try:
-            client = Elasticsearch(hosts=self.hosts)
-            index_exists = client.indices.exists(index=self.zone)
+    def bulk_save(self, docs, force_refresh=False, index=None, deletes=None, updates=None, versions=None, routings=None):
+        """
+        indexes the documents {id: dict_of_data} using the bulk API,
+        returns a dict {id: error} of the documents which could not be indexed or updated,
+        see is_conflict() to detect the errors due to concurrent writes
+
+        :param index: the index where the documents are written, the zone by default
+        :param versions: optional dict {id: _version} of the documents to be written or updated only if they were not changed meanwhile,
+                        a document with a version None is created only if it does not exist
+        :param deletes: optional dict {id: index} of copies to be deleted in the same bulk request,
+                        used to move documents to the newest partition of a partitioned zone
+        :param updates: optional dict {id: partial_doc} of existing documents to be partially updated in the same bulk request,
+                        the updates without version are retried on conflict, the partial document not depending on the previous content
+        :param routings: optional dict {id: routing} of the routing of the documents written, updated or deleted, see catalog_routing()
 
-            # check if the Elasticsearch index exists
-            if index_exists:
-                raise IndexError(f"Index {self.zone} already existing")
+        raise IndexError
+        """
+        if not docs and not updates:
+            return {}
 
-            client.indices.create(
-                index=self.zone,
-                body={
-                    'settings': _SETTINGS,
-                    'mappings': _MAPPING
-                }
-            )
+        if any([not _id or _id.strip()=='' for _id in list(docs.keys()) + list((updates or {}).keys())]):
+            raise IndexError("Cannot index data without an id")
+
+        versions = versions or {}
+        actions = []
+        for _id, dict_of_data in docs.items():
+            action = {
+                '_op_type': 'index',
+                '_index': index or self.zone,
+                '_type': _DOCUMENT_TYPE,
+                '_id': _id,
+                '_source': dict_of_data
+            }
+            if _id in versions:
+                if versions[_id] is None:
+                    action['_op_type'] = 'create'
+                else:
+                    action['_version'] = versions[_id]
+            actions.append(action)
+        for _id, partial_doc in (updates or {}).items():
+            action = {
+                '_op_type': 'update',
+                '_index': index or self.zone,
+                '_type': _DOCUMENT_TYPE,
+                '_id': _id,
+                'doc': partial_doc
+            }
+            if versions.get(_id) is not None:
+                action['_version'] = versions[_id]
+            else:
+                # partial updates do not depend on the previous content of the document
+                action['retry_on_conflict'] = config.ES.ES_CONFLICT_RETRIES
+            actions.append(action)
+        actions.extend([
+            {
+                '_op_type': 'delete',
+                '_index': old_index,
+                '_type': _DOCUMENT_TYPE,
+                '_id': _id
+            }
+            for _id, old_index in (deletes or {}).items()
+        ])
+
+        for action in actions:
+            if (routings or {}).get(action['_id']):
+                action['_routing'] = routings[action['_id']]
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            with ES_REQUEST_DURATION.time(operation='bulk'):
+                success, errors = helpers.bulk(
+                        client,
+                        actions,
+                        chunk_size=config.ES.ES_BULK_CHUNK_SIZE,
+                        raise_on_error=False,
+                        refresh=force_refresh
+                    )
+            LOGGER.info(f"Indexed {success} documents in {self.zone}, refresh={force_refresh})")
+
+            # each error is like {'index': {'_id': ..., 'error': ...}}
+            failures = {}
+            for error in errors:
+                for op_type, op_result in error.items():
+                    if op_type == 'delete':
+                        # the copy remains in the previous partition until it's dropped
+                        LOGGER.warning(f"Unable to delete {op_result.get('_id')} from {op_result.get('_index')}")
+                    else:
+                        failures[op_result.get('_id')] = op_result.get('error')
+            return failures
 
         except ElasticsearchException as err:
-            LOGGER.critical(err)
             raise IndexError(err)
 
 
-    def delete_index(self):
-        """raise IndexError"""
+    def begin_ingest(self):
+        """
+        optimizes the index for bulk writes: disables the periodic refresh and drops the replicas,
+        returns the previous settings, to be passed to end_ingest()
 
+        raise IndexError
+        """
         try:
-            client = Elasticsearch(hosts=self.hosts)
-            index_exists = client.indices.exists(index=self.zone)
-
-            # check if the Elasticsearch index exists
-            if index_exists == False:
-                raise IndexError(f"Index {self.zone} does not exist")
-
-            client.indices.delete(index=self.zone)
+            client = ElasticClientRegistry.get_client(self.hosts)
+            previous = _ingest_settings(client.indices.get_settings(
+                    index=self.zone,
+                    name=list(_INGEST_SETTINGS.keys()),
+                    flat_settings=True
+                ))
+            client.indices.put_settings(
+                index=self.zone,
+                body=_INGEST_SETTINGS
+            )
+            LOGGER.info(f"Ingest session started on {self.zone}, previous settings: {previous}")
+            return previous
 
         except ElasticsearchException as err:
             raise IndexError(err)
 
 
-class ElasticMonitoring():
-    """static interface to monitor the Elasticsearch cluster, given a zone and a list of hosts"""
-
-    @staticmethod
-    def monitor(zone):
+    def end_ingest(self, previous, force_merge=False):
         """
-        raise MonitoringError
+        restores the settings returned by begin_ingest() and refreshes the index once,
+        the segments are merged afterwards if force_merge is set
 
-        :Example:
-        >>> ElasticMonitoring.monitor(zone)
+        :param previous: the settings returned by begin_ingest(), {'index.refresh_interval': ..., 'index.number_of_replicas': ...}
+                         a None value resets the setting to its default value
 
+        raise IndexError
         """
         try:
-            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
-            return session.health()
-        except ValueError as ve:
-            raise MonitoringError(ve)
+            client = ElasticClientRegistry.get_client(self.hosts)
+            client.indices.put_settings(
+                index=self.zone,
+                body=previous or {}
+            )
+            client.indices.refresh(index=self.zone)
 
+            if force_merge:
+                # the merge may take long on large indices, do not apply the default timeout
+                client.indices.forcemerge(
+                    index=self.zone,
+                    max_num_segments=1,
+                    request_timeout=config.ES.ES_FORCE_MERGE_TIMEOUT
+                )
 
-class ElasticCommand():
-    """
-    static interface to manage elasticsearch indices and data
-    """
+            LOGGER.info(f"Ingest session ended on {self.zone}, restored settings: {previous}, force_merge={force_merge}")
 
-    @staticmethod
-    def get(zone, id):
-        """
-        raise SearchError
+        except ElasticsearchException as err:
+            raise IndexError(err)
 
-        :Example:
-        >>> ElasticCommand.get(zone, id)
-        True
 
+    def ensure_partition(self):
         """
+        creates the current partition of a partitioned zone if it does not exist yet,
+        returns the name of the partition where documents are written
+
+        raise IndexError
+        """
+        partition = _partition_name(self.zone)
         try:
-            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
-            return session.get(id)
-        except ValueError as ve:
-            raise SearchError(ve)
+            client = ElasticClientRegistry.get_client(self.hosts)
+            if not client.indices.exists(index=partition):
+                client.indices.create(
+                    index=partition,
+                    body={
+                        'settings': _index_settings(self.zone),
+                        'mappings': _index_mapping(self.zone),
+                        'aliases': {self.zone: {}}
+                    }
+                )
+                LOGGER.info(f"Created partition {partition}")
+            return partition
+
+        except RequestError as err:
+            # created in the meantime by another job
+            if err.error == 'resource_already_exists_exception':
+                return partition
+            raise IndexError(err)
+        except ElasticsearchException as err:
+            raise IndexError(err)
 
 
-    @staticmethod
-    def save(zone, id, dict_of_data, force_refresh=False):
+    def drop_expired_partitions(self, max_days):
         """
-        raise IndexError
+        deletes the documents of a partitioned zone where scraping_end_date is older than max_days:
+        the partitions where all documents are obsolete are dropped,
+        a delete by query is run on the partition overlapping the limit, if any
 
-        :Example:
-        >>> ElasticCommand.save(zone, id, dict_of_data, force_refresh=False)
-        True
+        returns the number of docs deleted
 
+        raise SearchError
         """
+        if not max_days or not isinstance(max_days, Integral):
+            raise SearchError("Cannot delete without max_days")
+
+        # documents last seen on or before this day are obsolete
+        limit = date.today() - timedelta(days=max_days)
+
         try:
-            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            client = ElasticClientRegistry.get_client(self.hosts)
+            if not client.indices.exists_alias(name=self.zone):
+                return 0
+
+            deleted = 0
+            for index in _aliased_indices(client.indices.get_alias(name=self.zone)):
+                start = _partition_date(self.zone, index)
+                if start is None:
+                    continue
+
+                end = start + timedelta(days=config.ENV.PARTITION_PERIOD_DAYS - 1)
+                if end <= limit:
+                    count = client.count(index=index)['count']
+                    client.indices.delete(index=index)
+                    LOGGER.info(f"Dropped partition {index} ({count} documents)")
+                    deleted += count
+                elif start <= limit:
+                    res = client.delete_by_query(
+                        index=index,
+                        doc_type=_DOCUMENT_TYPE,
+                        body={
+                            "query": {
+                                "range": {
+                                    "scraping_end_date": {
+                                        "lte": f"now-{max_days}d"
+                                    }
+                                }
+                            }
+                        }
+                    )
+                    deleted += res['deleted']
+
+            return deleted
+
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    def create_index(self):
+        """
+        creates the first version of the zone index, the zone being an alias of this index,
+        or the first partition of a partitioned zone
+
+        raise IndexError
+        """
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            index_exists = client.indices.exists(index=self.zone)
+
+            # check if the Elasticsearch index exists
+            if index_exists:
+                raise IndexError(f"Index {self.zone} already existing")
+
+            client.indices.create(
+                index=_partition_name(self.zone) if is_partitioned(self.zone) else _index_name(self.zone, 1),
+                body={
+                    'settings': _index_settings(self.zone),
+                    'mappings': _index_mapping(self.zone),
+                    'aliases': {self.zone: {}}
+                }
+            )
+
+        except ElasticsearchException as err:
+            LOGGER.critical(err)
+            raise IndexError(err)
+
+
+    def delete_index(self):
+        """
+        deletes the indices behind the zone alias,
+        or the index named after the zone for the zones created before versioning
+
+        raise IndexError
+        """
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+            index_exists = client.indices.exists(index=self.zone)
+
+            # check if the Elasticsearch index exists
+            if index_exists == False:
+                raise IndexError(f"Index {self.zone} does not exist")
+
+            if client.indices.exists_alias(name=self.zone):
+                indices = _aliased_indices(client.indices.get_alias(name=self.zone))
+            else:
+                indices = [self.zone]
+
+            client.indices.delete(index=','.join(indices))
+
+        except ElasticsearchException as err:
+            raise IndexError(err)
+
+
+    def reindex(self, keep_previous=False):
+        """
+        copies the documents of the zone into a new version of its index, created with the current settings and mapping of the zone,
+        then points the zone alias to the new version in a single atomic operation.
+
+        The copy is performed by Elasticsearch (reindex API), in parallel slices, the documents keep their version.
+        The zone remains searchable and writable during the copy. The writes to the current version are then refused
+        (index.blocks.write) until the alias is swapped, while the documents updated during the copy
+        (with a greater version) are copied again and the documents deleted during the copy are deleted from the new version,
+        so that no write is lost: the writes refused meanwhile fail and are retried by the indexing
+
+        A zone created before versioning (an index named after the zone) is migrated:
+        the legacy index is removed in the same operation as the alias is created
+
+        :param keep_previous: if False, the previous version is deleted after the swap
+
+        returns the name of the new index
+
+        raise IndexError
+        """
+        if is_partitioned(self.zone):
+            raise IndexError(f"Zone {self.zone} is partitioned, its partitions cannot be reindexed in a single version")
+
+        try:
+            client = ElasticClientRegistry.get_client(self.hosts)
+
+            if client.indices.exists_alias(name=self.zone):
+                current_indices = _aliased_indices(client.indices.get_alias(name=self.zone))
+                legacy = False
+            elif client.indices.exists(index=self.zone):
+                current_indices = [self.zone]
+                legacy = True
+            else:
+                raise IndexError(f"Index {self.zone} does not exist")
+
+            # the next version follows the greatest existing version of the zone
+            existing = _aliased_indices(client.indices.get(index=f"{self.zone}*"))
+            versions = [_index_version(self.zone, name) for name in existing + current_indices]
+            new_index = _index_name(self.zone, max([v for v in versions if v is not None] + [0]) + 1)
+
+            LOGGER.info(f"Reindexing {current_indices} into {new_index}")
+
+            # the shards of a compact zone are sized for the volume of the current version
+            size_in_bytes = 0
+            if is_compact(self.zone):
+                stats = client.indices.stats(index=','.join(current_indices), metric='store')
+                size_in_bytes = stats['_all']['primaries']['store']['size_in_bytes']
+
+            # write optimized during the copy, the base settings spelled without the index. prefix
+            # are left out, Elasticsearch would not tell which spelling of a setting applies
+            settings = {k: v for k, v in _index_settings(self.zone, size_in_bytes).items() if f"index.{k}" not in _INGEST_SETTINGS}
+            client.indices.create(
+                index=new_index,
+                body={
+                    'settings': dict(settings, **_INGEST_SETTINGS),
+                    'mappings': _index_mapping(self.zone)
+                }
+            )
+
+            self._wait_for_reindex(client, current_indices, new_index)
+
+            # from the catch up until the swap, the current version is read-only
+            self._block_writes(client, current_indices, True)
+            try:
+                # catch up the documents updated and deleted during the copy,
+                # the copy and the comparison read the documents visible to the searches
+                client.indices.refresh(index=','.join(current_indices))
+                self._wait_for_reindex(client, current_indices, new_index)
+                client.indices.refresh(index=new_index)
+                self._delete_missing(client, current_indices, new_index)
+
+                client.indices.put_settings(
+                    index=new_index,
+                    body={'index.refresh_interval': None, 'index.number_of_replicas': config.ES.ES_REPLICAS}
+                )
+                client.indices.refresh(index=new_index)
+
+                if legacy:
+                    actions = [
+                        {'remove_index': {'index': self.zone}},
+                        {'add': {'index': new_index, 'alias': self.zone}}
+                    ]
+                else:
+                    actions = [{'remove': {'index': index, 'alias': self.zone}} for index in current_indices]
+                    actions.append({'add': {'index': new_index, 'alias': self.zone}})
+
+                client.indices.update_aliases(body={'actions': actions})
+                LOGGER.info(f"Alias {self.zone} swapped to {new_index}")
+
+            except (ElasticsearchException, IndexError):
+                self._block_writes(client, current_indices, False)
+                raise
+
+            if not legacy and not keep_previous:
+                client.indices.delete(index=','.join(current_indices))
+            elif not legacy:
+                self._block_writes(client, current_indices, False)
+
+            return new_index
+
+        except ElasticsearchException as err:
+            LOGGER.critical(err)
+            raise IndexError(err)
+
+
+    def _block_writes(self, client, indices, blocked):
+        """refuses (or accepts again) the writes to the indices, the searches are not affected"""
+        client.indices.put_settings(
+            index=','.join(indices),
+            body={'index.blocks.write': True if blocked else None}
+        )
+        LOGGER.info(f"Writes to {indices} {'blocked' if blocked else 'unblocked'}")
+
+
+    def _wait_for_reindex(self, client, source_indices, dest_index):
+        """
+        runs the reindex as a task, polls the task until it's completed, raise IndexError if some documents failed
+
+        the documents keep their version (external version type), the documents already copied
+        with the same version are skipped (version conflicts), so that only the documents updated since are copied again
+        """
+        body = {
+            'source': {'index': source_indices},
+            'dest': {'index': dest_index, 'version_type': 'external'},
+            'conflicts': 'proceed'
+        }
+        if is_routed(self.zone):
+            # the documents are routed by catalog in the new version, whatever their previous routing
+            body['script'] = {'source': _ROUTING_SCRIPT, 'lang': 'painless'}
+
+        res = client.reindex(
+            body=body,
+            slices='auto',
+            wait_for_completion=False
+        )
+        task_id = res['task']
+
+        while True:
+            task = client.tasks.get(task_id=task_id)
+            if task.get('completed'):
+                break
+            time.sleep(config.ES.ES_REINDEX_POLL_INTERVAL)
+
+        if task.get('error'):
+            raise IndexError(f"Reindex of {source_indices} into {dest_index} failed: {task['error']}")
+
+        response = task.get('response', {})
+        if response.get('failures'):
+            raise IndexError(f"Reindex of {source_indices} into {dest_index} failed: {response['failures'][:10]}")
+
+        LOGGER.info(f"Reindexed {response.get('total')} documents from {source_indices} into {dest_index}, {response.get('version_conflicts')} unchanged")
+        return response
+
+
+    def _delete_missing(self, client, source_indices, dest_index, size=1000):
+        """
+        deletes from the dest index the documents which do not exist anymore in the source indices,
+        the dest index is scanned by pages sorted by _id, returns the number of documents deleted
+
+        raise IndexError if some documents could not be deleted
+        """
+        deleted = 0
+        after = None
+        while True:
+            body = {'query': {'match_all': {}}, 'size': size, 'sort': [{'_id': 'asc'}], '_source': False}
+            if after:
+                body['search_after'] = [after]
+            hits = client.search(index=dest_index, body=body, request_cache=False)['hits']['hits']
+            if not hits:
+                break
+            after = hits[-1]['_id']
+
+            ids = [hit['_id'] for hit in hits]
+            res = client.search(
+                index=','.join(source_indices),
+                body={'query': {'ids': {'values': ids}}, 'size': len(ids), '_source': False},
+                request_cache=False
+            )
+            existing = set([hit['_id'] for hit in res['hits']['hits']])
+
+            actions = []
+            for hit in hits:
+                if hit['_id'] in existing:
+                    continue
+                action = {'_op_type': 'delete', '_index': dest_index, '_type': _DOCUMENT_TYPE, '_id': hit['_id']}
+                if hit.get('_routing'):
+                    action['_routing'] = hit['_routing']
+                actions.append(action)
+
+            if actions:
+                success, errors = helpers.bulk(client, actions, raise_on_error=False)
+                if errors:
+                    raise IndexError(f"Unable to delete from {dest_index} the documents deleted from {source_indices}: {errors[:10]}")
+                deleted += success
+
+        LOGGER.info(f"Deleted from {dest_index} {deleted} documents deleted from {source_indices} during the copy")
+        return deleted
+
+
+class AsyncElasticSession():
+    """
+    asyncio counterpart of ElasticSession, to be used in the Sanic handlers
+    so that the event loop is not blocked while Elasticsearch is processing the requests
+    """
+
+    def __init__(self, hosts, zone):
+        """raise ValueError"""
+
+        if not zone or zone.strip()=='':
+            raise ValueError("zone param must not be null or blank")
+
+        self.hosts = hosts
+        self.zone = zone
+
+
+    async def health(self):
+        """health of the index"""
+        try:
+            client = ElasticClientRegistry.get_async_client(self.hosts)
+            return await client.cluster.health(index=self.zone)
+        except ElasticsearchException as ese:
+            raise MonitoringError(ese)
+
+
+    async def get(self, id, routing=None):
+        """see ElasticSession.get()
+
+        raise SearchError
+        """
+        if not id or id.strip()=='':
+            raise SearchError("Cannot get data without an id")
+
+        params = {'routing': routing} if routing else {}
+
+        try:
+            client = ElasticClientRegistry.get_async_client(self.hosts)
+            if is_routed(self.zone) and not routing:
+                # the document is searched in all the shards of the zone
+                res = await client.search(index=self.zone, body={'query': {'ids': {'values': [id]}}, 'size': 1})
+                hits = res['hits']['hits']
+                return hits[0].get('_source', {}) if hits else None
+
+            res = await client.get(
+                    index=self.zone,
+                    id=id,
+                    doc_type=_DOCUMENT_TYPE,
+                    **params
+                )
+            if res and res['found']:
+                return res['_source']
+            return None
+        except NotFoundError as n:
+            LOGGER.debug(f"Item {id} not found in index '{self.zone}'")
+            return None
+        except ElasticsearchException as err:
+            raise SearchError(err)
+
+
+    async def begin_ingest(self):
+        """
+        see ElasticSession.begin_ingest()
+
+        raise IndexError
+        """
+        try:
+            client = ElasticClientRegistry.get_async_client(self.hosts)
+            previous = _ingest_settings(await client.indices.get_settings(
+                    index=self.zone,
+                    name=list(_INGEST_SETTINGS.keys()),
+                    flat_settings=True
+                ))
+            await client.indices.put_settings(
+                index=self.zone,
+                body=_INGEST_SETTINGS
+            )
+            LOGGER.info(f"Ingest session started on {self.zone}, previous settings: {previous}")
+            return previous
+
+        except ElasticsearchException as err:
+            raise IndexError(err)
+
+
+    async def create_index(self):
+        """see ElasticSession.create_index()
+
+        raise IndexError
+        """
+        try:
+            client = ElasticClientRegistry.get_async_client(self.hosts)
+            index_exists = await client.indices.exists(index=self.zone)
+
+            # check if the Elasticsearch index exists
+            if index_exists:
+                raise IndexError(f"Index {self.zone} already existing")
+
+            await client.indices.create(
+                index=_partition_name(self.zone) if is_partitioned(self.zone) else _index_name(self.zone, 1),
+                body={
+                    'settings': _index_settings(self.zone),
+                    'mappings': _index_mapping(self.zone),
+                    'aliases': {self.zone: {}}
+                }
+            )
+
+        except ElasticsearchException as err:
+            LOGGER.critical(err)
+            raise IndexError(err)
+
+
+    async def delete_index(self):
+        """see ElasticSession.delete_index()
+
+        raise IndexError
+        """
+
+        try:
+            client = ElasticClientRegistry.get_async_client(self.hosts)
+            index_exists = await client.indices.exists(index=self.zone)
+
+            # check if the Elasticsearch index exists
+            if index_exists == False:
+                raise IndexError(f"Index {self.zone} does not exist")
+
+            if await client.indices.exists_alias(name=self.zone):
+                indices = _aliased_indices(await client.indices.get_alias(name=self.zone))
+            else:
+                indices = [self.zone]
+
+            await client.indices.delete(index=','.join(indices))
+
+        except ElasticsearchException as err:
+            raise IndexError(err)
+
+
+# the caches of the searches of the web, see the node stats of Elasticsearch
+_CACHES = ['request_cache', 'query_cache']
+
+
+def _cache_ratios(node_stats):
+    """
+    the hits, misses, hit ratio, evictions and memory of the shard request cache and of the node query cache, per node,
+    the hit ratio is None until the cache is used
+
+    :Example:
+    >>> _cache_ratios(client.nodes.stats(metric='indices', index_metric='request_cache,query_cache'))
+    {'node-1': {'request_cache': {'hit_count': 90, 'miss_count': 10, 'hit_ratio': 0.9, 'evictions': 0, 'memory_size_in_bytes': 2048}, 'query_cache': {...}}}
+    """
+    result = {}
+    for node_id, node in node_stats.get('nodes', {}).items():
+        caches = {}
+        for cache in _CACHES:
+            stats = node.get('indices', {}).get(cache, {})
+            hits, misses = stats.get('hit_count', 0), stats.get('miss_count', 0)
+            caches[cache] = {
+                'hit_count': hits,
+                'miss_count': misses,
+                'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+                'evictions': stats.get('evictions', 0),
+                'memory_size_in_bytes': stats.get('memory_size_in_bytes', 0)
+            }
+        result[node.get('name', node_id)] = caches
+    return result
+
+
+class ElasticMonitoring():
+    """static interface to monitor the Elasticsearch cluster, given a zone and a list of hosts"""
+
+    @staticmethod
+    def caches():
+        """
+        the hit ratios of the caches of the nodes of the cluster (see _cache_ratios)
+
+        raise MonitoringError
+
+        :Example:
+        >>> ElasticMonitoring.caches()
+        {'node-1': {'request_cache': {...}, 'query_cache': {...}}}
+        """
+        try:
+            client = ElasticClientRegistry.get_client([config.ES.ES_HOST])
+            return _cache_ratios(client.nodes.stats(metric='indices', index_metric=','.join(_CACHES)))
+        except ElasticsearchException as ese:
+            raise MonitoringError(ese)
+
+
+    @staticmethod
+    def monitor(zone):
+        """
+        raise MonitoringError
+
+        :Example:
+        >>> ElasticMonitoring.monitor(zone)
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.health()
+        except ValueError as ve:
+            raise MonitoringError(ve)
+
+
+class ElasticCommand():
+    """
+    static interface to manage elasticsearch indices and data
+    """
+
+    @staticmethod
+    def get(zone, id, routing=None):
+        """
+        raise SearchError
+
+        :Example:
+        >>> ElasticCommand.get(zone, id)
+        True
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.get(id, routing=routing)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def save(zone, id, dict_of_data, force_refresh=False):
+        """
+        raise IndexError
+
+        :Example:
+        >>> ElasticCommand.save(zone, id, dict_of_data, force_refresh=False)
+        True
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
             return session.save(id, dict_of_data, force_refresh=force_refresh)
         except ValueError as ve:
             raise IndexError(ve)
 
 
     @staticmethod
-    def delete_date_range(zone, date_field, max_days):
+    def mget(zone, ids, source_fields=None, with_version=False, routing=None):
+        """
+        raise SearchError
+
+        :Example:
+        >>> ElasticCommand.mget(zone, ['id1', 'id2'], source_fields=['scraping_start_date'])
+        {'id1': {'scraping_start_date': '2020-05-01'}}
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.mget(ids, source_fields=source_fields, with_version=with_version, routing=routing)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def locate(zone, ids, source_fields=None, with_version=False, routing=None):
+        """
+        raise SearchError
+
+        :Example:
+        >>> ElasticCommand.locate(zone, ['id1', 'id2'], source_fields=['scraping_start_date'])
+        {'id1': ('mel-2020.05.01', {'scraping_start_date': '2020-05-01'})}
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.locate(ids, source_fields=source_fields, with_version=with_version, routing=routing)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def bulk_save(zone, docs, force_refresh=False, index=None, deletes=None, updates=None, versions=None, routings=None):
+        """
+        raise IndexError
+
+        :Example:
+        >>> ElasticCommand.bulk_save(zone, {'id1': dict_of_data}, force_refresh=False)
+        {}
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.bulk_save(
+                docs,
+                force_refresh=force_refresh,
+                index=index,
+                deletes=deletes,
+                updates=updates,
+                versions=versions,
+                routings=routings
+            )
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
+    @staticmethod
+    def ensure_partition(zone):
+        """
+        raise IndexError
+
+        :Example:
+        >>> ElasticCommand.ensure_partition(zone)
+        'mel-2020.05.01'
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.ensure_partition()
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
+    @staticmethod
+    def drop_expired_partitions(zone, max_days):
+        """
+        raise SearchError
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.drop_expired_partitions(max_days)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def search_ids(zone, ids, source_fields=None, routing=None):
+        """
+        raise SearchError
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.search_ids(ids, source_fields=source_fields, routing=routing)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def scan_page(zone, after=None, size=500, source_fields=None, with_version=False):
+        """
+        raise SearchError
+
+        :Example:
+        >>> ElasticCommand.scan_page(zone, after='glv_123', size=2)
+        [('glv_124', 'mel_v1', {...}), ('glv_125', 'mel_v1', {...})]
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.scan_page(after=after, size=size, source_fields=source_fields, with_version=with_version)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def delete_date_range(zone, date_field, max_days, catalog=None, before=None):
         """
         raise SearchError
         """
         try:
             session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
-            return session.delete_date_range(date_field, max_days)
+            return session.delete_date_range(date_field, max_days, catalog=catalog, before=before)
         except ValueError as ve:
             raise SearchError(ve)
 
 
+    @staticmethod
+    def start_delete_date_range(zone, date_field, max_days, catalog=None, before=None):
+        """
+        raise SearchError
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.start_delete_date_range(date_field, max_days, catalog=catalog, before=before)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def task_status(zone, task_id):
+        """
+        raise SearchError
+
+        :Example:
+        >>> ElasticCommand.task_status(zone, 'oTUltX4IQMOUUVeiohTt8A:12345')
+        {'completed': False, 'total': 1200, 'deleted': 300, 'batches': 1, 'throttled_millis': 0, ...}
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.task_status(task_id)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    def begin_ingest(zone):
+        """
+        raise IndexError
+
+        :Example:
+        >>> previous = ElasticCommand.begin_ingest(zone)
+        >>> # ... bulk writes ...
+        >>> ElasticCommand.end_ingest(zone, previous, force_merge=True)
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.begin_ingest()
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
+    @staticmethod
+    def end_ingest(zone, previous, force_merge=False):
+        """
+        raise IndexError
+
+        :Example:
+        >>> ElasticCommand.end_ingest(zone, previous, force_merge=False)
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.end_ingest(previous, force_merge=force_merge)
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
     @staticmethod
     def create_index(zone):
         """
@@ -324,3 +1560,124 @@ class ElasticCommand():
             return session.delete_index()
         except ValueError as ve:
             raise IndexError(ve)
+
+
+    @staticmethod
+    def reindex(zone, keep_previous=False):
+        """
+        raise IndexError
+
+        :Example:
+        >>> ElasticCommand.reindex(zone)
+        'mel_v2'
+
+        """
+        try:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return session.reindex(keep_previous=keep_previous)
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
+class AsyncElasticMonitoring():
+    """asyncio counterpart of ElasticMonitoring"""
+
+    @staticmethod
+    async def caches():
+        """
+        raise MonitoringError
+
+        :Example:
+        >>> await AsyncElasticMonitoring.caches()
+
+        """
+        try:
+            client = ElasticClientRegistry.get_async_client([config.ES.ES_HOST])
+            return _cache_ratios(await client.nodes.stats(metric='indices', index_metric=','.join(_CACHES)))
+        except ElasticsearchException as ese:
+            raise MonitoringError(ese)
+
+
+    @staticmethod
+    async def monitor(zone):
+        """
+        raise MonitoringError
+
+        :Example:
+        >>> await AsyncElasticMonitoring.monitor(zone)
+
+        """
+        try:
+            session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return await session.health()
+        except ValueError as ve:
+            raise MonitoringError(ve)
+
+
+class AsyncElasticCommand():
+    """
+    asyncio counterpart of ElasticCommand, for the operations triggered by the Sanic handlers
+    """
+
+    @staticmethod
+    async def get(zone, id, routing=None):
+        """
+        raise SearchError
+
+        :Example:
+        >>> await AsyncElasticCommand.get(zone, id)
+
+        """
+        try:
+            session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return await session.get(id, routing=routing)
+        except ValueError as ve:
+            raise SearchError(ve)
+
+
+    @staticmethod
+    async def begin_ingest(zone):
+        """
+        raise IndexError
+
+        :Example:
+        >>> previous = await AsyncElasticCommand.begin_ingest(zone)
+
+        """
+        try:
+            session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return await session.begin_ingest()
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
+    @staticmethod
+    async def create_index(zone):
+        """
+        raise IndexError
+
+        :Example:
+        >>> await AsyncElasticCommand.create_index(zone)
+
+        """
+        try:
+            session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return await session.create_index()
+        except ValueError as ve:
+            raise IndexError(ve)
+
+
+    @staticmethod
+    async def delete_index(zone):
+        """
+        raise IndexError
+
+        :Example:
+        >>> await AsyncElasticCommand.delete_index(zone)
+
+        """
+        try:
+            session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+            return await session.delete_index()
+        except ValueError as ve:
+            raise IndexError(ve)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+Consumers of the ingestion streams (see streams.py)
+
+Each consumer reads blocks of items from the streams of all the zones, indexes them in batch
+and acknowledges the items indexed. The items left pending, by a dead consumer or because they could not be indexed,
+are reclaimed after config.Q.STREAM_CLAIM_IDLE_MS and moved to the dead letter stream after config.Q.STREAM_MAX_DELIVERIES
+
+Run a pool of config.Q.STREAM_CONSUMERS consumers with:
+    python stream_consumer.py
+"""
+
+import os
+import time
+import signal
+import socket
+import logging
+from multiprocessing import Process
+
+import ujson as json
+from redis.exceptions import ResponseError
+
+from jobs.elastic_task import do_index, is_ingest_session_open
+from redis_client import redis_conn
+import streams
+import config
+
+# import settings to init logging and sentry
+import settings
+
+
+LOGGER = logging.getLogger('app')
+
+
+class StreamConsumer():
+    """
+    a member of the consumer group of the ingestion streams
+
+    :Example:
+    >>> consumer = StreamConsumer('consumer-1')
+    >>> consumer.run()
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stopped = False
+        self.last_reclaim = 0
+
+
+    def stop(self, *args):
+        LOGGER.info(f"Stopping consumer {self.name}")
+        self.stopped = True
+
+
+    def run(self):
+        """reads the streams until the consumer is stopped"""
+        LOGGER.info(f"Consumer {self.name} started")
+        self.ensure_groups()
+        try:
+            while not self.stopped:
+                if time.time() - self.last_reclaim >= config.Q.STREAM_CLAIM_IDLE_MS / 1000:
+                    self.reclaim()
+                    self.last_reclaim = time.time()
+                self.read()
+        finally:
+            self.leave()
+
+
+    def ensure_groups(self):
+        """creates the consumer groups of the streams of the known zones, the producers create the groups of the new zones"""
+        for zone in streams.zones():
+            streams.ensure_group(zone)
+
+
+    def read(self):
+        """reads a block of new items on each stream, returns the number of items read"""
+        zones = streams.zones()
+        if not zones:
+            time.sleep(config.Q.STREAM_BLOCK_MS / 1000)
+            return 0
+
+        try:
+            response = redis_conn.xreadgroup(
+                config.Q.STREAM_GROUP,
+                self.name,
+                {streams.stream_key(zone): '>' for zone in zones},
+                count=config.Q.STREAM_BLOCK_SIZE,
+                block=config.Q.STREAM_BLOCK_MS
+            )
+        except ResponseError as re:
+            # NOGROUP: a stream or its group was deleted
+            if 'NOGROUP' not in str(re):
+                raise
+            LOGGER.warning(f"Consumer {self.name} recreates the consumer groups: {re}")
+            self.ensure_groups()
+            return 0
+
+        count = 0
+        for key, entries in response or []:
+            zone = streams._decode(key)[len(streams.stream_key('')):]
+            self.process(zone, entries)
+            count += len(entries)
+        return count
+
+
+    def process(self, zone, entries):
+        """
+        indexes the entries of the stream of the zone, by catalog, and acknowledges the entries indexed
+
+        the entries not indexed are not acknowledged so that they are delivered again after the claim timeout,
+        until they are moved to the dead letter stream (see reclaim)
+        """
+        force_refresh = False if is_ingest_session_open(zone) else None
+
+        for catalog, catalog_entries in streams.parse_entries(entries).items():
+
+            invalid_ids = [entry_id for entry_id, product_dict, _ in catalog_entries if product_dict is None]
+            if invalid_ids:
+                self.bury(zone, invalid_ids)
+
+            valid = [(entry_id, product_dict, trace) for entry_id, product_dict, trace in catalog_entries if product_dict is not None]
+            if not valid:
+                continue
+
+            failures = []
+            result = do_index(
+                [product_dict for _, product_dict, _ in valid],
+                catalog,
+                zone,
+                force_refresh=force_refresh,
+                traces=[trace for _, _, trace in valid],
+                failures=failures
+            )
+
+            if failures:
+                LOGGER.error(f"Unable to index {len(failures)} items of catalog {catalog} in zone {zone}, they will be delivered again")
+
+            indexed_ids = [entry_id for position, (entry_id, _, _) in enumerate(valid) if position not in failures]
+            if indexed_ids:
+                streams.ack(zone, indexed_ids)
+                LOGGER.debug(f"Consumer {self.name} indexed {len(indexed_ids)} items of catalog {catalog} in zone {zone}: {result}")
+
+
+    def reclaim(self):
+        """
+        processes the entries pending for more than config.Q.STREAM_CLAIM_IDLE_MS,
+        entries delivered config.Q.STREAM_MAX_DELIVERIES times are moved to the dead letter stream of the zone
+        """
+        for zone in streams.zones():
+            key = streams.stream_key(zone)
+            try:
+                pending = redis_conn.xpending_range(
+                    key,
+                    config.Q.STREAM_GROUP,
+                    min='-',
+                    max='+',
+                    count=config.Q.STREAM_BLOCK_SIZE
+                )
+            except ResponseError as re:
+                if 'NOGROUP' not in str(re):
+                    raise
+                streams.ensure_group(zone)
+                continue
+            idle = [p for p in pending if p['time_since_delivered'] >= config.Q.STREAM_CLAIM_IDLE_MS]
+            if not idle:
+                continue
+
+            dead_ids = [streams._decode(p['message_id']) for p in idle if p['times_delivered'] >= config.Q.STREAM_MAX_DELIVERIES]
+            if dead_ids:
+                self.bury(zone, dead_ids)
+
+            claim_ids = [streams._decode(p['message_id']) for p in idle if p['times_delivered'] < config.Q.STREAM_MAX_DELIVERIES]
+            if claim_ids:
+                entries = redis_conn.xclaim(
+                    key,
+                    config.Q.STREAM_GROUP,
+                    self.name,
+                    min_idle_time=config.Q.STREAM_CLAIM_IDLE_MS,
+                    message_ids=claim_ids
+                )
+                LOGGER.info(f"Consumer {self.name} reclaimed {len(entries)} items of zone {zone}")
+                # entries deleted meanwhile are returned without fields
+                self.process(zone, [(entry_id, fields) for entry_id, fields in entries if fields])
+
+
+    def bury(self, zone, entry_ids):
+        """moves the entries to the dead letter stream of the zone"""
+        key = streams.stream_key(zone)
+        pipe = redis_conn.pipeline()
+        for entry_id in entry_ids:
+            for _, fields in redis_conn.xrange(key, min=entry_id, max=entry_id):
+                pipe.xadd(streams.dead_letter_key(zone), dict(fields, origin_id=entry_id), maxlen=config.Q.STREAM_DEAD_MAXLEN, approximate=True)
+        pipe.execute()
+        streams.ack(zone, entry_ids)
+        LOGGER.error(f"{len(entry_ids)} items of zone {zone} moved to {streams.dead_letter_key(zone)}")
+
+
+    def leave(self):
+        """removes the consumer from the groups where it has no pending entry"""
+        for zone in streams.zones():
+            key = streams.stream_key(zone)
+            try:
+                if not redis_conn.xpending_range(key, config.Q.STREAM_GROUP, min='-', max='+', count=1, consumername=self.name):
+                    redis_conn.xgroup_delconsumer(key, config.Q.STREAM_GROUP, self.name)
+            except Exception as e:
+                LOGGER.warning(f"Consumer {self.name} could not leave the group of {key}: {e}")
+
+
+def _run_consumer(index):
+    consumer = StreamConsumer(f"{socket.gethostname()}-{os.getpid()}-{index}")
+    signal.signal(signal.SIGTERM, consumer.stop)
+    signal.signal(signal.SIGINT, consumer.stop)
+    consumer.run()
+
+
+if __name__ == '__main__':
+
+    processes = [Process(target=_run_consumer, args=(i,)) for i in range(config.Q.STREAM_CONSUMERS)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+Redis Streams transport of the items to be indexed
+
+The items received for a zone are appended to the stream of the zone,
+they are read by blocks by the consumers of a consumer group (see stream_consumer.py),
+indexed in batch, acknowledged and deleted, so that the length of a stream is the number of its items waiting to be indexed.
+Items not acknowledged after config.Q.STREAM_CLAIM_IDLE_MS are reclaimed by another consumer,
+items delivered too many times are moved to a dead letter stream
+"""
+
+import logging
+
+import ujson as json
+from redis.exceptions import ResponseError
+
+from redis_client import redis_conn
+import config
+
+
+LOGGER = logging.getLogger('app')
+
+# the set of the zones having a stream, used by the consumers to discover the streams to read
+_ZONES_KEY = "reps:zones"
+
+
+def stream_key(zone):
+    return f"reps:{zone}"
+
+
+def dead_letter_key(zone):
+    return f"reps:dead:{zone}"
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def ensure_group(zone):
+    """creates the consumer group of the stream of the zone, and the stream itself, if they do not exist"""
+    try:
+        redis_conn.xgroup_create(stream_key(zone), config.Q.STREAM_GROUP, id='0', mkstream=True)
+    except ResponseError as re:
+        # BUSYGROUP: the group already exists
+        if 'BUSYGROUP' not in str(re):
+            raise
+
+
+def zones():
+    """the zones having a stream"""
+    return sorted([_decode(z) for z in redis_conn.smembers(_ZONES_KEY)])
+
+
+def append_items(products_list, catalog='', zone='', traces=None):
+    """
+    appends the items to the stream of the zone, returns the ids of the stream entries
+
+    the stream is not capped: the entries are deleted only once acknowledged (see ack),
+    its length being bounded by the backpressure of /reps (see tasks.is_ingestion_throttled),
+    the traces of the items (see tracing.py), if any, are stored with the items
+    """
+    ensure_group(zone)
+    key = stream_key(zone)
+
+    pipe = redis_conn.pipeline()
+    pipe.sadd(_ZONES_KEY, zone)
+    for product_dict, trace in zip(products_list, traces or [None] * len(products_list)):
+        fields = {'catalog': catalog, 'item': json.dumps(product_dict)}
+        if trace:
+            fields['trace'] = json.dumps(trace)
+        pipe.xadd(key, fields)
+    entry_ids = [_decode(entry_id) for entry_id in pipe.execute()[1:]]
+
+    LOGGER.debug(f"Appended {len(entry_ids)} items of catalog {catalog} to stream {key}")
+    return entry_ids
+
+
+def ack(zone, entry_ids):
+    """acknowledges the entries of the stream of the zone and deletes them"""
+    if not entry_ids:
+        return
+    key = stream_key(zone)
+    pipe = redis_conn.pipeline()
+    pipe.xack(key, config.Q.STREAM_GROUP, *entry_ids)
+    pipe.xdel(key, *entry_ids)
+    pipe.execute()
+
+
+def depths():
+    """
+    the number of items waiting to be indexed per zone, delivered or not,
+    the items being deleted once acknowledged (see ack)
+
+    :Example:
+    >>> streams.depths()
+    {'mel': 1200, 'nantes': 0}
+    """
+    zones_list = zones()
+    if not zones_list:
+        return {}
+    pipe = redis_conn.pipeline()
+    for zone in zones_list:
+        pipe.xlen(stream_key(zone))
+    return dict(zip(zones_list, pipe.execute()))
+
+
+def depth():
+    """the number of items waiting to be indexed in the streams of all the zones, see depths()"""
+    return sum(depths().values())
+
+
+def parse_entries(entries):
+    """
+    decodes the stream entries [(entry_id, fields)] into a dict {catalog: [(entry_id, product_dict, trace)]}
+    so that the items can be indexed by catalog, the trace is None when the item is not traced
+    """
+    by_catalog = {}
+    for entry_id, fields in entries:
+        fields = {_decode(k): _decode(v) for k, v in fields.items()}
+        try:
+            product_dict = json.loads(fields['item'])
+            trace = json.loads(fields['trace']) if fields.get('trace') else None
+        except (KeyError, ValueError):
+            LOGGER.error(f"Invalid stream entry {_decode(entry_id)}: {fields}")
+            product_dict, trace = None, None
+        by_catalog.setdefault(fields.get('catalog', ''), []).append((_decode(entry_id), product_dict, trace))
+    return by_catalog
+
+
+def stats():
+    """
+    state of the ingestion streams: per zone, the length of the stream (the items waiting to be indexed, see ack),
+    the number of entries not yet delivered to the group (lag) and the number of entries delivered but not acknowledged (pending)
+
+    :Example:
+    >>> streams.stats()
+    {
+        'mel': {
+            'length': 1200,
+            'dead': 2,
+            'groups': [{'name': 'indexers', 'consumers': 4, 'pending': 100, 'lag': 350, 'last_delivered_id': '...'}]
+        }
+    }
+    """
+    result = {}
+    for zone in zones():
+        key = stream_key(zone)
+        groups = []
+        try:
+            for group in redis_conn.xinfo_groups(key):
+                group = {_decode(k): _decode(v) for k, v in group.items()}
+                groups.append({
+                    'name': group.get('name'),
+                    'consumers': group.get('consumers'),
+                    'pending': group.get('pending'),
+                    # lag is available from Redis 7
+                    'lag': group.get('lag'),
+                    'last_delivered_id': group.get('last-delivered-id')
+                })
+        except ResponseError as re:
+            LOGGER.warning(f"No group on stream {key}: {re}")
+
+        result[zone] = {
+            'length': redis_conn.xlen(key),
+            'dead': redis_conn.xlen(dead_letter_key(zone)),
+            'groups': groups
+        }
+    return result
@@ -5,34 +5,30 @@ This module contains tasks which are supposed to run in background,
 managed by a redis queue for long time running tasks
 """
 
+import time
 import logging
-from datetime import datetime
-from urllib.parse import urlparse
+from datetime import datetime, timedelta
 
 from rq import Queue, Worker
 from rq_scheduler import Scheduler
-from redis import Redis
+import ujson as json
 
 import config
 
-# import settings to auto-configure sentry used in task do_send_to_sentry
+# import settings to init logging and sentry
 import settings
 
-from jobs.elastic_task import do_cleanup
+from jobs.elastic_task import do_cleanup, cleanup_stats, backfill_checkpoint_key, ingest_session_key
+from jobs.alerting_task import do_flush_errors
+from redis_client import redis_conn
+import streams
+import error_reports
+import dedup
 
 
 #############################################################################
 LOGGER = logging.getLogger("app")
 
-# Tell RQ what Redis connection to use
-# urlparse.uses_netloc.append('redis')
-url = urlparse(config.Q.REDIS_URL)
-redis_conn = Redis(
-    host=url.hostname,
-    port=url.port,
-    db=0,
-    password=url.password
-)
 
 # high_q has a higher priority
 high_q = Queue("high", connection=redis_conn)
@@ -43,12 +39,204 @@ low_q = Queue("low", connection=redis_conn)
 Tasks
 """
 
-def index_items(products_list, catalog='', zone=''):
-    job = high_q.enqueue('jobs.elastic_task.do_index', products_list, catalog, zone)
+def index_items(products_list, catalog='', zone='', traces=None, pipe=None):
+    """
+    returns the id of the RQ job indexing the items,
+    or the id of the last stream entry when the items are sent to the ingestion stream of the zone
+
+    the items already received within config.Q.INGEST_DEDUP_WINDOW are dropped (see dedup.py),
+    None is returned when all the items are dropped
+
+    traces is an optional list of the traces of the items (see tracing.py), in the same order as the items
+
+    pipe is an optional Redis pipeline holding commands of the caller (ex: the metrics of the request),
+    sent to Redis with the claim of the items and the check of the ingest session, in a single round trip
+    """
+    pipe = pipe if pipe is not None else redis_conn.pipeline()
+    # the replies of the commands of the caller are ignored
+    skipped = len(pipe.command_stack)
+    claims = dedup.queue_claim(pipe, products_list, catalog=catalog)
+    if config.Q.INGEST_TRANSPORT != 'stream':
+        pipe.exists(ingest_session_key(zone))
+    replies = pipe.execute()[skipped:] if pipe.command_stack else []
+
+    traces = traces or [None] * len(products_list)
+    is_new = dedup.claimed(products_list, replies[:claims], catalog=catalog)
+    kept = [(product_dict, trace) for product_dict, trace, new in zip(products_list, traces, is_new) if new]
+    if not kept:
+        return None
+
+    products_list = [product_dict for product_dict, _ in kept]
+    traces = [trace for _, trace in kept] if any([trace for _, trace in kept]) else None
+
+    try:
+        if config.Q.INGEST_TRANSPORT == 'stream':
+            return streams.append_items(products_list, catalog=catalog, zone=zone, traces=traces)[-1]
+
+        # the index is refreshed once at the end of the ingest session
+        force_refresh = False if bool(zone) and replies[claims] > 0 else None
+        job = high_q.enqueue('jobs.elastic_task.do_index', products_list, catalog, zone, force_refresh=force_refresh, traces=traces)
+        return job.id
+
+    except Exception:
+        # the items are not dropped when they are sent again
+        dedup.release(products_list, catalog)
+        raise
+
+# the depth of the ingestion is read at most once per second per process, not on every call to /reps
+_DEPTH_CACHE_SECONDS = 1
+_depth_cache = {'depth': 0, 'read_at': 0}
+
+
+def ingestion_depth():
+    """
+    the number of items waiting to be indexed:
+    the number of jobs of high_q, or the length of the streams, where the items are deleted once indexed
+    """
+    if time.time() - _depth_cache['read_at'] < _DEPTH_CACHE_SECONDS:
+        return _depth_cache['depth']
+
+    if config.Q.INGEST_TRANSPORT == 'stream':
+        depth = streams.depth()
+    else:
+        depth = len(high_q)
+
+    _depth_cache.update(depth=depth, read_at=time.time())
+    return depth
+
+
+_THROTTLED_KEY = "ingestion:throttled"
+
+# the state of the throttling is read at most once per second per process, as the depth
+_throttled_cache = {'throttled': False, 'read_at': 0}
+
+
+def is_ingestion_throttled():
+    """
+    True when the crawlers must slow down: the throttling starts when the depth of the ingestion
+    reaches config.Q.INGEST_HIGH_WATERMARK and stops when it gets under config.Q.INGEST_LOW_WATERMARK,
+    the state is shared by all the processes of the app
+    """
+    if time.time() - _throttled_cache['read_at'] < _DEPTH_CACHE_SECONDS:
+        return _throttled_cache['throttled']
+
+    depth = ingestion_depth()
+    throttled = redis_conn.exists(_THROTTLED_KEY) > 0
+
+    if throttled and depth <= config.Q.INGEST_LOW_WATERMARK:
+        redis_conn.delete(_THROTTLED_KEY)
+        LOGGER.info(f"Ingestion depth {depth} under the low watermark, throttling stopped")
+        throttled = False
+
+    elif not throttled and depth >= config.Q.INGEST_HIGH_WATERMARK:
+        redis_conn.set(_THROTTLED_KEY, depth)
+        LOGGER.warning(f"Ingestion depth {depth} over the high watermark, throttling started")
+        throttled = True
+
+    _throttled_cache.update(throttled=throttled, read_at=time.time())
+    return throttled
+
+
+def report_error(products_list, catalog='', errors=[], signature=None):
+    """
+    records the invalid items in the group of their catalog and of their signature,
+    the groups are reported periodically by do_flush_errors. Returns the key of the group
+    """
+    return error_reports.record(products_list, catalog=catalog, errors=errors, signature=signature)
+
+def reindex_zone(zone, keep_previous=False):
+    job = low_q.enqueue(
+        'jobs.elastic_task.do_reindex',
+        zone,
+        keep_previous=keep_previous,
+        job_timeout=config.ES.ES_REINDEX_TIMEOUT
+    )
+    return job.id
+
+def backfill_zone(zone, resume=False):
+    job = low_q.enqueue(
+        'jobs.elastic_task.do_backfill',
+        zone,
+        resume=resume,
+        job_timeout=config.ENV.BACKFILL_TIMEOUT
+    )
+    return job.id
+
+def backfill_checkpoint(zone):
+    """the progress of the last backfill of the zone, None if it is completed or if it never ran"""
+    checkpoint = redis_conn.get(backfill_checkpoint_key(zone))
+    return json.loads(checkpoint) if checkpoint else None
+
+
+"""
+Ingest sessions
+
+While an ingest session is open on a zone, the refresh of the index is disabled and its replicas are dropped
+(see ElasticCommand.begin_ingest), the previous settings are kept in redis
+so that they can be restored when the session is closed, or when it times out
+"""
+
+def claim_ingest_session(zone, timeout=config.ENV.INGEST_SESSION_TIMEOUT):
+    """
+    reserves the ingest session of the zone,
+    returns False if a session is already open on the zone, in which case its timeout is postponed
+    """
+    key = ingest_session_key(zone)
+    if redis_conn.set(key, json.dumps({}), nx=True, ex=timeout):
+        return True
+
+    session = json.loads(redis_conn.get(key) or '{}')
+    if session.get('previous') is not None:
+        start_ingest_session(zone, session['previous'], timeout=timeout)
+    return False
+
+
+def start_ingest_session(zone, previous, timeout=config.ENV.INGEST_SESSION_TIMEOUT):
+    """
+    registers the settings previous to the ingest session of the zone
+    and schedules the end of the session after the timeout
+    """
+    key = ingest_session_key(zone)
+    session = json.loads(redis_conn.get(key) or '{}')
+    if session.get('job_id'):
+        scheduler.cancel(session['job_id'])
+
+    job = scheduler.enqueue_in(
+        timedelta(seconds=timeout),
+        'jobs.elastic_task.do_end_ingest_session',
+        zone,
+        previous
+    )
+    redis_conn.set(key, json.dumps({'previous': previous, 'job_id': job.id}), ex=timeout)
     return job.id
 
-def report_error(products_list, catalog='', errors=[]):
-    job = std_q.enqueue('jobs.alerting_task.do_send_to_sentry', products_list, catalog, errors)
+
+def release_ingest_session(zone):
+    """releases a session claimed but not started"""
+    redis_conn.delete(ingest_session_key(zone))
+
+
+def close_ingest_session(zone, force_merge=False):
+    """
+    restores the settings of the zone index in background,
+    returns the job id, or None if no session is open on the zone
+    """
+    key = ingest_session_key(zone)
+    session = json.loads(redis_conn.get(key) or '{}')
+    if session.get('previous') is None:
+        return None
+
+    if session.get('job_id'):
+        scheduler.cancel(session['job_id'])
+    redis_conn.delete(key)
+
+    job = std_q.enqueue(
+        'jobs.elastic_task.do_end_ingest_session',
+        zone,
+        session['previous'],
+        force_merge=force_merge,
+        job_timeout=config.ES.ES_FORCE_MERGE_TIMEOUT
+    )
     return job.id
 
 
@@ -59,7 +247,21 @@ Scheduled tasks
 # scheduled tasks have a low priority
 scheduler = Scheduler('low', connection=redis_conn) # Get a scheduler for the "foo" queue
 
-scheduler.schedule(
+
+def _schedule_once(job_id, **kwargs):
+    """
+    schedules a repeated job under a stable id, unless it is already scheduled,
+    so that the processes importing this module do not schedule it again.
+    The job must be cancelled (scheduler.cancel(job_id)) for a change of its arguments or of its interval to be applied
+    """
+    # the lock prevents 2 processes starting at the same time from both scheduling the job
+    if job_id in scheduler or not redis_conn.set(f"scheduler:lock:{job_id}", 1, nx=True, ex=60):
+        return
+    scheduler.schedule(id=job_id, **kwargs)
+
+
+_schedule_once(
+    'scheduled:do_cleanup',
     scheduled_time=datetime.utcnow(), # Time for first execution, in UTC timezone
     func=do_cleanup,               # Function to be queued
     args=[config.ENV.CLEANUP_ZONES_LIST, config.ENV.CLEANUP_REPS_AFTER_X_DAYS],  # Arguments passed into function when executed
@@ -68,3 +270,12 @@ scheduler.schedule(
     repeat=None,                   # Repeat this number of times (None means repeat forever)
     # meta={'foo': 'bar'}          # Arbitrary pickleable data on the job itself
 )
+
+# the validation errors are reported by groups, see error_reports.py
+_schedule_once(
+    'scheduled:do_flush_errors',
+    scheduled_time=datetime.utcnow(),
+    func=do_flush_errors,
+    interval=config.ENV.ERROR_REPORT_WINDOW,
+    repeat=None,
+)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+
+import ujson as json
+
+from tests.data.base_data import CATALOG
+
+from redis_client import redis_conn
+import crawls
+
+
+async def test_add_crawl(test_cli):
+    """the stats sent by the spider are recorded
+    """
+    zone = f"crawls_{uuid.uuid4().hex}"
+    try:
+        response = await test_cli.post(
+            '/crawls',
+            data=json.dumps({
+                'spider': CATALOG,
+                'zone': zone,
+                'stats': {
+                    'start_time': '2020-05-01T02:00:00',
+                    'finish_reason': 'finished',
+                    'item_scraped_count': 12,
+                    'http_pipeline/delivered': 12
+                }
+            }),
+            headers={"content-type": "application/json"})
+
+        jay = await response.json()
+        assert jay['result']['healthy']
+
+        response = await test_cli.get(f"/crawls?zone={zone}")
+        jay = await response.json()
+        assert jay['result'][CATALOG]['last_healthy_crawl']['items'] == 12
+    finally:
+        redis_conn.delete(crawls.crawls_key(zone))
+
+
+async def test_add_crawl_no_zone_400(test_cli):
+    """
+    """
+    response = await test_cli.post(
+        '/crawls',
+        data=json.dumps({'spider': CATALOG, 'stats': {}}),
+        headers={"content-type": "application/json"})
+
+    assert response.status == 400
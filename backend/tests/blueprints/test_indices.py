@@ -5,14 +5,15 @@ import ujson as json
 
 from search_index import IndexError
 from tests.data.base_data import ZONE
+from tests.conftest import mock_coro
 
 
 async def test_create_index(test_cli, mocker):
     """
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.create_index")
-    mock_create.return_value = True
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.create_index")
+    mock_create.return_value = mock_coro(True)
 
     response = await test_cli.post(
         '/indices',
@@ -29,8 +30,8 @@ async def test_create_index_unsafe_zone(test_cli, mocker):
     """Zone information is processed to be safe
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.create_index")
-    mock_create.return_value = True
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.create_index")
+    mock_create.return_value = mock_coro(True)
 
     response = await test_cli.post(
         '/indices',
@@ -50,8 +51,8 @@ async def test_create_index_no_zone(test_cli, mocker):
     """
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.create_index")
-    mock_create.return_value = True
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.create_index")
+    mock_create.return_value = mock_coro(True)
 
     response = await test_cli.post(
         '/indices',
@@ -66,7 +67,7 @@ async def test_index_exists(test_cli, mocker):
     """
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.create_index")
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.create_index")
     mock_create.side_effect = IndexError('Boom!')
 
     response = await test_cli.post(
@@ -84,7 +85,8 @@ async def test_delete_index(test_cli, mocker):
     """
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.delete_index")
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.delete_index")
+    mock_create.return_value = mock_coro(True)
 
     response = await test_cli.delete(
         f"/indices?zone={ZONE}",
@@ -98,7 +100,8 @@ async def test_delete_index_no_zone(test_cli, mocker):
     """
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.delete_index")
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.delete_index")
+    mock_create.return_value = mock_coro(True)
 
     response = await test_cli.delete(
         f"/indices",
@@ -111,7 +114,7 @@ async def test_delete_index_error(test_cli, mocker):
     """
     """
 
-    mock_create = mocker.patch("search_index.ElasticCommand.delete_index")
+    mock_create = mocker.patch("search_index.AsyncElasticCommand.delete_index")
     mock_create.side_effect = IndexError('Boom!')
 
     response = await test_cli.delete(
@@ -120,3 +123,192 @@ async def test_delete_index_error(test_cli, mocker):
 
     jay = await response.json()
     assert jay["success"] == False
+
+
+async def test_begin_ingest_session(test_cli, mocker):
+    """
+    """
+    previous = {'index.refresh_interval': None, 'index.number_of_replicas': "1"}
+
+    mock_claim = mocker.patch("blueprints.indices.claim_ingest_session")
+    mock_claim.return_value = True
+    mock_begin = mocker.patch("search_index.AsyncElasticCommand.begin_ingest")
+    mock_begin.return_value = mock_coro(previous)
+    mock_start = mocker.patch("blueprints.indices.start_ingest_session")
+    mock_start.return_value = "job_id"
+
+    response = await test_cli.post(
+        '/indices/ingest',
+        data=json.dumps({
+            'zone': ZONE,
+            'timeout': 60
+        }),
+        headers={"content-type": "application/json"})
+
+    args, kwargs = mock_start.call_args
+
+    jay = await response.json()
+    assert jay["success"]
+    assert jay["result"] == {'already_open': False, 'timeout_job_id': "job_id"}
+    assert args == (ZONE, previous)
+    assert kwargs == {'timeout': 60}
+
+
+async def test_begin_ingest_session_already_open(test_cli, mocker):
+    """the settings are not changed twice
+    """
+    mock_claim = mocker.patch("blueprints.indices.claim_ingest_session")
+    mock_claim.return_value = False
+    mock_begin = mocker.patch("search_index.AsyncElasticCommand.begin_ingest")
+
+    response = await test_cli.post(
+        '/indices/ingest',
+        data=json.dumps({
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    jay = await response.json()
+    assert jay["success"]
+    assert jay["result"]["already_open"]
+    assert not mock_begin.called
+
+
+async def test_begin_ingest_session_error(test_cli, mocker):
+    """the session is released when the settings cannot be changed
+    """
+    mock_claim = mocker.patch("blueprints.indices.claim_ingest_session")
+    mock_claim.return_value = True
+    mock_begin = mocker.patch("search_index.AsyncElasticCommand.begin_ingest")
+    mock_begin.side_effect = IndexError('Boom!')
+    mock_release = mocker.patch("blueprints.indices.release_ingest_session")
+
+    response = await test_cli.post(
+        '/indices/ingest',
+        data=json.dumps({
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    jay = await response.json()
+    assert jay["success"] == False
+    assert mock_release.called
+
+
+async def test_begin_ingest_session_invalid_timeout(test_cli, mocker):
+    """
+    """
+    response = await test_cli.post(
+        '/indices/ingest',
+        data=json.dumps({
+            'zone': ZONE,
+            'timeout': "abc"
+        }),
+        headers={"content-type": "application/json"})
+
+    assert response.status == 400
+
+
+async def test_end_ingest_session(test_cli, mocker):
+    """
+    """
+    mock_close = mocker.patch("blueprints.indices.close_ingest_session")
+    mock_close.return_value = "job_id"
+
+    response = await test_cli.delete(
+        f"/indices/ingest?zone={ZONE}&force_merge=true",
+        headers={"content-type": "application/json"})
+
+    args, kwargs = mock_close.call_args
+
+    jay = await response.json()
+    assert jay["success"]
+    assert kwargs == {'force_merge': True}
+
+
+async def test_end_ingest_session_not_open(test_cli, mocker):
+    """
+    """
+    mock_close = mocker.patch("blueprints.indices.close_ingest_session")
+    mock_close.return_value = None
+
+    response = await test_cli.delete(
+        f"/indices/ingest?zone={ZONE}",
+        headers={"content-type": "application/json"})
+
+    jay = await response.json()
+    assert jay["success"] == False
+
+
+async def test_reindex(test_cli, mocker):
+    """
+    """
+    mock_reindex = mocker.patch("blueprints.indices.reindex_zone")
+    mock_reindex.return_value = "job_id"
+
+    response = await test_cli.post(
+        '/indices/reindex',
+        data=json.dumps({
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    args, kwargs = mock_reindex.call_args
+
+    jay = await response.json()
+    assert jay["success"]
+    assert jay["result"]["job_id"] == "job_id"
+    assert args == (ZONE,)
+    assert kwargs == {'keep_previous': False}
+
+
+async def test_reindex_no_zone(test_cli, mocker):
+    """
+    """
+    mock_reindex = mocker.patch("blueprints.indices.reindex_zone")
+
+    response = await test_cli.post(
+        '/indices/reindex',
+        data=json.dumps({
+        }),
+        headers={"content-type": "application/json"})
+
+    assert response.status == 400
+    assert not mock_reindex.called
+
+
+async def test_backfill(test_cli, mocker):
+    """
+    """
+    mock_backfill = mocker.patch("blueprints.indices.backfill_zone")
+    mock_backfill.return_value = "job_id"
+
+    response = await test_cli.post(
+        '/indices/backfill',
+        data=json.dumps({
+            'zone': ZONE,
+            'resume': True
+        }),
+        headers={"content-type": "application/json"})
+
+    args, kwargs = mock_backfill.call_args
+
+    jay = await response.json()
+    assert jay["success"]
+    assert jay["result"]["job_id"] == "job_id"
+    assert args == (ZONE,)
+    assert kwargs == {'resume': True}
+
+
+async def test_backfill_progress(test_cli, mocker):
+    """
+    """
+    mock_checkpoint = mocker.patch("blueprints.indices.backfill_checkpoint")
+    mock_checkpoint.return_value = {'after': "glv_1", 'processed': 500, 'errors': 0}
+
+    response = await test_cli.get(f'/indices/backfill?zone={ZONE}')
+
+    jay = await response.json()
+    assert jay["success"]
+    assert jay["result"]["processed"] == 500
+    assert mock_checkpoint.call_args[0] == (ZONE,)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+import ujson as json
+
+from tests.data.base_data import ZONE, CATALOG
+
+
+async def test_metrics(test_cli, mocker, dataset):
+    """the items received are counted
+    """
+    # the metrics of the request are sent to Redis by index_items
+    mocker.patch("blueprints.reps.index_items").side_effect = lambda *args, pipe=None, **kwargs: pipe.execute() and "job"
+    mocker.patch("blueprints.reps.is_ingestion_throttled").return_value = False
+
+    await test_cli.post(
+        '/reps',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'item': copy.deepcopy(dataset['products']['valid'][0]),
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    response = await test_cli.get('/metrics')
+    text = await response.text()
+
+    assert response.status == 200
+    assert f'reps_items_received_total{{catalog="{CATALOG}"}}' in text
+    assert f'reps_items_validated_total{{catalog="{CATALOG}"}}' in text
+    assert 'rq_queue_depth{queue="high"}' in text
+
+
+async def test_stream_depth(test_cli, mocker):
+    """the backlog of the ingestion streams is exported per zone
+    """
+    mocker.patch("streams.depths").return_value = {ZONE: 12}
+
+    response = await test_cli.get('/metrics')
+    text = await response.text()
+
+    assert f'stream_depth{{zone="{ZONE}"}} 12' in text
@@ -4,6 +4,9 @@ import pytest
 
 import requests
 
+from search_index import MonitoringError
+from tests.conftest import mock_coro
+
 
 class ElasticResponse():
     """Mock the Elastic response"""
@@ -90,3 +93,100 @@ async def test_error_in_elastic_response(test_cli, mocker):
     )
 
     assert response.status == 500
+
+
+async def test_pools(test_cli, mocker):
+    """
+    """
+    response = await test_cli.get(
+        f"/monitoring/pools",
+        headers={"content-type": "application/json"}
+    )
+
+    data = await response.json()
+
+    assert data["success"]
+    assert "clients" in data["result"]
+
+
+async def test_streams(test_cli, mocker):
+    """
+    """
+    mock_stats = mocker.patch("streams.stats")
+    mock_stats.return_value = {'test': {'length': 2, 'dead': 0, 'groups': []}}
+
+    response = await test_cli.get(
+        f"/monitoring/streams",
+        headers={"content-type": "application/json"}
+    )
+
+    data = await response.json()
+
+    assert data["success"]
+    assert data["result"]["test"]["length"] == 2
+
+
+async def test_latency(test_cli, mocker):
+    """the percentiles are returned per catalog and per stage
+    """
+    mock_percentiles = mocker.patch("metrics.STAGE_DURATION.percentiles")
+    mock_percentiles.return_value = {
+        ('test', 'queue'): {'count': 2, 'p50': 1.0, 'p90': 1.8, 'p99': 1.98},
+        ('test', 'total'): {'count': 1, 'p50': 5.0, 'p90': 9.0, 'p99': 9.9},
+    }
+
+    response = await test_cli.get(
+        f"/monitoring/latency",
+        headers={"content-type": "application/json"}
+    )
+
+    data = await response.json()
+
+    assert data["success"]
+    assert data["result"]["test"]["queue"]["count"] == 2
+    assert data["result"]["test"]["total"]["p50"] == 5.0
+
+
+async def test_caches(test_cli, mocker):
+    """the hit ratios of the caches are computed per node from the node stats
+    """
+    mock_client = mocker.patch("elastic_client.ElasticClientRegistry.get_async_client")
+    mock_client.return_value.nodes.stats.return_value = mock_coro({
+        'nodes': {
+            'abc': {
+                'name': "node-1",
+                'indices': {
+                    'request_cache': {'hit_count': 90, 'miss_count': 10, 'evictions': 2, 'memory_size_in_bytes': 2048},
+                    'query_cache': {'hit_count': 0, 'miss_count': 0, 'evictions': 0, 'memory_size_in_bytes': 0},
+                }
+            }
+        }
+    })
+
+    response = await test_cli.get(
+        f"/monitoring/caches",
+        headers={"content-type": "application/json"}
+    )
+
+    data = await response.json()
+
+    assert data["success"]
+    assert data["result"]["node-1"]["request_cache"]["hit_ratio"] == 0.9
+    assert data["result"]["node-1"]["request_cache"]["evictions"] == 2
+    assert data["result"]["node-1"]["query_cache"]["hit_ratio"] is None
+
+
+async def test_caches_error(test_cli, mocker):
+    """
+    """
+    mock_caches = mocker.patch("search_index.AsyncElasticMonitoring.caches")
+    mock_caches.side_effect = MonitoringError("unavailable")
+
+    response = await test_cli.get(
+        f"/monitoring/caches",
+        headers={"content-type": "application/json"}
+    )
+
+    data = await response.json()
+
+    assert not data["success"]
@@ -74,6 +74,8 @@ async def test_schema_validation_error(test_cli, mocker, dataset):
 
     assert jay['success'] == False
     assert "errors" in jay
+    assert jay['result']['error_id']
+    assert jay['result']['job_id'] is None
 
 
 def test_insert_schema_error_false(mocker, dataset):
@@ -128,3 +130,185 @@ def test_insert_ZONE_blank_400(dataset):
         headers={"content-type": "application/json"})
 
     assert resp.status == 400
+
+
+async def test_bulk_split_valid_invalid(test_cli, mocker, dataset):
+    """valid items are queued, invalid ones are rejected, each item gets a status
+    """
+    mock_index = mocker.patch("blueprints.reps.index_items")
+    mock_index.return_value = "index_job"
+    mock_report = mocker.patch("blueprints.reps.report_error")
+    mock_report.return_value = "error_job"
+
+    valid = copy.deepcopy(dataset['products']['valid'][0])
+    invalid = copy.deepcopy(dataset['products']['invalid'][0])
+
+    response = await test_cli.post(
+        '/reps/bulk',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'items': [valid, invalid],
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    jay = await response.json()
+
+    assert jay['success'] == False
+    assert jay['result']['accepted'] == 1
+    assert jay['result']['rejected'] == 1
+    assert jay['result']['items'][0]['status'] == 'queued'
+    assert jay['result']['items'][0]['job_id'] == "index_job"
+    assert jay['result']['items'][1]['status'] == 'rejected'
+    assert jay['result']['items'][1]['errors']
+    assert jay['result']['error_ids'] == ["error_job"]
+    assert jay['result']['error_job_id'] is None
+
+    # invalid items are reported once for the whole batch
+    assert mock_report.call_count == 1
+
+
+async def test_bulk_batches(test_cli, mocker, monkeypatch, dataset):
+    """the number of jobs is bounded by the batch size
+    """
+    monkeypatch.setattr('config.ENV.BULK_BATCH_SIZE', 2)
+    mock_index = mocker.patch("blueprints.reps.index_items")
+    mock_index.return_value = "index_job"
+
+    items = [copy.deepcopy(dataset['products']['valid'][0]) for i in range(5)]
+
+    response = await test_cli.post(
+        '/reps/bulk',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'items': items,
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    jay = await response.json()
+
+    assert jay['success']
+    assert mock_index.call_count == 3
+    assert [len(c[0][0]) for c in mock_index.call_args_list] == [2, 2, 1]
+
+
+async def test_bulk_ndjson(test_cli, mocker, dataset):
+    """items can be sent as NDJSON, catalog and zone being passed as query args
+    """
+    mock_index = mocker.patch("blueprints.reps.index_items")
+    mock_index.return_value = "index_job"
+
+    items = copy.deepcopy(dataset['products']['valid'])
+
+    response = await test_cli.post(
+        f'/reps/bulk?catalog={CATALOG}&zone={ZONE}',
+        data='\n'.join([json.dumps(i) for i in items]),
+        headers={"content-type": "application/x-ndjson"})
+
+    jay = await response.json()
+
+    assert jay['success']
+    assert jay['result']['accepted'] == len(items)
+    args, kwargs = mock_index.call_args
+    assert kwargs == {'catalog': CATALOG, 'zone': ZONE}
+
+
+async def test_bulk_invalid_json_400(test_cli, mocker, dataset):
+    """a body which is not JSON, or not a JSON object, is rejected as the invalid NDJSON bodies
+    """
+    mock_index = mocker.patch("blueprints.reps.index_items")
+
+    items = copy.deepcopy(dataset['products']['valid'])
+
+    for data in ['{"catalog": ', json.dumps(items)]:
+        response = await test_cli.post(
+            '/reps/bulk',
+            data=data,
+            headers={"content-type": "application/json"})
+
+        assert response.status == 400
+
+    assert not mock_index.called
+
+
+async def test_bulk_too_many_items_400(test_cli, mocker, monkeypatch, dataset):
+    """
+    """
+    monkeypatch.setattr('config.ENV.BULK_MAX_ITEMS', 1)
+    mock_index = mocker.patch("blueprints.reps.index_items")
+
+    items = copy.deepcopy(dataset['products']['valid'])
+
+    response = await test_cli.post(
+        '/reps/bulk',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'items': items,
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    assert response.status == 400
+    assert not mock_index.called
+
+
+async def test_throttled_429(test_cli, mocker, monkeypatch, dataset):
+    """the crawlers are asked to retry later when the ingestion is late
+    """
+    monkeypatch.setattr('config.Q.INGEST_RETRY_AFTER', 12)
+    mocker.patch("blueprints.reps.is_ingestion_throttled").return_value = True
+    mock_index = mocker.patch("blueprints.reps.index_items")
+
+    response = await test_cli.post(
+        '/reps',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'item': copy.deepcopy(dataset['products']['valid'][0]),
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    assert response.status == 429
+    assert response.headers['Retry-After'] == '12'
+    assert not mock_index.called
+
+    response = await test_cli.post(
+        '/reps/bulk',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'items': copy.deepcopy(dataset['products']['valid']),
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    assert response.status == 429
+    assert not mock_index.called
+
+
+async def test_bulk_errors_grouped(test_cli, mocker, dataset):
+    """the invalid items are reported once per kind of error
+    """
+    mocker.patch("blueprints.reps.index_items")
+    mock_report = mocker.patch("blueprints.reps.report_error")
+    mock_report.return_value = "errors:key"
+
+    valid = copy.deepcopy(dataset['products']['valid'][0])
+    no_price = [dict(valid, sku=f"sku-{i}", price=-i - 1) for i in range(3)]
+    no_url = dict(valid)
+    del no_url['url']
+
+    response = await test_cli.post(
+        '/reps/bulk',
+        data=json.dumps({
+            'catalog': CATALOG,
+            'items': no_price + [no_url],
+            'zone': ZONE
+        }),
+        headers={"content-type": "application/json"})
+
+    jay = await response.json()
+
+    assert jay['result']['rejected'] == 4
+    assert mock_report.call_count == 2
+    assert sorted([len(c[0][0]) for c in mock_report.call_args_list]) == [1, 3]
@@ -20,6 +20,10 @@ from tests.data.base_data import ZONE, CATALOG
 
 import config
 
+async def mock_coro(mock=None):
+    return mock
+
+
 @pytest.fixture
 def test_cli(loop, sanic_client):
     return loop.run_until_complete(sanic_client(app))
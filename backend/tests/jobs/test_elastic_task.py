@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 
 import pytest
+import ujson as json
 from unittest.mock import patch
 
 from tests.data.base_data import ZONE, CATALOG
 
-from jobs.elastic_task import do_index
+from jobs.elastic_task import (do_index, do_trace_visibility, do_cleanup, do_cleanup_zone, cleanup_stats, do_end_ingest_session, do_backfill,
+    backfill_checkpoint_key, _FINGERPRINT_EXCLUDED_FIELDS)
+from search_index import SearchError
+from redis_client import redis_conn
 
 import config
+import utils
 
 
 @pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
@@ -48,26 +54,26 @@ class TestIndexTask(object):
         """
         a_product = copy.deepcopy(dataset['products']['valid'][0])
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # suppose the document does not exist
-        # get returns None
-        mock_get = mocker.patch("search_index.ElasticCommand.get")
-        mock_get.return_value = None
+        # mget returns no document
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
 
         # wait for the task to complete with .get()
         result = do_index([a_product], "", ZONE)
 
         args, kwargs = mock_save.call_args
-        prop = args[2]
+        prop = list(args[1].values())[0]
         today = datetime.today().strftime('%Y-%m-%d')
 
         assert prop['is_new'] == True
         # both dates are equal
         assert prop['scraping_start_date'] == today
         assert prop['scraping_end_date'] == today
-        assert result == {'created': 1, 'updated':0, 'errors': 0}
+        assert result == {'created': 1, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 0}
 
 
 
@@ -81,19 +87,19 @@ class TestIndexTask(object):
         a_product['scraping_start_date'] = yesterday.strftime('%Y-%m-%d')
         a_product['scraping_end_date'] = yesterday.strftime('%Y-%m-%d')
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # suppose the document exists
-        # get returns an object != None
-        mock_get = mocker.patch("search_index.ElasticCommand.get")
-        mock_get.return_value = {'id': '1'}
+        # mget returns the document for the id requested
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.side_effect = lambda zone, ids, **kwargs: {_id: (1, {'scraping_start_date': a_product['scraping_start_date']}) for _id in ids}
 
         # wait for the task to complete with .get()
         result = do_index([a_product], "", ZONE)
 
         args, kwargs = mock_save.call_args
-        prop = args[2]
+        prop = list(args[1].values())[0]
         today = datetime.today().strftime('%Y-%m-%d')
 
         assert prop['is_new'] == False
@@ -101,7 +107,7 @@ class TestIndexTask(object):
         # only the scraping_end_date is touched, scraping_start_date is unchanged
         assert prop['scraping_end_date'] == today
         assert prop['scraping_start_date'] == yesterday.strftime('%Y-%m-%d')
-        assert result == {'created': 0, 'updated':1, 'errors': 0}
+        assert result == {'created': 0, 'updated':1, 'unchanged': 0, 'changed': 1, 'errors': 0}
 
 
     async def test_no_catalog(self, monkeypatch, mocker, dataset):
@@ -109,18 +115,18 @@ class TestIndexTask(object):
         """
         a_product = copy.deepcopy(dataset['products']['valid'][0])
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # suppose the document does not exist
         # this is a creation
-        mock_get = mocker.patch("search_index.ElasticCommand.get")
-        mock_get.return_value = None
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
 
         # wait for the task to complete with .get()
         result = do_index([a_product], "", ZONE)
 
-        assert result == {'created': 1, 'updated':0, 'errors': 0}
+        assert result == {'created': 1, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 0}
 
 
     async def test_not_a_list(self, monkeypatch, mocker, dataset):
@@ -131,7 +137,7 @@ class TestIndexTask(object):
         # wait for the task to complete with .get()
         result = do_index(a_product, CATALOG, ZONE)
 
-        assert result == {'created': 0, 'updated':0, 'errors': 0}
+        assert result == {'created': 0, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 0}
 
 
     async def test_features_enrichment(self, monkeypatch, mocker, dataset):
@@ -139,21 +145,42 @@ class TestIndexTask(object):
 
         a_product = copy.deepcopy(dataset['products']['valid'][0])
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # mock the FeaturesExtractor to verify its return value is passed to the product
-        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract")
-        mock_extractor.return_value = "my_features"
+        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract_many")
+        mock_extractor.return_value = ["my_features"]
 
         # wait for the task to complete with .get()
         do_index([a_product], CATALOG, ZONE)
 
         # assert the object saved is passed the features extracted
-        saved_product = mock_save.call_args[0][2]
+        saved_product = list(mock_save.call_args[0][1].values())[0]
         assert saved_product['features'] == "my_features"
 
 
+    async def test_attributes_enrichment(self, monkeypatch, mocker, dataset):
+        """the typed attributes are extracted from the title and the description, unless sent by the spider
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        a_product['title'] = "Appartement T3"
+        a_product['description'] = "2 chambres, DPE : B"
+        a_product['floor'] = 4
+
+        mocker.patch("search_index.ElasticCommand.mget").return_value = {}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        do_index([a_product], CATALOG, ZONE)
+
+        saved_product = list(mock_save.call_args[0][1].values())[0]
+        assert saved_product['rooms'] == 3
+        assert saved_product['bedrooms'] == 2
+        assert saved_product['energy_class'] == 'B'
+        assert saved_product['floor'] == 4
+
+
     async def test_quality_index(self, monkeypatch, mocker, dataset):
         """"""
         a_product = {
@@ -174,12 +201,12 @@ class TestIndexTask(object):
             "area": 90
         }
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # mock the FeaturesExtractor to verify its return value is passed to the product
-        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract")
-        mock_extractor.return_value = ["my_features"]
+        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract_many")
+        mock_extractor.return_value = [["my_features"]]
 
         # wait for the task to complete with .get()
         do_index([a_product], CATALOG, ZONE)
@@ -193,7 +220,7 @@ class TestIndexTask(object):
         QI += 2 # 1 feature existing ['my_features']
 
         # assert the object saved is passed the features extracted
-        saved_product = mock_save.call_args[0][2]
+        saved_product = list(mock_save.call_args[0][1].values())[0]
         assert saved_product['quality_index'] == QI
 
 
@@ -209,18 +236,18 @@ class TestIndexTask(object):
         # mock_get.return_value = False
         # return False to avoid evaluation of 'exists.sku' which would require mocking an elastic object...
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # mock the FeaturesExtractor to verify its return value is passed to the product
-        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract")
-        mock_extractor.return_value = "my_features"
+        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract_many")
+        mock_extractor.return_value = ["my_features"]
 
         # wait for the task to complete with .get()
         do_index([a_product], CATALOG, ZONE)
 
         # assert the object saved is passed the features extracted
-        saved_product = mock_save.call_args[0][2]
+        saved_product = list(mock_save.call_args[0][1].values())[0]
         assert saved_product['city'] == "a bad city 1"
 
 
@@ -233,16 +260,597 @@ class TestIndexTask(object):
         b_product = copy.deepcopy(a_product)
         b_product['sku'] = str(uuid.uuid4())
 
-        mock_save = mocker.patch("search_index.ElasticCommand.save")
-        mock_save.return_value = True
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
 
         # mock the FeaturesExtractor to verify its return value is passed to the product
-        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract")
-        mock_extractor.return_value = "my_features"
+        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract_many")
+        mock_extractor.return_value = ["my_features"]
 
         # wait for the task to complete with .get()
         do_index([b_product], CATALOG, ZONE)
 
         # assert the object saved is passed the features extracted
-        saved_product = mock_save.call_args[0][2]
+        saved_product = list(mock_save.call_args[0][1].values())[0]
         assert saved_product['sku'] == b_product['sku']
+
+
+    async def test_start_date_preserved(self, monkeypatch, mocker, dataset):
+        """the scraping_start_date of an existing doc is kept when the item does not provide it
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        a_product.pop('scraping_start_date', None)
+
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.side_effect = lambda zone, ids, **kwargs: {_id: (1, {'scraping_start_date': '2020-01-01'}) for _id in ids}
+
+        result = do_index([a_product], CATALOG, ZONE)
+
+        prop = list(mock_save.call_args[0][1].values())[0]
+        assert prop['is_new'] == False
+        assert prop['scraping_start_date'] == '2020-01-01'
+        assert result == {'created': 0, 'updated':1, 'unchanged': 0, 'changed': 1, 'errors': 0}
+
+
+    async def test_chunks(self, monkeypatch, mocker, dataset):
+        """one mget and one bulk request per chunk of products
+        """
+        monkeypatch.setattr('config.ES.ES_BULK_CHUNK_SIZE', 2)
+
+        products = []
+        for i in range(5):
+            p = copy.deepcopy(dataset['products']['valid'][0])
+            p['sku'] = str(uuid.uuid4())
+            products.append(p)
+
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
+
+        result = do_index(products, CATALOG, ZONE)
+
+        assert mock_get.call_count == 3
+        assert mock_save.call_count == 3
+        assert result == {'created': 5, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 0}
+
+
+    async def test_duplicates_in_batch(self, monkeypatch, mocker, dataset):
+        """a product sent twice is written once, with its last content
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        b_product = copy.deepcopy(a_product)
+        b_product['price'] = 123456
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        result = do_index([a_product, b_product], CATALOG, ZONE)
+
+        args, kwargs = mock_get.call_args
+        assert len(args[1]) == 1
+        args, kwargs = mock_save.call_args
+        assert [doc['price'] for doc in args[1].values()] == [123456]
+        assert result == {'created': 1, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 0}
+
+
+    async def test_bulk_errors(self, monkeypatch, mocker, dataset):
+        """documents rejected by the bulk request are counted as errors
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        b_product = copy.deepcopy(a_product)
+        b_product['sku'] = str(uuid.uuid4())
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.side_effect = lambda zone, docs, **kwargs: {list(docs.keys())[0]: "Boom!"}
+
+        mock_release = mocker.patch("dedup.release")
+
+        failures = []
+        result = do_index([a_product, b_product, "not a product"], CATALOG, ZONE, failures=failures)
+
+        assert result == {'created': 1, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 2}
+        # the positions of the products not indexed
+        assert failures == [0, 2]
+        # they can be sent again
+        assert mock_release.call_args[0] == ([a_product, "not a product"], CATALOG)
+
+
+    async def test_force_refresh(self, monkeypatch, mocker, dataset):
+        """force_refresh defaults to the configuration, it is disabled during ingest sessions
+        """
+        monkeypatch.setattr('config.ENV.FORCE_REFRESH', True)
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        do_index([copy.deepcopy(a_product)], CATALOG, ZONE)
+        args, kwargs = mock_save.call_args
+        assert kwargs['force_refresh'] == True
+
+        do_index([copy.deepcopy(a_product)], CATALOG, ZONE, force_refresh=False)
+        args, kwargs = mock_save.call_args
+        assert kwargs['force_refresh'] == False
+
+
+
+    async def test_conflicts_retried(self, monkeypatch, mocker, dataset):
+        """a product created meanwhile by another worker is read again and updated
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        a_product.pop('scraping_start_date', None)
+        conflict = {'type': 'version_conflict_engine_exception'}
+
+        # the product does not exist when it's read first
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.side_effect = lambda zone, ids, **kwargs: {} if mock_get.call_count == 1 else {
+            _id: (3, {'scraping_start_date': '2020-01-01'}) for _id in ids
+        }
+        # but it's created by another worker before it's written
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.side_effect = lambda zone, docs, **kwargs: {_id: conflict for _id in docs} if mock_save.call_count == 1 else {}
+
+        result = do_index([a_product], CATALOG, ZONE)
+
+        first, second = mock_save.call_args_list
+        doc_id = list(first[0][1].keys())[0]
+        # first created, then updated with the version read
+        assert first[1]['versions'] == {doc_id: None}
+        assert second[1]['versions'] == {doc_id: 3}
+        assert second[0][1][doc_id]['scraping_start_date'] == '2020-01-01'
+        assert second[0][1][doc_id]['is_new'] == False
+        assert result == {'created': 0, 'updated':1, 'unchanged': 0, 'changed': 1, 'errors': 0}
+
+
+    async def test_too_many_conflicts(self, monkeypatch, mocker, dataset):
+        """the conflicts are retried a limited number of times
+        """
+        monkeypatch.setattr('config.ES.ES_CONFLICT_RETRIES', 2)
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+
+        mocker.patch("search_index.ElasticCommand.mget").return_value = {}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.side_effect = lambda zone, docs, **kwargs: {_id: {'type': 'version_conflict_engine_exception'} for _id in docs}
+
+        result = do_index([a_product], CATALOG, ZONE)
+
+        assert mock_save.call_count == 3
+        assert result == {'created': 0, 'updated':0, 'unchanged': 0, 'changed': 0, 'errors': 1}
+
+
+    async def test_partitioned_zone(self, monkeypatch, mocker, dataset):
+        """documents are written in the current partition and deleted from their previous partition
+        """
+        monkeypatch.setattr('config.ENV.PARTITIONED_ZONES', [ZONE])
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        b_product = copy.deepcopy(a_product)
+        b_product['sku'] = str(uuid.uuid4())
+        a_id = utils.safe_text(f"{CATALOG}_{a_product['sku']}", accept=["_"])
+
+        mock_partition = mocker.patch("search_index.ElasticCommand.ensure_partition")
+        mock_partition.return_value = f"{ZONE}-2020.05.02"
+        mock_locate = mocker.patch("search_index.ElasticCommand.locate")
+        mock_locate.return_value = {a_id: (f"{ZONE}-2020.05.01", {'scraping_start_date': '2020-01-01'}, 1)}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        result = do_index([a_product, b_product], CATALOG, ZONE)
+
+        args, kwargs = mock_save.call_args
+
+        assert result == {'created': 1, 'updated':1, 'unchanged': 0, 'changed': 1, 'errors': 0}
+        assert kwargs['index'] == f"{ZONE}-2020.05.02"
+        assert kwargs['deletes'] == {a_id: f"{ZONE}-2020.05.01"}
+        assert args[1][a_id]['scraping_start_date'] == '2020-01-01'
+
+
+
+    async def test_unchanged(self, monkeypatch, mocker, dataset):
+        """an unchanged product is not analyzed again, only its dates are updated
+        """
+        monkeypatch.setattr('config.ENV.FORCE_REFRESH', False)
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        fingerprint = utils.content_hash(copy.deepcopy(a_product), exclude=_FINGERPRINT_EXCLUDED_FIELDS)
+        b_product = copy.deepcopy(a_product)
+        b_product['sku'] = str(uuid.uuid4())
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.side_effect = lambda zone, ids, **kwargs: {
+            _id: (1, {'scraping_start_date': '2020-01-01', 'content_hash': fingerprint}) for _id in ids
+        }
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+        mock_extractor = mocker.patch("nlp.FeaturesExtractor.extract_many")
+        mock_extractor.side_effect = lambda texts: [[] for t in texts]
+
+        result = do_index([a_product, b_product], CATALOG, ZONE)
+
+        args, kwargs = mock_save.call_args
+        today = datetime.today().strftime('%Y-%m-%d')
+
+        # the sku differs, b_product is rewritten
+        assert list(args[1].values())[0]['sku'] == b_product['sku']
+        assert list(args[1].values())[0]['content_hash'] != fingerprint
+        assert list(kwargs['updates'].values()) == [{'scraping_end_date': today, 'is_new': False}]
+        # only the description of b_product is analysed
+        assert mock_extractor.call_count == 1
+        assert len(mock_extractor.call_args[0][0]) == 1
+        assert result == {'created': 0, 'updated':2, 'unchanged': 1, 'changed': 1, 'errors': 0}
+
+
+    async def test_unchanged_force_refresh(self, monkeypatch, mocker, dataset):
+        """FORCE_REFRESH forces the analysis of unchanged products
+        """
+        monkeypatch.setattr('config.ENV.FORCE_REFRESH', True)
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        fingerprint = utils.content_hash(copy.deepcopy(a_product), exclude=_FINGERPRINT_EXCLUDED_FIELDS)
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.side_effect = lambda zone, ids, **kwargs: {
+            _id: (1, {'scraping_start_date': '2020-01-01', 'content_hash': fingerprint}) for _id in ids
+        }
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        result = do_index([a_product], CATALOG, ZONE)
+
+        args, kwargs = mock_save.call_args
+
+        assert kwargs['updates'] == {}
+        assert result == {'created': 0, 'updated':1, 'unchanged': 0, 'changed': 1, 'errors': 0}
+
+
+    async def test_routed_zone(self, monkeypatch, mocker, dataset):
+        """the products of a routed zone are read and written with the routing of their catalog
+        """
+        monkeypatch.setattr('config.ES.ROUTED_ZONES', [ZONE])
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        do_index([a_product], CATALOG, ZONE)
+
+        assert mock_get.call_args[1]['routing'] == CATALOG.lower()
+        assert set(mock_save.call_args[1]['routings'].values()) == {CATALOG.lower()}
+
+
+    async def test_traces(self, monkeypatch, mocker, dataset):
+        """the stages of the traced products are observed, the visibility of a sample is checked in background
+        """
+        monkeypatch.setattr('config.ENV.TRACE_SAMPLE_PERCENT', 100)
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        another_product = copy.deepcopy(dataset['products']['valid'][1])
+        trace = {'id': 'a1b2', 'scraped_at': 100, 'received_at': 101}
+
+        mocker.patch("search_index.ElasticCommand.mget").return_value = {}
+        mocker.patch("search_index.ElasticCommand.bulk_save").return_value = {}
+        mock_observe = mocker.patch("tracing.observe")
+        mock_enqueue = mocker.patch("jobs.elastic_task._traces_q.enqueue")
+        redis_conn.delete(f"traces:{ZONE}", f"traces:checker:{ZONE}")
+
+        do_index([a_product, another_product], CATALOG, ZONE, force_refresh=False, traces=[trace, None])
+        do_index([copy.deepcopy(a_product)], CATALOG, ZONE, force_refresh=False, traces=[trace])
+
+        stages = [args[1] for args, kwargs in mock_observe.call_args_list]
+        assert stages == ['queue', 'enrichment', 'indexing'] * 2
+
+        # a single job checks the traces of the zone
+        assert mock_enqueue.call_count == 1
+        assert mock_enqueue.call_args[0] == ('jobs.elastic_task.do_trace_visibility', ZONE)
+        traces = [json.loads(t) for t in redis_conn.hgetall(f"traces:{ZONE}").values()]
+        assert [(t['id'], t['catalog']) for t in traces] == [('a1b2', CATALOG)]
+        assert traces[0]['content_hash']
+
+        redis_conn.delete(f"traces:{ZONE}", f"traces:checker:{ZONE}")
+
+
+    async def test_traces_ingest_session(self, monkeypatch, mocker, dataset):
+        """the visibility of the products is not checked while the index is not refreshed by the ingest session
+        """
+        monkeypatch.setattr('config.ENV.TRACE_SAMPLE_PERCENT', 100)
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        trace = {'id': 'a1b2', 'scraped_at': 100, 'received_at': 101}
+
+        mocker.patch("search_index.ElasticCommand.mget").return_value = {}
+        mocker.patch("search_index.ElasticCommand.bulk_save").return_value = {}
+        mocker.patch("jobs.elastic_task.is_ingest_session_open").return_value = True
+        mock_enqueue = mocker.patch("jobs.elastic_task._traces_q.enqueue")
+        redis_conn.delete(f"traces:{ZONE}", f"traces:checker:{ZONE}")
+
+        do_index([a_product], CATALOG, ZONE, force_refresh=False, traces=[trace])
+
+        assert not mock_enqueue.called
+        assert not redis_conn.exists(f"traces:{ZONE}")
+
+
+    async def test_traces_force_refresh(self, monkeypatch, mocker, dataset):
+        """the products are searchable right away when the index is refreshed by the write
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+        trace = {'id': 'a1b2', 'scraped_at': 100, 'received_at': 101}
+
+        mocker.patch("search_index.ElasticCommand.mget").return_value = {}
+        mocker.patch("search_index.ElasticCommand.bulk_save").return_value = {}
+        mock_observe = mocker.patch("tracing.observe")
+        mock_enqueue = mocker.patch("jobs.elastic_task._traces_q.enqueue")
+
+        do_index([a_product], CATALOG, ZONE, force_refresh=True, traces=[trace])
+
+        stages = [args[1] for args, kwargs in mock_observe.call_args_list]
+        assert stages == ['queue', 'enrichment', 'indexing', 'refresh', 'total']
+        assert not mock_enqueue.called
+
+
+    async def test_trace_visibility(self, monkeypatch, mocker, dataset):
+        """the refresh is observed once the content written is returned by a search
+        """
+        monkeypatch.setattr('config.ENV.TRACE_POLL_INTERVAL_MS', 1)
+        now = time.time()
+        visible = {'id': 'a1b2', 'catalog': CATALOG, 'scraped_at': now - 5, 'indexed_at': now, 'doc_id': 'test_1', 'content_hash': 'new'}
+        expired = {'id': 'c3d4', 'catalog': CATALOG, 'scraped_at': now - 500, 'indexed_at': now - 400, 'doc_id': 'test_2', 'content_hash': 'new'}
+        redis_conn.delete(f"traces:{ZONE}")
+        redis_conn.hset(f"traces:{ZONE}", 'test_1', json.dumps(visible))
+        redis_conn.hset(f"traces:{ZONE}", 'test_2', json.dumps(expired))
+        redis_conn.set(f"traces:checker:{ZONE}", 1)
+
+        mock_search = mocker.patch("search_index.ElasticCommand.search_ids")
+        mock_search.side_effect = [{'test_1': {'content_hash': 'old'}}, {'test_1': {'content_hash': 'new'}}]
+        mock_observe = mocker.patch("tracing.observe")
+        mock_enqueue = mocker.patch("jobs.elastic_task._traces_q.enqueue")
+
+        assert do_trace_visibility(ZONE) == 1
+        # all the traces of the zone are checked by a single search
+        assert sorted(mock_search.call_args_list[0][0][1]) == ['test_1', 'test_2']
+        assert mock_search.call_args_list[1][0][1] == ['test_1']
+        assert [args[1] for args, kwargs in mock_observe.call_args_list] == ['refresh', 'total']
+        assert not redis_conn.exists(f"traces:{ZONE}")
+        assert not redis_conn.exists(f"traces:checker:{ZONE}")
+        assert not mock_enqueue.called
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
+class TestCleanupTask(object):
+    """
+    """
+
+    async def test_cleanup_fan_out(self, monkeypatch, mocker, dataset):
+        """one job is enqueued per zone
+        """
+        mock_enqueue = mocker.patch("jobs.elastic_task._low_q.enqueue")
+        mock_enqueue.return_value.id = "job"
+
+        result = do_cleanup(["partitioned", ZONE], 3)
+
+        assert result == {"partitioned": "job", ZONE: "job"}
+        assert [c[0][1:] for c in mock_enqueue.call_args_list] == [("partitioned", 3), (ZONE, 3)]
+
+
+    async def test_cleanup_partitioned_zone(self, monkeypatch, mocker, dataset):
+        """partitioned zones drop their obsolete partitions
+        """
+        monkeypatch.setattr('config.ENV.PARTITIONED_ZONES', ["partitioned"])
+        mocker.patch("crawls.get_crawls").return_value = {CATALOG: {}}
+        mocker.patch("crawls.healthy_since").return_value = {CATALOG: date.today()}
+        mock_drop = mocker.patch("search_index.ElasticCommand.drop_expired_partitions")
+        mock_drop.return_value = 10
+
+        result = do_cleanup_zone("partitioned", 3)
+
+        assert result['deleted'] == 10
+        assert mock_drop.call_args[0] == ("partitioned", 3)
+        assert cleanup_stats()["partitioned"]['status'] == 'completed'
+
+
+    async def test_cleanup_partitions_kept(self, monkeypatch, mocker, dataset):
+        """the partitions are kept until all the catalogs have been crawled successfully since their period
+        """
+        monkeypatch.setattr('config.ENV.PARTITIONED_ZONES', ["partitioned"])
+        mocker.patch("crawls.get_crawls").return_value = {"a": {}, "b": {}}
+        mocker.patch("crawls.healthy_since").return_value = {"a": date.today(), "b": date.today() - timedelta(days=9)}
+        mock_drop = mocker.patch("search_index.ElasticCommand.drop_expired_partitions")
+        mock_drop.return_value = 0
+
+        do_cleanup_zone("partitioned", 3)
+
+        assert mock_drop.call_args[0] == ("partitioned", 10)
+
+
+    async def test_cleanup_by_catalog(self, monkeypatch, mocker, dataset):
+        """only the catalogs having a healthy crawl are cleaned up, the tasks are polled until completed
+        """
+        monkeypatch.setattr('config.ES.ES_TASK_POLL_INTERVAL', 0)
+        last_healthy = date.today() - timedelta(days=1)
+        mocker.patch("crawls.get_crawls").return_value = {"healthy": {}, "broken": {}}
+        mocker.patch("crawls.healthy_since").return_value = {"healthy": last_healthy}
+        mock_start = mocker.patch("search_index.ElasticCommand.start_delete_date_range")
+        mock_start.return_value = "task:1"
+        mock_status = mocker.patch("search_index.ElasticCommand.task_status")
+        mock_status.side_effect = [
+            {'completed': False, 'deleted': 2, 'throttled_millis': 10, 'error': None},
+            {'completed': True, 'deleted': 5, 'throttled_millis': 20, 'error': None},
+        ]
+
+        result = do_cleanup_zone(ZONE, 2)
+
+        assert result == {'deleted': 5, 'catalogs': {"healthy": 5}, 'skipped': ["broken"]}
+        assert mock_start.call_args[0] == (ZONE, "scraping_end_date", 2)
+        assert mock_start.call_args[1] == {'catalog': "healthy", 'before': last_healthy}
+        assert mock_status.call_count == 2
+
+        stats = cleanup_stats()[ZONE]
+        assert stats['status'] == 'completed'
+        assert stats['deleted'] == 5
+        assert stats['throttled_millis'] == 20
+        assert stats['skipped'] == ["broken"]
+
+
+    async def test_cleanup_workers(self, monkeypatch, mocker, dataset):
+        """no more than CLEANUP_WORKERS deletions run at the same time
+        """
+        monkeypatch.setattr('config.ENV.CLEANUP_WORKERS', 2)
+        monkeypatch.setattr('config.ES.ES_TASK_POLL_INTERVAL', 0)
+        mocker.patch("crawls.get_crawls").return_value = {c: {} for c in ["a", "b", "c"]}
+        mocker.patch("crawls.healthy_since").return_value = {c: date.today() for c in ["a", "b", "c"]}
+        running = set()
+        max_running = []
+
+        def start(zone, field, days, catalog, before):
+            running.add(catalog)
+            max_running.append(len(running))
+            return catalog
+
+        def status(zone, task_id):
+            running.discard(task_id)
+            return {'completed': True, 'deleted': 1, 'throttled_millis': 0, 'error': None}
+
+        mocker.patch("search_index.ElasticCommand.start_delete_date_range").side_effect = start
+        mocker.patch("search_index.ElasticCommand.task_status").side_effect = status
+
+        result = do_cleanup_zone(ZONE, 2)
+
+        assert result['catalogs'] == {"a": 1, "b": 1, "c": 1}
+        assert max(max_running) == 2
+
+
+    async def test_cleanup_without_healthy_crawls(self, monkeypatch, mocker, dataset):
+        """nothing is deleted when no healthy crawl has been reported
+        """
+        mocker.patch("crawls.get_crawls").return_value = {"broken": {}}
+        mocker.patch("crawls.healthy_since").return_value = {}
+        mock_start = mocker.patch("search_index.ElasticCommand.start_delete_date_range")
+        mock_delete = mocker.patch("search_index.ElasticCommand.delete_date_range")
+
+        result = do_cleanup_zone(ZONE, 2)
+
+        assert result['deleted'] == 0
+        assert not mock_start.called
+        assert not mock_delete.called
+
+
+    async def test_cleanup_without_crawls(self, monkeypatch, mocker, dataset):
+        """a zone where no crawl has been reported is cleaned up on the dates only
+        """
+        mocker.patch("crawls.get_crawls").return_value = {}
+        mocker.patch("crawls.healthy_since").return_value = {}
+        mock_delete = mocker.patch("search_index.ElasticCommand.delete_date_range")
+        mock_delete.return_value = 7
+
+        result = do_cleanup_zone(ZONE, 2)
+
+        assert result['deleted'] == 7
+        assert mock_delete.call_args[0] == (ZONE, "scraping_end_date", 2)
+
+@pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
+class TestIngestSessionTask(object):
+    """
+    """
+
+    async def test_end_ingest_session(self, monkeypatch, mocker, dataset):
+        """
+        """
+        previous = {'index.refresh_interval': None, 'index.number_of_replicas': "1"}
+        mock_end = mocker.patch("search_index.ElasticCommand.end_ingest")
+
+        do_end_ingest_session(ZONE, previous, force_merge=True)
+
+        args, kwargs = mock_end.call_args
+        assert args == (ZONE, previous)
+        assert kwargs == {'force_merge': True}
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker")
+class TestBackfillTask(object):
+    """
+    """
+
+    async def test_backfill(self, monkeypatch, mocker):
+        """the documents are read page by page and partially updated in their index
+        """
+        monkeypatch.setattr('config.ENV.BACKFILL_PROCESSES', 1)
+        monkeypatch.setattr('config.ENV.BACKFILL_BATCH_SIZE', 2)
+        monkeypatch.setattr('config.ENV.BACKFILL_RATE', 1000000)
+
+        pages = [
+            [("1", f"{ZONE}_v1", {'title': "Maison", 'description': "3 chambres et un jardin"}, 1),
+             ("2", f"{ZONE}_v1", {'title': "Appartement T2", 'description': ""}, 4)],
+            [("3", f"{ZONE}_v1", {'title': "Terrain"}, 1)],
+            []
+        ]
+        mock_scan = mocker.patch("search_index.ElasticCommand.scan_page")
+        mock_scan.side_effect = pages
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.return_value = {}
+
+        result = do_backfill(ZONE)
+
+        assert [c[1]['after'] for c in mock_scan.call_args_list] == [None, "2", "3"]
+        assert mock_scan.call_args[1]['with_version'] == True
+        assert result == {'after': "3", 'processed': 3, 'errors': 0}
+
+        args, kwargs = mock_save.call_args_list[0]
+        assert args == (ZONE, {})
+        assert kwargs['index'] == f"{ZONE}_v1"
+        # the documents are only updated if they were not changed since they were read
+        assert kwargs['versions'] == {"1": 1, "2": 4}
+        assert kwargs['updates']["1"]['features'] == ['3 chambres', 'jardin']
+        assert kwargs['updates']["1"]['bedrooms'] == 3
+        assert kwargs['updates']["2"]['rooms'] == 2
+        assert kwargs['updates']["2"]['bedrooms'] is None
+
+        # the checkpoint is removed once the backfill is completed
+        assert redis_conn.get(backfill_checkpoint_key(ZONE)) is None
+
+
+    async def test_backfill_conflict(self, monkeypatch, mocker):
+        """a document changed meanwhile is read again and updated with its new content
+        """
+        monkeypatch.setattr('config.ENV.BACKFILL_PROCESSES', 1)
+        monkeypatch.setattr('config.ENV.BACKFILL_RATE', 1000000)
+
+        mock_scan = mocker.patch("search_index.ElasticCommand.scan_page")
+        mock_scan.side_effect = [[("1", f"{ZONE}_v1", {'title': "Maison", 'description': ""}, 1)], []]
+        mock_get = mocker.patch("search_index.ElasticCommand.mget")
+        mock_get.return_value = {"1": (2, {'title': "Maison", 'description': "3 chambres"})}
+        mock_save = mocker.patch("search_index.ElasticCommand.bulk_save")
+        mock_save.side_effect = [{"1": {'type': 'version_conflict_engine_exception'}}, {}]
+
+        result = do_backfill(ZONE)
+
+        assert result == {'after': "1", 'processed': 1, 'errors': 0}
+        args, kwargs = mock_save.call_args
+        assert kwargs['versions'] == {"1": 2}
+        assert kwargs['updates']["1"]['bedrooms'] == 3
+
+        redis_conn.delete(backfill_checkpoint_key(ZONE))
+
+
+    async def test_backfill_resume(self, monkeypatch, mocker):
+        """an interrupted backfill is resumed from its checkpoint
+        """
+        monkeypatch.setattr('config.ENV.BACKFILL_PROCESSES', 1)
+        mock_scan = mocker.patch("search_index.ElasticCommand.scan_page")
+        mock_scan.side_effect = SearchError("boom")
+        redis_conn.set(backfill_checkpoint_key(ZONE), '{"after": "10", "processed": 10, "errors": 1}')
+
+        try:
+            with pytest.raises(SearchError):
+                do_backfill(ZONE, resume=True)
+
+            assert mock_scan.call_args[1]['after'] == "10"
+            # the checkpoint is kept
+            assert redis_conn.get(backfill_checkpoint_key(ZONE)) is not None
+        finally:
+            redis_conn.delete(backfill_checkpoint_key(ZONE))
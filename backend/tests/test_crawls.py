@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+from datetime import date
+
+import pytest
+
+from redis_client import redis_conn
+import crawls
+
+
+@pytest.fixture
+def crawl_zone():
+    """a zone without any crawl recorded, deleted after the test"""
+    zone = f"crawls_{uuid.uuid4().hex}"
+    yield zone
+    redis_conn.delete(crawls.crawls_key(zone))
+
+
+def _stats(items, reason='finished', start='2020-05-01T02:00:00.123456', delivered=None):
+    return {
+        'start_time': start,
+        'finish_time': '2020-05-01T03:00:00',
+        'finish_reason': reason,
+        'item_scraped_count': items,
+        'http_pipeline/delivered': items if delivered is None else delivered
+    }
+
+
+class TestCrawls(object):
+    """
+    """
+
+    def test_healthy_crawl(self, monkeypatch, crawl_zone):
+        """
+        """
+        crawl = crawls.record_crawl("glv", crawl_zone, _stats(100))
+
+        assert crawl['healthy']
+        assert crawl['items'] == 100
+        assert crawls.healthy_since(crawl_zone) == {"glv": date(2020, 5, 1)}
+
+
+    def test_unhealthy_crawls(self, monkeypatch, crawl_zone):
+        """interrupted crawls and crawls scraping much less items than the previous one are not healthy
+        """
+        monkeypatch.setattr('config.ENV.CRAWL_MIN_ITEMS_PERCENT', 50)
+        crawls.record_crawl("glv", crawl_zone, _stats(100))
+
+        assert not crawls.record_crawl("glv", crawl_zone, _stats(100, reason='shutdown', start='2020-05-02T02:00:00'))['healthy']
+        assert not crawls.record_crawl("glv", crawl_zone, _stats(10, start='2020-05-03T02:00:00'))['healthy']
+        assert not crawls.record_crawl("other", crawl_zone, _stats(0))['healthy']
+        # the items could not be posted to the backend
+        assert not crawls.record_crawl("glv", crawl_zone, _stats(100, start='2020-05-04T02:00:00', delivered=0))['healthy']
+
+        record = crawls.get_crawls(crawl_zone)
+        assert record["glv"]['last_crawl']['delivered'] == 0
+        assert record["glv"]['last_healthy_crawl']['items'] == 100
+        assert crawls.healthy_since(crawl_zone) == {"glv": date(2020, 5, 1)}
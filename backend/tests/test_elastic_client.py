@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from elastic_client import ElasticClientRegistry
+
+import config
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker")
+class TestElasticClientRegistry(object):
+    """
+    """
+    def test_same_client(self, monkeypatch, mocker):
+        """the client is reused for the same hosts and options
+        """
+        client = ElasticClientRegistry.get_client(["http://fake_host:9200"])
+
+        assert client is ElasticClientRegistry.get_client("http://fake_host:9200")
+        assert client is not ElasticClientRegistry.get_client(["http://fake_host:9200"], timeout=1)
+
+
+    def test_multiple_hosts(self, monkeypatch, mocker):
+        """a comma separated list of hosts is split
+        """
+        client = ElasticClientRegistry.get_client(["http://fake_host_1:9200,http://fake_host_2:9200"])
+
+        assert len(client.transport.connection_pool.connections) == 2
+
+
+    def test_fork_safe(self, monkeypatch, mocker):
+        """clients of the parent process are not reused in a child process
+        """
+        client = ElasticClientRegistry.get_client(["http://fake_host:9200"])
+
+        mock_pid = mocker.patch("os.getpid")
+        mock_pid.return_value = ElasticClientRegistry._pid + 1
+
+        assert client is not ElasticClientRegistry.get_client(["http://fake_host:9200"])
+
+
+    def test_stats(self, monkeypatch, mocker):
+        """
+        """
+        ElasticClientRegistry.get_client(["http://fake_host:9200"])
+        stats = ElasticClientRegistry.stats()
+
+        hosts = [c['hosts'] for c in stats['clients']]
+        assert ["http://fake_host:9200"] in hosts
+        assert all(['connections' in c for c in stats['clients']])
+
+
+    def test_copies_identical(self, monkeypatch, mocker):
+        """the copy of the module in the web is the same as the one of the backend
+        """
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        backend_copy = os.path.join(root, 'backend', 'elastic_client.py')
+        web_copy = os.path.join(root, 'web', 'services', 'elastic_client.py')
+        if not os.path.exists(web_copy):
+            pytest.skip("the web is not available, ex: in the image of the backend")
+
+        with open(backend_copy, 'rb') as b, open(web_copy, 'rb') as w:
+            assert b.read() == w.read(), "backend/elastic_client.py and web/services/elastic_client.py differ"
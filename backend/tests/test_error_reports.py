@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+
+import pytest
+
+from redis_client import redis_conn
+import error_reports
+from jobs.alerting_task import do_send_to_sentry
+
+
+@pytest.fixture
+def error_catalog():
+    """a catalog without any error recorded, its keys are deleted after the test"""
+    catalog = f"errors_{uuid.uuid4().hex}"
+    yield catalog
+    keys = redis_conn.keys(f"errors:{catalog}:*") + redis_conn.keys(f"errors:sent:{catalog}:*")
+    if keys:
+        redis_conn.srem("errors:groups", *keys)
+        redis_conn.delete(*keys)
+
+
+class TestErrorReports(object):
+    """
+    """
+
+    def test_group_by_signature(self, monkeypatch, error_catalog):
+        """the items are counted per signature, a few samples are kept
+        """
+        monkeypatch.setattr('config.ENV.ERROR_REPORT_SAMPLES', 2)
+
+        for i in range(5):
+            error_reports.record([{'sku': f"{i}"}], catalog=error_catalog, errors=["'price' is a required property"])
+        error_reports.record([{'sku': 'x'}], catalog=error_catalog, errors=["'url' is a required property"])
+
+        sent = []
+        error_reports.flush(sent.append)
+        summaries = sorted([s for s in sent if s['catalog'] == error_catalog], key=lambda s: s['count'])
+
+        assert [s['count'] for s in summaries] == [1, 5]
+        assert summaries[1]['errors'] == ["'price' is a required property"]
+        assert summaries[1]['samples'] == [{'sku': '0'}, {'sku': '1'}]
+
+        # the groups are reset once flushed
+        sent = []
+        error_reports.flush(sent.append)
+        assert not [s for s in sent if s['catalog'] == error_catalog]
+
+
+    def test_cap_per_hour(self, monkeypatch, error_catalog):
+        """the groups over the cap are held and keep counting until the next hour
+        """
+        monkeypatch.setattr('config.ENV.ERROR_REPORT_MAX_PER_HOUR', 1)
+        now = 3600 * 1000
+
+        error_reports.record([{'sku': '1'}], catalog=error_catalog, errors=["a"])
+        error_reports.record([{'sku': '2'}], catalog=error_catalog, errors=["b"])
+
+        sent = []
+        error_reports.flush(sent.append, now=now)
+        assert len([s for s in sent if s['catalog'] == error_catalog]) == 1
+
+        error_reports.record([{'sku': '3'}, {'sku': '4'}], catalog=error_catalog, errors=["a"])
+        error_reports.record([{'sku': '5'}], catalog=error_catalog, errors=["b"])
+
+        sent = []
+        error_reports.flush(sent.append, now=now)
+        assert not [s for s in sent if s['catalog'] == error_catalog]
+
+        # next hour
+        sent = []
+        error_reports.flush(sent.append, now=now + 3600)
+        summaries = [s for s in sent if s['catalog'] == error_catalog]
+        assert len(summaries) == 1
+
+        sent = []
+        error_reports.flush(sent.append, now=now + 7200)
+        summaries += [s for s in sent if s['catalog'] == error_catalog]
+        assert sorted([s['count'] for s in summaries]) == [2, 2]
+
+
+    def test_send_to_sentry_shim(self, monkeypatch, error_catalog):
+        """the jobs enqueued by the previous releases record the items as the current code does
+        """
+        key = do_send_to_sentry([{'sku': '1'}], error_catalog, ["a"])
+
+        assert key == error_reports.group_key(error_catalog, error_reports.make_signature(["a"]))
+        assert int(redis_conn.hget(key, 'count')) == 1
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metric_name():
+    """a unique metric name, the metrics created with this name are unregistered and reset after the test"""
+    name = f"test_{uuid.uuid4().hex}"
+    yield name
+    for metric in [m for m in metrics.REGISTRY if m.name == name]:
+        metric.reset()
+        metrics.REGISTRY.remove(metric)
+
+
+class TestMetrics(object):
+    """
+    """
+
+    def test_counter(self, metric_name):
+        """the counters are incremented per label values
+        """
+        counter = metrics.Counter(metric_name, "a counter", labels=('catalog', 'zone'))
+        counter.inc(catalog="glv", zone="mel")
+        counter.inc(2, catalog="glv", zone="mel")
+        counter.inc(catalog='a "quoted" one', zone="mel")
+
+        lines = counter.render()
+
+        assert f"# TYPE {metric_name} counter" in lines
+        assert f'{metric_name}{{catalog="glv",zone="mel"}} 3' in lines
+        assert f'{metric_name}{{catalog="a \\"quoted\\" one",zone="mel"}} 1' in lines
+
+
+    def test_histogram(self, metric_name):
+        """the buckets are cumulative
+        """
+        histogram = metrics.Histogram(metric_name, "a histogram", labels=('operation',), buckets=(0.1, 1))
+        for value in [0.05, 0.5, 0.7, 3]:
+            histogram.observe(value, operation="bulk")
+
+        lines = histogram.render()
+
+        assert f'{metric_name}_bucket{{operation="bulk",le="0.1"}} 1' in lines
+        assert f'{metric_name}_bucket{{operation="bulk",le="1"}} 3' in lines
+        assert f'{metric_name}_bucket{{operation="bulk",le="+Inf"}} 4' in lines
+        assert f'{metric_name}_count{{operation="bulk"}} 4' in lines
+        assert f'{metric_name}_sum{{operation="bulk"}} 4.25' in lines
+
+
+    def test_gauge(self, metric_name):
+        """
+        """
+        gauge = metrics.Gauge(metric_name, "a gauge", collect=lambda: {("high", ): 12}, labels=('queue',))
+
+        assert f'{metric_name}{{queue="high"}} 12' in gauge.render()
+        assert f'{metric_name}{{queue="high"}} 12' in metrics.render()
+
+
+    def test_percentiles(self, metric_name):
+        """the percentiles are interpolated within the buckets, per label values
+        """
+        histogram = metrics.Histogram(metric_name, "a histogram", labels=('catalog', 'stage'), buckets=(1, 2, 4))
+        for value in [0.5, 1.5, 1.5, 3]:
+            histogram.observe(value, catalog="glv", stage="queue")
+        histogram.observe(10, catalog="glv", stage="total")
+
+        result = histogram.percentiles(percentiles=(50, 100))
+
+        assert result[("glv", "queue")] == {'count': 4, 'p50': 1.5, 'p100': 4}
+        # the values over the last bucket are estimated as the last bucket
+        assert result[("glv", "total")]['p50'] == 4
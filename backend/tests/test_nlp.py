@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from nlp import FeaturesEngine, FeaturesExtractor
+
+
+
+async def test_extract_default_vocabulary(monkeypatch, mocker, dataset):
+    """all the features are found, in the order of the vocabulary"""
+
+    text = "Maison de plain pied, 3 chambres, Jardin et garage. Piscine, cave, parking, terrasse."
+
+    assert FeaturesExtractor(text).extract() == [
+        '3 chambres', 'jardin', 'garage', 'piscine', 'terrasse', 'cave', 'parking', 'plain-pied'
+    ]
+
+
+async def test_extract_words_only(monkeypatch, mocker, dataset):
+    """terms are matched as whole words"""
+
+    engine = FeaturesEngine([{'feature': 'cave', 'terms': ['cave']}])
+
+    assert engine.extract("Belle concavité, caveau") == []
+    assert engine.extract("une CAVE voutée") == ['cave']
+    assert engine.extract("") == []
+    assert engine.extract(None) == []
+
+
+async def test_extract_pattern(monkeypatch, mocker, dataset):
+    """the text matched by a pattern is extracted, once"""
+
+    engine = FeaturesEngine([{'feature': 'chambres', 'pattern': r'\d{1,3}\s+chambres?'}])
+
+    assert engine.extract("12   Chambres, dont 2 chambres à l'étage") == ['12 chambres']
+
+
+async def test_extract_many(monkeypatch, mocker, dataset):
+    """the features of each text are returned in the order of the texts"""
+
+    result = FeaturesExtractor.extract_many(["un jardin", "", "un garage et un jardin"])
+
+    assert result == [['jardin'], [], ['jardin', 'garage']]
+
+
+async def test_vocabulary_file(monkeypatch, mocker, tmpdir):
+    """the vocabulary is read from a file"""
+
+    path = tmpdir.join('features.json')
+    path.write_text('[{"feature": "cheminée", "terms": ["cheminée", "insert"]}]', encoding='utf-8')
+
+    engine = FeaturesEngine.from_file(str(path))
+
+    assert engine.extract("salon avec INSERT") == ['cheminée']
+
+
+async def test_extract_attributes(monkeypatch, mocker, dataset):
+    """the typed attributes are normalized"""
+
+    result = FeaturesExtractor.extract_attributes_many([
+        "Appartement T3 au 2ème étage, 2 chambres, DPE : c",
+        "Maison 5 pièces, terrain de 1 200 m², 4 Chambres, classe énergie D",
+        "Studio au rez-de-chaussée, 800m2 de terrain",
+        "150 chambres",
+    ])
+
+    assert result == [
+        {'bedrooms': 2, 'rooms': 3, 'energy_class': 'C', 'floor': 2},
+        {'bedrooms': 4, 'rooms': 5, 'land_area': 1200.0, 'energy_class': 'D'},
+        {'land_area': 800.0, 'floor': 0},
+        {},
+    ]
@@ -1,16 +1,19 @@
 import copy
 import uuid
+from datetime import date, timedelta
 
 import pytest
 from unittest.mock import patch
 
 from elasticsearch import Elasticsearch, ElasticsearchException, NotFoundError
 
-from tests.data.base_data import ZONE
+from tests.data.base_data import ZONE, CATALOG
 
 from search_index import (
     ElasticSession, ElasticMonitoring, MonitoringError,
-    ElasticCommand, IndexError, SearchError, _DOCUMENT_TYPE)
+    ElasticCommand, IndexError, SearchError, _DOCUMENT_TYPE,
+    AsyncElasticCommand, AsyncElasticMonitoring, _index_version, _partition_name, _partition_start, is_conflict,
+    _index_settings, _index_mapping, _compact_shards, _SETTINGS, _MAPPING, catalog_routing)
 
 import config
 
@@ -78,6 +81,493 @@ class TestElasticSession(object):
         assert obj == None
 
 
+    def test_mget_args(self, monkeypatch, mocker, dataset):
+        """
+        """
+        mock_es = mocker.patch("elasticsearch.Elasticsearch.mget")
+        mock_es.return_value = {'docs': [
+            {'_id': "1", 'found': True, '_source': {'scraping_start_date': '2020-01-01'}},
+            {'_id': "2", 'found': False}
+        ]}
+
+        session = ElasticSession("fake_host", ZONE)
+        docs = session.mget(["1", "2", " "], source_fields=['scraping_start_date'])
+
+        args, kwargs = mock_es.call_args
+
+        assert kwargs == {
+            'index': ZONE,
+            'doc_type': _DOCUMENT_TYPE,
+            'body': {'ids': ["1", "2"]},
+            '_source': ['scraping_start_date']
+        }
+        assert docs == {"1": {'scraping_start_date': '2020-01-01'}}
+
+
+    def test_scan_page_args(self, monkeypatch, mocker, dataset):
+        """the scan is resumed after the last _id read
+        """
+        mock_search = mocker.patch("elasticsearch.Elasticsearch.search")
+        mock_search.return_value = {'hits': {'hits': [
+            {'_id': "2", '_index': f"{ZONE}_v1", '_source': {'title': 'a title'}},
+        ]}}
+
+        session = ElasticSession("fake_host", ZONE)
+        page = session.scan_page(after="1", size=10, source_fields=['title'])
+
+        args, kwargs = mock_search.call_args
+
+        assert kwargs['body']['search_after'] == ["1"]
+        assert kwargs['body']['sort'] == [{'_id': 'asc'}]
+        assert kwargs['body']['size'] == 10
+        assert page == [("2", f"{ZONE}_v1", {'title': 'a title'})]
+
+        mock_search.return_value['hits']['hits'][0]['_version'] = 3
+        page = session.scan_page(after="1", size=10, source_fields=['title'], with_version=True)
+        assert mock_search.call_args[1]['body']['version'] == True
+        assert page == [("2", f"{ZONE}_v1", {'title': 'a title'}, 3)]
+
+
+    def test_bulk_save_errors(self, monkeypatch, mocker, dataset):
+        """
+        """
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        mock_bulk.return_value = (1, [{'index': {'_id': "2", 'error': "Boom!"}}])
+
+        session = ElasticSession("fake_host", ZONE)
+        failures = session.bulk_save({"1": {"key": "value"}, "2": {"key": "value"}}, force_refresh=True)
+
+        args, kwargs = mock_bulk.call_args
+
+        assert [a['_id'] for a in args[1]] == ["1", "2"]
+        assert kwargs['refresh'] == True
+        assert failures == {"2": "Boom!"}
+
+
+    def test_bulk_save_updates(self, monkeypatch, mocker, dataset):
+        """partial updates are sent in the same bulk request
+        """
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        mock_bulk.return_value = (1, [{'update': {'_id': "2", 'error': "Boom!"}}])
+
+        session = ElasticSession("fake_host", ZONE)
+        failures = session.bulk_save({}, updates={"2": {"is_new": False}})
+
+        args, kwargs = mock_bulk.call_args
+
+        assert args[1] == [{
+            '_op_type': 'update',
+            '_index': ZONE,
+            '_type': _DOCUMENT_TYPE,
+            '_id': "2",
+            'doc': {"is_new": False},
+            'retry_on_conflict': config.ES.ES_CONFLICT_RETRIES
+        }]
+        assert failures == {"2": "Boom!"}
+
+
+    def test_bulk_save_versions(self, monkeypatch, mocker, dataset):
+        """new documents are created, existing documents are written only if their version did not change
+        """
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        conflict = {'type': 'version_conflict_engine_exception', 'reason': "..."}
+        mock_bulk.return_value = (1, [{'create': {'_id': "1", 'status': 409, 'error': conflict}}])
+
+        session = ElasticSession("fake_host", ZONE)
+        failures = session.bulk_save(
+            {"1": {'sku': "1"}, "2": {'sku': "2"}, "3": {'sku': "3"}},
+            versions={"1": None, "2": 7}
+        )
+
+        args, kwargs = mock_bulk.call_args
+        actions = {a['_id']: a for a in args[1]}
+
+        assert actions["1"]['_op_type'] == 'create'
+        assert actions["2"]['_op_type'] == 'index'
+        assert actions["2"]['_version'] == 7
+        # no version passed, the document is overwritten
+        assert '_version' not in actions["3"]
+        assert failures == {"1": conflict}
+        assert is_conflict(failures["1"])
+        assert not is_conflict("Boom!")
+
+
+    def test_bulk_save_update_versions(self, monkeypatch, mocker, dataset):
+        """the partial updates with a version are not retried on conflict
+        """
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        mock_bulk.return_value = (2, [])
+
+        session = ElasticSession("fake_host", ZONE)
+        session.bulk_save({}, updates={"1": {'quality_index': 2}, "2": {'quality_index': 3}}, versions={"1": 4})
+
+        args, kwargs = mock_bulk.call_args
+        actions = {a['_id']: a for a in args[1]}
+
+        assert actions["1"]['_version'] == 4
+        assert 'retry_on_conflict' not in actions["1"]
+        assert '_version' not in actions["2"]
+        assert actions["2"]['retry_on_conflict'] == config.ES.ES_CONFLICT_RETRIES
+
+
+    def test_bulk_save_no_id(self, monkeypatch, mocker, dataset):
+        """
+        """
+        with pytest.raises(IndexError) as c:
+            session = ElasticSession("fake_host", ZONE)
+            session.bulk_save({"": {"key": "value"}})
+
+
+    def test_begin_ingest(self, monkeypatch, mocker, dataset):
+        """the previous settings are returned, None when not set explicitly on the index
+        """
+        mock_get = mocker.patch("elasticsearch.client.IndicesClient.get_settings")
+        mock_get.return_value = {
+            f"{ZONE}_v1": {'settings': {'index.number_of_replicas': "1"}}
+        }
+        mock_put = mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+
+        session = ElasticSession("fake_host", ZONE)
+        previous = session.begin_ingest()
+
+        args, kwargs = mock_put.call_args
+
+        assert previous == {'index.refresh_interval': None, 'index.number_of_replicas': "1"}
+        assert kwargs['body'] == {'index.refresh_interval': "-1", 'index.number_of_replicas': 0}
+
+
+    def test_end_ingest(self, monkeypatch, mocker, dataset):
+        """
+        """
+        previous = {'index.refresh_interval': None, 'index.number_of_replicas': "1"}
+        mock_put = mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+        mock_refresh = mocker.patch("elasticsearch.client.IndicesClient.refresh")
+        mock_merge = mocker.patch("elasticsearch.client.IndicesClient.forcemerge")
+
+        session = ElasticSession("fake_host", ZONE)
+        session.end_ingest(previous, force_merge=False)
+
+        args, kwargs = mock_put.call_args
+
+        assert kwargs['body'] == previous
+        assert mock_refresh.call_count == 1
+        assert not mock_merge.called
+
+        session.end_ingest(previous, force_merge=True)
+
+        assert mock_merge.called
+
+
+    def test_create_index_alias(self, monkeypatch, mocker, dataset):
+        """the zone is an alias of the first version of the index
+        """
+        mock_exists = mocker.patch("elasticsearch.client.IndicesClient.exists")
+        mock_exists.return_value = False
+        mock_create = mocker.patch("elasticsearch.client.IndicesClient.create")
+
+        session = ElasticSession("fake_host", ZONE)
+        session.create_index()
+
+        args, kwargs = mock_create.call_args
+
+        assert kwargs['index'] == f"{ZONE}_v1"
+        assert kwargs['body']['aliases'] == {ZONE: {}}
+
+
+    def test_index_version(self, monkeypatch, mocker, dataset):
+        """
+        """
+        assert _index_version("mel", "mel") == 0
+        assert _index_version("mel", "mel_v12") == 12
+        assert _index_version("mel", "melun_v1") is None
+        assert _index_version("mel", "mel_v1_old") is None
+
+
+    def test_reindex(self, monkeypatch, mocker, dataset):
+        """a new version is created, the alias is swapped atomically and the previous version is deleted
+        """
+        monkeypatch.setattr('config.ES.ES_REINDEX_POLL_INTERVAL', 0)
+
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get_alias").return_value = {f"{ZONE}_v2": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.get").return_value = {f"{ZONE}_v2": {}, f"{ZONE}_v1": {}}
+        mock_create = mocker.patch("elasticsearch.client.IndicesClient.create")
+        mock_settings = mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+        mocker.patch("elasticsearch.client.IndicesClient.refresh")
+        mock_aliases = mocker.patch("elasticsearch.client.IndicesClient.update_aliases")
+        mock_delete = mocker.patch("elasticsearch.client.IndicesClient.delete")
+        mock_reindex = mocker.patch("elasticsearch.Elasticsearch.reindex")
+        mock_reindex.return_value = {'task': "node:1"}
+        mock_task = mocker.patch("elasticsearch.client.TasksClient.get")
+        mock_task.side_effect = [
+            {'completed': False},
+            {'completed': True, 'response': {'total': 10, 'failures': []}},
+            {'completed': True, 'response': {'total': 10, 'version_conflicts': 9, 'failures': []}}
+        ]
+        mocker.patch("elasticsearch.Elasticsearch.search").return_value = {'hits': {'hits': []}}
+
+        session = ElasticSession("fake_host", ZONE)
+        new_index = session.reindex()
+
+        assert new_index == f"{ZONE}_v3"
+        assert mock_create.call_args[1]['index'] == f"{ZONE}_v3"
+        # the catch up copies again the documents updated during the copy, while the current version is read-only
+        assert mock_reindex.call_count == 2
+        assert mock_reindex.call_args_list[0][1]['body']['source'] == {'index': [f"{ZONE}_v2"]}
+        assert mock_reindex.call_args_list[0][1]['body']['dest'] == {'index': f"{ZONE}_v3", 'version_type': 'external'}
+        assert mock_reindex.call_args_list[0][1]['slices'] == 'auto'
+        assert mock_reindex.call_args_list[1][1]['body'] == mock_reindex.call_args_list[0][1]['body']
+        assert mock_settings.call_args_list[0][1] == {'index': f"{ZONE}_v2", 'body': {'index.blocks.write': True}}
+        assert mock_aliases.call_args[1]['body'] == {'actions': [
+            {'remove': {'index': f"{ZONE}_v2", 'alias': ZONE}},
+            {'add': {'index': f"{ZONE}_v3", 'alias': ZONE}}
+        ]}
+        assert mock_delete.call_args[1]['index'] == f"{ZONE}_v2"
+
+
+    def test_compact_profile(self, monkeypatch, mocker, dataset):
+        """the compact zones are compressed and do not keep the doc_values of the fields never sorted nor aggregated
+        """
+        monkeypatch.setattr('config.ES.COMPACT_ZONES', [ZONE])
+        monkeypatch.setattr('config.ES.ES_SHARDS', 5)
+        monkeypatch.setattr('config.ES.ES_COMPACT_SHARD_SIZE_MB', 100)
+
+        settings = _index_settings(ZONE)
+        properties = _index_mapping(ZONE)[_DOCUMENT_TYPE]['properties']
+
+        assert settings['codec'] == "best_compression"
+        assert settings['number_of_shards'] == 1
+        assert settings['sort.field'] == _SETTINGS['sort.field']
+        assert properties['price'] == {"type" : "scaled_float", "scaling_factor": 100, "doc_values": "false"}
+        assert properties['city'] == _MAPPING[_DOCUMENT_TYPE]['properties']['city']
+        assert 'doc_values' not in _MAPPING[_DOCUMENT_TYPE]['properties']['price']
+
+        assert _index_settings("other") == _SETTINGS
+        assert _index_mapping("other") == _MAPPING
+
+
+    def test_compact_shards(self, monkeypatch, mocker, dataset):
+        """a shard holds ES_COMPACT_SHARD_SIZE_MB at most, within ES_SHARDS shards
+        """
+        monkeypatch.setattr('config.ES.ES_SHARDS', 5)
+        monkeypatch.setattr('config.ES.ES_COMPACT_SHARD_SIZE_MB', 100)
+
+        assert _compact_shards(0) == 1
+        assert _compact_shards(100 * 1024 * 1024) == 1
+        assert _compact_shards(250 * 1024 * 1024) == 3
+        assert _compact_shards(10000 * 1024 * 1024) == 5
+
+
+    def test_reindex_compact(self, monkeypatch, mocker, dataset):
+        """the shards of the new version of a compact zone are sized for the volume of the current version
+        """
+        monkeypatch.setattr('config.ES.COMPACT_ZONES', [ZONE])
+        monkeypatch.setattr('config.ES.ES_SHARDS', 5)
+        monkeypatch.setattr('config.ES.ES_COMPACT_SHARD_SIZE_MB', 100)
+
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get_alias").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.get").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.stats").return_value = {
+            '_all': {'primaries': {'store': {'size_in_bytes': 150 * 1024 * 1024}}}
+        }
+        mock_create = mocker.patch("elasticsearch.client.IndicesClient.create")
+        mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+        mocker.patch("elasticsearch.client.IndicesClient.refresh")
+        mocker.patch("elasticsearch.client.IndicesClient.update_aliases")
+        mocker.patch("elasticsearch.client.IndicesClient.delete")
+        mocker.patch("elasticsearch.Elasticsearch.reindex").return_value = {'task': "node:1"}
+        mocker.patch("elasticsearch.client.TasksClient.get").return_value = {'completed': True, 'response': {}}
+        mocker.patch("elasticsearch.Elasticsearch.search").return_value = {'hits': {'hits': []}}
+
+        session = ElasticSession("fake_host", ZONE)
+        session.reindex()
+
+        body = mock_create.call_args[1]['body']
+        assert body['settings']['number_of_shards'] == 2
+        assert body['settings']['codec'] == "best_compression"
+        assert body['settings']['index.refresh_interval'] == "-1"
+        assert body['settings']['index.number_of_replicas'] == 0
+        assert 'number_of_replicas' not in body['settings']
+        assert body['mappings']['_doc']['properties']['price']['doc_values'] == "false"
+
+
+    def test_reindex_legacy(self, monkeypatch, mocker, dataset):
+        """an index named after the zone is replaced by an alias in the same operation
+        """
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = False
+        mocker.patch("elasticsearch.client.IndicesClient.exists").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get").return_value = {ZONE: {}}
+        mocker.patch("elasticsearch.client.IndicesClient.create")
+        mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+        mocker.patch("elasticsearch.client.IndicesClient.refresh")
+        mock_aliases = mocker.patch("elasticsearch.client.IndicesClient.update_aliases")
+        mock_delete = mocker.patch("elasticsearch.client.IndicesClient.delete")
+        mocker.patch("elasticsearch.Elasticsearch.reindex").return_value = {'task': "node:1"}
+        mocker.patch("elasticsearch.client.TasksClient.get").return_value = {'completed': True, 'response': {}}
+        mocker.patch("elasticsearch.Elasticsearch.search").return_value = {'hits': {'hits': []}}
+
+        session = ElasticSession("fake_host", ZONE)
+        new_index = session.reindex()
+
+        assert new_index == f"{ZONE}_v1"
+        assert mock_aliases.call_args[1]['body'] == {'actions': [
+            {'remove_index': {'index': ZONE}},
+            {'add': {'index': f"{ZONE}_v1", 'alias': ZONE}}
+        ]}
+        assert not mock_delete.called
+
+
+    def test_reindex_failures(self, monkeypatch, mocker, dataset):
+        """the alias is not swapped when documents could not be copied
+        """
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get_alias").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.get").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.create")
+        mock_aliases = mocker.patch("elasticsearch.client.IndicesClient.update_aliases")
+        mocker.patch("elasticsearch.Elasticsearch.reindex").return_value = {'task': "node:1"}
+        mocker.patch("elasticsearch.client.TasksClient.get").return_value = {
+            'completed': True, 'response': {'failures': [{'cause': "Boom!"}]}
+        }
+
+        with pytest.raises(IndexError) as c:
+            session = ElasticSession("fake_host", ZONE)
+            session.reindex()
+
+        assert not mock_aliases.called
+
+
+    def test_reindex_blocked_writes(self, monkeypatch, mocker, dataset):
+        """the previous version kept after the swap, or left after a failed catch up, accepts the writes again
+        """
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get_alias").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.get").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.create")
+        mock_settings = mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+        mocker.patch("elasticsearch.client.IndicesClient.refresh")
+        mock_aliases = mocker.patch("elasticsearch.client.IndicesClient.update_aliases")
+        mock_delete = mocker.patch("elasticsearch.client.IndicesClient.delete")
+        mocker.patch("elasticsearch.Elasticsearch.reindex").return_value = {'task': "node:1"}
+        mocker.patch("elasticsearch.Elasticsearch.search").return_value = {'hits': {'hits': []}}
+        mock_task = mocker.patch("elasticsearch.client.TasksClient.get")
+        mock_task.return_value = {'completed': True, 'response': {}}
+
+        session = ElasticSession("fake_host", ZONE)
+        session.reindex(keep_previous=True)
+
+        assert not mock_delete.called
+        assert mock_settings.call_args[1] == {'index': f"{ZONE}_v1", 'body': {'index.blocks.write': None}}
+
+        mock_aliases.reset_mock()
+        mock_task.side_effect = [
+            {'completed': True, 'response': {}},
+            {'completed': True, 'response': {'failures': [{'cause': "Boom!"}]}}
+        ]
+        with pytest.raises(IndexError):
+            session.reindex()
+
+        assert not mock_aliases.called
+        assert mock_settings.call_args[1] == {'index': f"{ZONE}_v1", 'body': {'index.blocks.write': None}}
+
+
+    def test_delete_missing(self, monkeypatch, mocker, dataset):
+        """the documents deleted from the previous version during the copy are deleted from the new version
+        """
+        mock_search = mocker.patch("elasticsearch.Elasticsearch.search")
+        mock_search.side_effect = [
+            {'hits': {'hits': [{'_id': "a"}, {'_id': "b", '_routing': "glv"}, {'_id': "c"}]}},
+            {'hits': {'hits': [{'_id': "a"}]}},
+            {'hits': {'hits': []}}
+        ]
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        mock_bulk.return_value = (2, [])
+
+        session = ElasticSession("fake_host", ZONE)
+        client = Elasticsearch("fake_host")
+
+        assert session._delete_missing(client, [f"{ZONE}_v1"], f"{ZONE}_v2") == 2
+        assert mock_search.call_args_list[1][1]['body']['query'] == {'ids': {'values': ["a", "b", "c"]}}
+        assert mock_search.call_args_list[2][1]['body']['search_after'] == ["c"]
+        assert [(a['_id'], a.get('_routing')) for a in mock_bulk.call_args[0][1]] == [("b", "glv"), ("c", None)]
+        assert all([a['_index'] == f"{ZONE}_v2" and a['_op_type'] == 'delete' for a in mock_bulk.call_args[0][1]])
+
+
+    def test_partition_name(self, monkeypatch, mocker, dataset):
+        """partitions are named after the first day of their period
+        """
+        monkeypatch.setattr('config.ENV.PARTITION_PERIOD_DAYS', 1)
+        assert _partition_name("mel", date(2020, 5, 3)) == "mel-2020.05.03"
+
+        monkeypatch.setattr('config.ENV.PARTITION_PERIOD_DAYS', 7)
+        assert _partition_name("mel", date(2020, 5, 3)) == _partition_name("mel", date(2020, 5, 6))
+        assert _partition_name("mel", date(2020, 5, 3)) != _partition_name("mel", date(2020, 5, 7))
+
+
+    def test_locate(self, monkeypatch, mocker, dataset):
+        """the most recent partition is kept when a document is found twice
+        """
+        mock_search = mocker.patch("elasticsearch.Elasticsearch.search")
+        mock_search.return_value = {'hits': {'hits': [
+            {'_id': "1", '_index': f"{ZONE}-2020.05.01", '_source': {'scraping_start_date': '2020-01-01'}},
+            {'_id': "1", '_index': f"{ZONE}-2020.05.02", '_source': {'scraping_start_date': '2020-01-01'}},
+        ]}}
+
+        session = ElasticSession("fake_host", ZONE)
+        located = session.locate(["1", "2"], source_fields=['scraping_start_date'])
+
+        args, kwargs = mock_search.call_args
+
+        assert kwargs['body']['query'] == {'ids': {'values': ["1", "2"]}}
+        assert located == {"1": (f"{ZONE}-2020.05.02", {'scraping_start_date': '2020-01-01'})}
+
+
+    def test_bulk_save_move(self, monkeypatch, mocker, dataset):
+        """documents are written in the index passed and deleted from their previous index
+        """
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        mock_bulk.return_value = (2, [{'delete': {'_id': "1", '_index': "old", 'error': "Boom!"}}])
+
+        session = ElasticSession("fake_host", ZONE)
+        failures = session.bulk_save({"1": {"key": "value"}}, index="new", deletes={"1": "old"})
+
+        args, kwargs = mock_bulk.call_args
+
+        assert [(a['_op_type'], a['_index']) for a in args[1]] == [('index', "new"), ('delete', "old")]
+        assert failures == {}
+
+
+    def test_drop_expired_partitions(self, monkeypatch, mocker, dataset):
+        """obsolete partitions are dropped, the partition overlapping the limit is cleaned up by query
+        """
+        monkeypatch.setattr('config.ENV.PARTITION_PERIOD_DAYS', 2)
+        today = date.today()
+        # the limit is the first day of a partition, which thus overlaps it
+        start = _partition_start(today - timedelta(days=4))
+        max_days = (today - start).days
+        old = _partition_name(ZONE, start - timedelta(days=10))
+        overlapping = _partition_name(ZONE, start)
+        current = _partition_name(ZONE, today)
+
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get_alias").return_value = {
+            old: {}, overlapping: {}, current: {}
+        }
+        mocker.patch("elasticsearch.Elasticsearch.count").return_value = {'count': 5}
+        mock_delete = mocker.patch("elasticsearch.client.IndicesClient.delete")
+        mock_dbq = mocker.patch("elasticsearch.Elasticsearch.delete_by_query")
+        mock_dbq.return_value = {'deleted': 1}
+
+        session = ElasticSession("fake_host", ZONE)
+        deleted = session.drop_expired_partitions(max_days)
+
+        assert mock_delete.call_count == 1
+        assert mock_delete.call_args[1]['index'] == old
+        assert [c[1]['index'] for c in mock_dbq.call_args_list] == [overlapping]
+        assert deleted == 6
+
+
     def test_delete_date_range_args(self, monkeypatch, mocker, dataset):
         """
         """
@@ -119,6 +609,129 @@ class TestElasticSession(object):
             session.delete_date_range("myfield", "")
 
 
+    def test_start_delete_date_range(self, monkeypatch, mocker, dataset):
+        """the deletion is started as a sliced and throttled task
+        """
+        monkeypatch.setattr('config.ES.ES_DELETE_REQUESTS_PER_SECOND', 100)
+        mock_es = mocker.patch("elasticsearch.Elasticsearch.delete_by_query")
+        mock_es.return_value = {'task': 'node:1'}
+
+        session = ElasticSession("fake_host", ZONE)
+        task_id = session.start_delete_date_range("my_field", 3, catalog=CATALOG, before=date(2020, 5, 1))
+
+        args, kwargs = mock_es.call_args
+
+        assert task_id == 'node:1'
+        assert kwargs['slices'] == 'auto'
+        assert kwargs['wait_for_completion'] == False
+        assert kwargs['requests_per_second'] == 100
+        assert kwargs['body']['query']['bool']['filter'] == [
+            {"range": {"my_field": {"lte": "now-3d"}}},
+            {"term": {"catalog": CATALOG}},
+            {"range": {"my_field": {"lt": "2020-05-01"}}}
+        ]
+
+
+    def test_routed_zone(self, monkeypatch, mocker, dataset):
+        """the documents of a routed zone are written and read with the routing of their catalog
+        """
+        monkeypatch.setattr('config.ES.ROUTED_ZONES', [ZONE])
+        mock_bulk = mocker.patch("elasticsearch.helpers.bulk")
+        mock_bulk.return_value = (2, [])
+        mock_mget = mocker.patch("elasticsearch.Elasticsearch.mget")
+        mock_mget.return_value = {'docs': []}
+        mock_dbq = mocker.patch("elasticsearch.Elasticsearch.delete_by_query")
+        mock_dbq.return_value = {'task': 'node:1'}
+
+        routing = catalog_routing(ZONE, " GLV")
+        assert routing == "glv"
+        assert catalog_routing("other", "glv") is None
+        assert _index_mapping(ZONE)[_DOCUMENT_TYPE]['_routing'] == {"required": True}
+        assert '_routing' not in _index_mapping("other")[_DOCUMENT_TYPE]
+
+        session = ElasticSession("fake_host", ZONE)
+        session.bulk_save({"1": {"key": "value"}}, updates={"2": {"key": "value"}}, routings={"1": routing, "2": routing})
+        session.mget(["1"], routing=routing)
+        session.start_delete_date_range("my_field", 3, catalog="GLV")
+
+        args, kwargs = mock_bulk.call_args
+        assert [a['_routing'] for a in args[1]] == [routing, routing]
+        assert mock_mget.call_args[1]['routing'] == routing
+        assert mock_dbq.call_args[1]['routing'] == routing
+
+
+    def test_routed_zone_get(self, monkeypatch, mocker, dataset):
+        """a document of a routed zone is searched in all the shards when its routing is unknown
+        """
+        monkeypatch.setattr('config.ES.ROUTED_ZONES', [ZONE])
+        mock_get = mocker.patch("elasticsearch.Elasticsearch.get")
+        mock_get.return_value = {'found': True, '_source': {'sku': "1"}}
+        mock_search = mocker.patch("elasticsearch.Elasticsearch.search")
+        mock_search.return_value = {'hits': {'hits': [{'_id': "glv_1", '_index': f"{ZONE}_v1", '_source': {'sku': "1"}}]}}
+
+        session = ElasticSession("fake_host", ZONE)
+
+        assert session.get("glv_1") == {'sku': "1"}
+        assert not mock_get.called
+        assert 'routing' not in mock_search.call_args[1]
+
+        assert session.get("glv_1", routing="glv") == {'sku': "1"}
+        assert mock_get.call_args[1]['routing'] == "glv"
+
+
+    def test_reindex_routed(self, monkeypatch, mocker, dataset):
+        """the documents copied into a routed zone are routed by catalog
+        """
+        monkeypatch.setattr('config.ES.ROUTED_ZONES', [ZONE])
+        mocker.patch("elasticsearch.client.IndicesClient.exists_alias").return_value = True
+        mocker.patch("elasticsearch.client.IndicesClient.get_alias").return_value = {f"{ZONE}_v1": {}}
+        mocker.patch("elasticsearch.client.IndicesClient.get").return_value = {f"{ZONE}_v1": {}}
+        mock_create = mocker.patch("elasticsearch.client.IndicesClient.create")
+        mocker.patch("elasticsearch.client.IndicesClient.put_settings")
+        mocker.patch("elasticsearch.client.IndicesClient.refresh")
+        mocker.patch("elasticsearch.client.IndicesClient.update_aliases")
+        mocker.patch("elasticsearch.client.IndicesClient.delete")
+        mock_reindex = mocker.patch("elasticsearch.Elasticsearch.reindex")
+        mock_reindex.return_value = {'task': "node:1"}
+        mocker.patch("elasticsearch.client.TasksClient.get").return_value = {'completed': True, 'response': {}}
+        mocker.patch("elasticsearch.Elasticsearch.search").return_value = {'hits': {'hits': []}}
+
+        session = ElasticSession("fake_host", ZONE)
+        session.reindex()
+
+        assert mock_create.call_args[1]['body']['mappings']['_doc']['_routing'] == {"required": True}
+        assert all(['ctx._routing' in c[1]['body']['script']['source'] for c in mock_reindex.call_args_list])
+
+
+    def test_task_status(self, monkeypatch, mocker, dataset):
+        """the counters are read in the status of a running task, in the response of a completed one
+        """
+        mock_es = mocker.patch("elasticsearch.client.TasksClient.get")
+        mock_es.return_value = {
+            'completed': False,
+            'task': {'running_time_in_nanos': 2000000000, 'status': {'total': 10, 'deleted': 4, 'throttled_millis': 5}}
+        }
+
+        session = ElasticSession("fake_host", ZONE)
+        status = session.task_status('node:1')
+
+        assert not status['completed']
+        assert status['deleted'] == 4
+        assert status['throttled_millis'] == 5
+        assert status['running_time_ms'] == 2000
+
+        mock_es.return_value = {
+            'completed': True,
+            'task': {'running_time_in_nanos': 3000000000, 'status': {'total': 10, 'deleted': 4}},
+            'response': {'total': 10, 'deleted': 10, 'failures': []}
+        }
+        status = session.task_status('node:1')
+
+        assert status['completed']
+        assert status['deleted'] == 10
+        assert status['error'] is None
+
+
 
 @pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
 class TestElasticMonitoring(object):
@@ -183,3 +796,35 @@ class TestElasticCommand(object):
         assert args[0] == "1"
         assert args[1] == {"key": "value"}
         assert 'force_refresh' in kwargs and kwargs['force_refresh'] == True
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
+class TestAsyncElasticCommand(object):
+    """
+    """
+    async def test_get_no_ZONE(self, monkeypatch, mocker, dataset):
+        """raise a ValueError
+        """
+        with pytest.raises(SearchError) as c:
+            await AsyncElasticCommand.get("", "1")
+
+
+    async def test_monitor_no_ZONE(self, monkeypatch, mocker, dataset):
+        """raise a ValueError
+        """
+        with pytest.raises(MonitoringError) as c:
+            await AsyncElasticMonitoring.monitor("")
+
+
+    async def test_monitor(self, monkeypatch, mocker, dataset):
+        """the async monitoring returns the same health as the sync one
+        """
+        health = await AsyncElasticMonitoring.monitor(ZONE)
+
+        assert health['status'] == ElasticMonitoring.monitor(ZONE)['status']
+
+
+    async def test_get_not_found(self, monkeypatch, mocker, dataset):
+        """return None
+        """
+        assert await AsyncElasticCommand.get(ZONE, "not_existing") is None
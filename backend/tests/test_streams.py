@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import uuid
+
+import pytest
+
+import ujson as json
+
+from tests.data.base_data import ZONE, CATALOG
+
+from redis_client import redis_conn
+from stream_consumer import StreamConsumer
+import streams
+import config
+
+
+@pytest.fixture
+def stream_zone():
+    """a zone with a brand new stream, deleted after the test"""
+    zone = f"{ZONE}_{uuid.uuid4().hex}"
+    yield zone
+    redis_conn.delete(streams.stream_key(zone), streams.dead_letter_key(zone))
+    redis_conn.srem("reps:zones", zone)
+
+
+def _failing_index(positions):
+    """a mock of do_index failing to index the products at the positions passed"""
+    def index(products_list, catalog, zone, failures=None, **kwargs):
+        failures.extend(positions)
+        return {'created': len(products_list) - len(positions), 'updated': 0, 'errors': len(positions)}
+    return index
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
+class TestStreams(object):
+    """
+    """
+
+    def test_append_items(self, monkeypatch, mocker, dataset, stream_zone):
+        """
+        """
+        items = copy.deepcopy(dataset['products']['valid'][:2])
+        ids = streams.append_items(items, catalog=CATALOG, zone=stream_zone)
+
+        assert len(ids) == 2
+        assert stream_zone in streams.zones()
+        assert redis_conn.xlen(streams.stream_key(stream_zone)) == 2
+
+
+    def test_stats(self, monkeypatch, mocker, dataset, stream_zone):
+        """entries read but not acknowledged are pending
+        """
+        items = copy.deepcopy(dataset['products']['valid'][:2])
+        streams.append_items(items, catalog=CATALOG, zone=stream_zone)
+        redis_conn.xreadgroup(config.Q.STREAM_GROUP, "consumer", {streams.stream_key(stream_zone): '>'}, count=1)
+
+        stats = streams.stats()[stream_zone]
+
+        assert stats['length'] == 2
+        assert stats['dead'] == 0
+        assert stats['groups'][0]['pending'] == 1
+
+
+    def test_depth(self, monkeypatch, mocker, dataset, stream_zone):
+        """the items delivered and not acknowledged are still waiting to be indexed
+        """
+        items = copy.deepcopy(dataset['products']['valid'][:3])
+        ids = streams.append_items(items, catalog=CATALOG, zone=stream_zone)
+        before = streams.depth()
+        redis_conn.xreadgroup(config.Q.STREAM_GROUP, "consumer", {streams.stream_key(stream_zone): '>'}, count=2)
+
+        assert streams.depth() == before
+        streams.ack(stream_zone, ids[:2])
+        assert streams.depth() == before - 2
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
+class TestStreamConsumer(object):
+    """
+    """
+
+    def test_read_ack(self, monkeypatch, mocker, dataset, stream_zone):
+        """items are indexed by catalog and acknowledged
+        """
+        monkeypatch.setattr('config.Q.STREAM_BLOCK_MS', 10)
+        mock_index = mocker.patch("stream_consumer.do_index")
+        mock_index.return_value = {'created': 1, 'updated': 0, 'errors': 0}
+
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:2]), catalog=CATALOG, zone=stream_zone)
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:1]), catalog="other", zone=stream_zone)
+
+        consumer = StreamConsumer("consumer")
+        consumer.read()
+
+        assert sorted([(c[0][1], len(c[0][0])) for c in mock_index.call_args_list]) == [(CATALOG, 2), ("other", 1)]
+        assert streams.stats()[stream_zone]['groups'][0]['pending'] == 0
+        # the items indexed are deleted, the stream only holds the items waiting to be indexed
+        assert streams.stats()[stream_zone]['length'] == 0
+
+
+    def test_traces(self, monkeypatch, mocker, dataset, stream_zone):
+        """the traces of the items are passed to the indexing along with the items
+        """
+        monkeypatch.setattr('config.Q.STREAM_BLOCK_MS', 10)
+        mock_index = mocker.patch("stream_consumer.do_index")
+        mock_index.return_value = {'created': 2, 'updated': 0, 'errors': 0}
+
+        trace = {'id': 'a1b2', 'scraped_at': 100.5, 'received_at': 101.0}
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:2]), catalog=CATALOG, zone=stream_zone, traces=[trace, None])
+
+        consumer = StreamConsumer("consumer")
+        consumer.read()
+
+        args, kwargs = mock_index.call_args
+        assert kwargs['traces'] == [trace, None]
+
+
+    def test_technical_error_not_acknowledged(self, monkeypatch, mocker, dataset, stream_zone):
+        """items are left pending when none of them could be indexed
+        """
+        monkeypatch.setattr('config.Q.STREAM_BLOCK_MS', 10)
+        mock_index = mocker.patch("stream_consumer.do_index")
+        mock_index.side_effect = _failing_index([0])
+
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:1]), catalog=CATALOG, zone=stream_zone)
+
+        consumer = StreamConsumer("consumer")
+        consumer.read()
+
+        assert streams.stats()[stream_zone]['groups'][0]['pending'] == 1
+
+
+    def test_partial_error(self, monkeypatch, mocker, dataset, stream_zone):
+        """only the items indexed are acknowledged, the others are left pending
+        """
+        monkeypatch.setattr('config.Q.STREAM_BLOCK_MS', 10)
+        mock_index = mocker.patch("stream_consumer.do_index")
+        mock_index.side_effect = _failing_index([1])
+
+        ids = streams.append_items(copy.deepcopy(dataset['products']['valid'][:3]), catalog=CATALOG, zone=stream_zone)
+
+        consumer = StreamConsumer("consumer")
+        consumer.read()
+
+        pending = redis_conn.xpending_range(streams.stream_key(stream_zone), config.Q.STREAM_GROUP, min='-', max='+', count=10)
+        assert [streams._decode(p['message_id']) for p in pending] == [ids[1]]
+        assert streams.stats()[stream_zone]['length'] == 1
+
+
+    def test_group_deleted(self, monkeypatch, mocker, dataset, stream_zone):
+        """the consumer groups are created again when a group was deleted
+        """
+        monkeypatch.setattr('config.Q.STREAM_BLOCK_MS', 10)
+        mock_index = mocker.patch("stream_consumer.do_index")
+        mock_index.return_value = {'created': 1, 'updated': 0, 'errors': 0}
+        mock_ensure = mocker.spy(streams, "ensure_group")
+
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:1]), catalog=CATALOG, zone=stream_zone)
+
+        consumer = StreamConsumer("consumer")
+        consumer.read()
+        assert mock_ensure.call_count == 1
+        assert mock_index.call_count == 1
+
+        redis_conn.xgroup_destroy(streams.stream_key(stream_zone), config.Q.STREAM_GROUP)
+        assert consumer.read() == 0
+        assert mock_ensure.call_count == 2
+
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:1]), catalog=CATALOG, zone=stream_zone)
+        consumer.read()
+        assert mock_index.call_count == 2
+
+
+    def test_reclaim(self, monkeypatch, mocker, dataset, stream_zone):
+        """idle pending items are processed by another consumer, items delivered too many times are dead
+        """
+        monkeypatch.setattr('config.Q.STREAM_CLAIM_IDLE_MS', 0)
+        monkeypatch.setattr('config.Q.STREAM_MAX_DELIVERIES', 2)
+        mock_index = mocker.patch("stream_consumer.do_index")
+        mock_index.side_effect = _failing_index([0])
+
+        streams.append_items(copy.deepcopy(dataset['products']['valid'][:1]), catalog=CATALOG, zone=stream_zone)
+        redis_conn.xreadgroup(config.Q.STREAM_GROUP, "dead_consumer", {streams.stream_key(stream_zone): '>'}, count=1)
+
+        consumer = StreamConsumer("consumer")
+
+        # delivered a second time, still in error
+        consumer.reclaim()
+        assert mock_index.call_count == 1
+
+        # delivered too many times
+        consumer.reclaim()
+        stats = streams.stats()[stream_zone]
+        assert mock_index.call_count == 1
+        assert stats['groups'][0]['pending'] == 0
+        assert stats['dead'] == 1
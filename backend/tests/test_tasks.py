@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+from datetime import datetime
+
+import pytest
+
+from tests.data.base_data import ZONE, CATALOG
+
+from redis_client import redis_conn
+
+import tasks
+import dedup
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker")
+class TestScheduler(object):
+    """
+    """
+
+    def test_schedule_once(self, monkeypatch, mocker):
+        """a job is scheduled under its id, unless a job of this id is already scheduled
+        """
+        job_id = "scheduled:test_schedule_once"
+        redis_conn.delete(f"scheduler:lock:{job_id}")
+        mock_schedule = mocker.patch("tasks.scheduler.schedule")
+
+        tasks._schedule_once(job_id, scheduled_time=datetime.utcnow(), func=tasks.do_flush_errors, interval=60, repeat=None)
+        args, kwargs = mock_schedule.call_args
+        assert kwargs['id'] == job_id
+
+        # already scheduled by another process
+        mocker.patch("tasks.Scheduler.__contains__").return_value = True
+        redis_conn.delete(f"scheduler:lock:{job_id}")
+        tasks._schedule_once(job_id, scheduled_time=datetime.utcnow(), func=tasks.do_flush_errors, interval=60, repeat=None)
+        assert mock_schedule.call_count == 1
+
+        redis_conn.delete(f"scheduler:lock:{job_id}")
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker")
+class TestBackpressure(object):
+    """
+    """
+
+    async def test_hysteresis(self, monkeypatch, mocker):
+        """the throttling starts over the high watermark and stops under the low watermark
+        """
+        monkeypatch.setattr('config.Q.INGEST_HIGH_WATERMARK', 10)
+        monkeypatch.setattr('config.Q.INGEST_LOW_WATERMARK', 5)
+        monkeypatch.setattr('tasks._DEPTH_CACHE_SECONDS', 0)
+        mock_depth = mocker.patch("tasks.ingestion_depth")
+        tasks.redis_conn.delete(tasks._THROTTLED_KEY)
+
+        try:
+            states = []
+            for depth in [3, 10, 7, 5, 7]:
+                mock_depth.return_value = depth
+                states.append(tasks.is_ingestion_throttled())
+
+            assert states == [False, True, True, False, False]
+        finally:
+            tasks.redis_conn.delete(tasks._THROTTLED_KEY)
+
+
+    async def test_stream_depth(self, monkeypatch, mocker):
+        """in stream mode, the depth is the length of the streams, read at most once per second
+        """
+        monkeypatch.setattr('config.Q.INGEST_TRANSPORT', 'stream')
+        monkeypatch.setattr('tasks._depth_cache', {'depth': 0, 'read_at': 0})
+        mock_depth = mocker.patch("streams.depth")
+        mock_depth.return_value = 12000
+
+        assert tasks.ingestion_depth() == 12000
+        assert tasks.ingestion_depth() == 12000
+        assert mock_depth.call_count == 1
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker")
+class TestDeduplication(object):
+    """
+    """
+
+    async def test_duplicates_suppressed(self, monkeypatch, mocker):
+        """the copies of an item received within the window are not enqueued
+        """
+        monkeypatch.setattr('config.Q.INGEST_TRANSPORT', 'rq')
+        monkeypatch.setattr('config.Q.INGEST_DEDUP_WINDOW', 60)
+        mock_enqueue = mocker.patch("tasks.high_q.enqueue")
+        mock_enqueue.return_value.id = "job"
+
+        catalog = f"dedup-{uuid.uuid4()}"
+        item = {'sku': 'sku-1', 'title': 'Maison', 'price': 100000}
+        changed = dict(item, price=90000)
+
+        try:
+            assert tasks.index_items([item, dict(item)], catalog=catalog, zone=ZONE) == "job"
+            assert mock_enqueue.call_args[0][1] == [item]
+
+            # sent again by another listing page
+            assert tasks.index_items([dict(item)], catalog=catalog, zone=ZONE) is None
+            assert mock_enqueue.call_count == 1
+
+            # the content of the ad has changed, the traces follow the items kept
+            assert tasks.index_items([item, changed], catalog=catalog, zone=ZONE, traces=[{'id': 'a'}, {'id': 'b'}]) == "job"
+            assert mock_enqueue.call_args[0][1] == [changed]
+            assert mock_enqueue.call_args[1]['traces'] == [{'id': 'b'}]
+
+            assert dedup.stats()[catalog] == {'accepted': 2, 'suppressed': 3}
+        finally:
+            redis_conn.delete(*redis_conn.keys(f"dedup:{catalog}:*"))
+            redis_conn.hdel(dedup._STATS_KEY, f"{catalog}:accepted", f"{catalog}:suppressed")
+
+
+    async def test_release_on_enqueue_error(self, monkeypatch, mocker):
+        """the items which could not be enqueued are not dropped when they are sent again
+        """
+        monkeypatch.setattr('config.Q.INGEST_TRANSPORT', 'rq')
+        monkeypatch.setattr('config.Q.INGEST_DEDUP_WINDOW', 60)
+        mock_enqueue = mocker.patch("tasks.high_q.enqueue")
+        mock_enqueue.side_effect = [ConnectionError("boom"), mocker.Mock(id="job")]
+
+        catalog = f"dedup-{uuid.uuid4()}"
+        item = {'sku': 'sku-1', 'title': 'Maison', 'price': 100000}
+
+        try:
+            with pytest.raises(ConnectionError):
+                tasks.index_items([item], catalog=catalog, zone=ZONE)
+
+            assert tasks.index_items([dict(item)], catalog=catalog, zone=ZONE) == "job"
+        finally:
+            redis_conn.delete(*redis_conn.keys(f"dedup:{catalog}:*"))
+            redis_conn.hdel(dedup._STATS_KEY, f"{catalog}:accepted", f"{catalog}:suppressed")
+
+
+    async def test_single_round_trip(self, monkeypatch, mocker):
+        """the commands of the caller, the claim of the item and the check of the ingest session are sent to Redis at once
+        """
+        monkeypatch.setattr('config.Q.INGEST_TRANSPORT', 'rq')
+        monkeypatch.setattr('config.Q.INGEST_DEDUP_WINDOW', 60)
+        mock_enqueue = mocker.patch("tasks.high_q.enqueue")
+        mock_execute = mocker.spy(tasks.redis_conn.pipeline().__class__, 'execute')
+
+        catalog = f"dedup-{uuid.uuid4()}"
+        item = {'sku': 'sku-1', 'title': 'Maison', 'price': 100000}
+        session_key = tasks.ingest_session_key(ZONE)
+
+        try:
+            redis_conn.set(session_key, '{}')
+            pipe = redis_conn.pipeline()
+            pipe.hincrby(f"dedup:{catalog}:caller", 'count', 1)
+            tasks.index_items([item], catalog=catalog, zone=ZONE, pipe=pipe)
+
+            assert mock_execute.call_count == 1
+            assert int(redis_conn.hget(f"dedup:{catalog}:caller", 'count')) == 1
+            assert mock_enqueue.call_args[1]['force_refresh'] is False
+        finally:
+            redis_conn.delete(session_key)
+            redis_conn.delete(*redis_conn.keys(f"dedup:{catalog}:*"))
+            redis_conn.hdel(dedup._STATS_KEY, f"{catalog}:accepted", f"{catalog}:suppressed")
+
+
+    async def test_dedup_disabled(self, monkeypatch, mocker):
+        """all the items are enqueued when the window is 0
+        """
+        monkeypatch.setattr('config.Q.INGEST_TRANSPORT', 'rq')
+        monkeypatch.setattr('config.Q.INGEST_DEDUP_WINDOW', 0)
+        mock_enqueue = mocker.patch("tasks.high_q.enqueue")
+
+        item = {'sku': 'sku-1', 'title': 'Maison', 'price': 100000}
+        tasks.index_items([item, dict(item)], catalog=CATALOG, zone=ZONE)
+
+        assert mock_enqueue.call_args[0][1] == [item, item]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import tracing
+from metrics import STAGE_DURATION
+
+
+@pytest.fixture
+def stage_duration():
+    STAGE_DURATION.reset()
+    yield STAGE_DURATION
+    STAGE_DURATION.reset()
+
+
+class TestTracing(object):
+    """
+    """
+
+    def test_receive(self):
+        """the trace is completed with its reception time, the invalid traces are ignored
+        """
+        trace = tracing.receive({'id': 'a1b2', 'scraped_at': '100.5'}, received_at=102)
+
+        assert trace == {'id': 'a1b2', 'scraped_at': 100.5, 'received_at': 102}
+        assert tracing.receive({'id': 'a1b2', 'scraped_at': 'yesterday'}, received_at=102)['scraped_at'] is None
+        assert tracing.receive(None) is None
+        assert tracing.receive({'scraped_at': 100}) is None
+        assert tracing.receive("a1b2") is None
+
+
+    def test_observe(self, stage_duration):
+        """the durations are observed per catalog and per stage, the unknown bounds and the skewed clocks are ignored
+        """
+        tracing.observe('glv', 'http', 100, 102)
+        tracing.observe('glv', 'http', None, 102)
+        tracing.observe('glv', 'http', 104, 102)
+
+        assert stage_duration.percentiles()[('glv', 'http')]['count'] == 1
+
+
+    def test_is_sampled(self, monkeypatch):
+        """the sampling is deterministic per trace id
+        """
+        monkeypatch.setattr('config.ENV.TRACE_SAMPLE_PERCENT', 0)
+        assert not tracing.is_sampled({'id': 'a1b2'})
+
+        monkeypatch.setattr('config.ENV.TRACE_SAMPLE_PERCENT', 100)
+        assert tracing.is_sampled({'id': 'a1b2'})
+
+        monkeypatch.setattr('config.ENV.TRACE_SAMPLE_PERCENT', 50)
+        sampled = [tracing.is_sampled({'id': f"trace_{i}"}) for i in range(100)]
+        assert sampled == [tracing.is_sampled({'id': f"trace_{i}"}) for i in range(100)]
+        assert 0 < sum(sampled) < 100
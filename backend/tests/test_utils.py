@@ -17,3 +17,13 @@ async def test_safe_text_accept(monkeypatch, mocker, dataset):
     """try accepting some chars"""
 
     assert utils.safe_text("my?_# text", accept=["_", " "]) == "my_ text"
+
+
+async def test_content_hash_stable(monkeypatch, mocker, dataset):
+    """the order of the keys does not matter, excluded keys are ignored"""
+
+    a = {'sku': "1", 'title': "my title", 'price': 100}
+    b = {'price': 100, 'title': "my title", 'sku': "1", 'is_new': True}
+
+    assert utils.content_hash(a) == utils.content_hash(b, exclude=['is_new'])
+    assert utils.content_hash(a) != utils.content_hash(dict(a, price=101))
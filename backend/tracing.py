@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tracing of the time taken by an ad to become searchable, from the spider to Elasticsearch
+
+The spiders attach a trace to each item sent: {'id': '...', 'scraped_at': <epoch seconds>},
+the trace is completed along the ingestion and the duration of each stage is observed per catalog
+in the histogram ingest_stage_duration_seconds (see metrics.py):
+
+- http: from the scraping of the item to its reception by /reps, including the retries of the spider
+- queue: from the reception of the item to the start of its indexing job (RQ queue or stream)
+- enrichment: the extraction of the features and of the attributes of the batch of the item
+- indexing: the bulk write of the batch of the item
+- refresh: from the end of the bulk write to the item being returned by a search
+- total: from the scraping of the item to the item being returned by a search
+
+The refresh is only traced for a sample of the new or changed items (config.ENV.TRACE_SAMPLE_PERCENT),
+it is measured by polling Elasticsearch every config.ENV.TRACE_POLL_INTERVAL_MS, the duration is thus rounded up to the interval
+"""
+
+import time
+import zlib
+import logging
+
+from metrics import STAGE_DURATION
+import config
+
+
+LOGGER = logging.getLogger('app')
+
+
+def _to_timestamp(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def receive(trace, received_at=None):
+    """
+    the trace sent by the spider, completed with the time of its reception, None if no trace was sent
+
+    :Example:
+    >>> receive({'id': 'a1b2', 'scraped_at': 1588291200.5})
+    {'id': 'a1b2', 'scraped_at': 1588291200.5, 'received_at': 1588291201.2}
+    """
+    if not isinstance(trace, dict) or not trace.get('id'):
+        return None
+
+    return {
+        'id': str(trace['id']),
+        'scraped_at': _to_timestamp(trace.get('scraped_at')),
+        'received_at': received_at or time.time()
+    }
+
+
+def observe(catalog, stage, start, end):
+    """observes the duration of the stage of a trace, ignored when a bound is unknown or when the clocks are skewed"""
+    if start is None or end is None or end < start:
+        return
+    STAGE_DURATION.observe(end - start, catalog=catalog, stage=stage)
+
+
+def is_sampled(trace):
+    """True when the refresh of the item of the trace is to be traced, the sampling is deterministic per trace id"""
+    return zlib.crc32(trace['id'].encode('utf-8')) % 100 < config.ENV.TRACE_SAMPLE_PERCENT
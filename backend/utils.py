@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import collections
+import hashlib
+import json
 import text_unidecode
 import re
 import string
@@ -36,3 +38,20 @@ def is_list(obj):
     if isinstance(obj, collections.abc.Sequence) and not isinstance(obj, str):
         return True
     return False
+
+
+def chunks(a_list, size):
+    """yields successive chunks of the given size from a_list"""
+    for i in range(0, len(a_list), size):
+        yield a_list[i:i + size]
+
+
+def content_hash(dict_of_data, exclude=[]):
+    """
+    stable fingerprint of the content of a dict, which does not depend on the order of its keys
+
+    :param exclude: list of keys not taken into account
+    """
+    content = {k: v for k, v in dict_of_data.items() if k not in exclude}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
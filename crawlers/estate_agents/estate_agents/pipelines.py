@@ -6,9 +6,14 @@ import logging
 import ujson as json
 import requests
 import datetime
+import time
+import uuid
 
 from .items import ESTATE_PROPERTY_SCHEMA, EstateProperty
 from scrapy.exceptions import DropItem
+from scrapy import signals
+
+from twisted.internet import defer, reactor, task, threads
 
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError
@@ -23,16 +28,73 @@ class HttpPipeline(object):
     - 'name' : the endpoint name
     - 'zone' : a geographical zone to which scraped items belong (ex: paris_8)
     - 'item' : the item scrapped
+    - 'trace' : the id of the trace of the item and the time it was scraped, to measure the time taken by the item to be searchable
+
+    When the backend asks to slow down (HTTP 429 or 503) or cannot be reached,
+    the item is sent again with an exponential backoff, honouring the Retry-After header.
+    The requests are sent in a thread and the backoff is waited for without blocking the reactor:
+    the items waited for fill the scraper, which slows down the crawl meanwhile
+
+    The items accepted by the backend are counted in the stat 'http_pipeline/delivered', reported by the OnClosePipeline,
+    so that a crawl which could not deliver its items is not considered healthy by the backend
     """
+
+    # the status codes telling that the item must be sent later
+    RETRY_STATUS_CODES = (429, 503)
+
+    def __init__(self, stats=None):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def _delay(self, attempt, spider, response=None):
+        """the delay before the next attempt, in seconds"""
+        backoff = int(spider.settings.get('ON_PROCESS_ITEM_BACKOFF', 2))
+        max_backoff = int(spider.settings.get('ON_PROCESS_ITEM_MAX_BACKOFF', 300))
+
+        delay = backoff * (2 ** attempt)
+        if response is not None:
+            try:
+                delay = max([delay, int(response.headers.get('Retry-After', 0))])
+            except ValueError:
+                # Retry-After passed as a HTTP date is not supported
+                pass
+        return min([delay, max_backoff])
+
+    @defer.inlineCallbacks
+    def _post(self, url, payload, spider):
+        """posts the payload, retries while the backend is late, returns a Deferred firing with the response"""
+        max_retries = int(spider.settings.get('ON_PROCESS_ITEM_MAX_RETRIES', 8))
+        attempt = 0
+
+        while True:
+            try:
+                r = yield threads.deferToThread(requests.post, url, data=payload, headers={'Content-Type': 'application/json'})
+                if r.status_code not in self.RETRY_STATUS_CODES:
+                    return r
+                error, delay = f"HTTP {r.status_code}", self._delay(attempt, spider, r)
+            except requests.exceptions.ConnectionError as e:
+                error, delay = e, self._delay(attempt, spider)
+
+            if attempt >= max_retries:
+                raise IOError(f"Giving up sending the item to {url} after {attempt + 1} attempts: {error}")
+
+            pipelineLogger.warning(f"Backend not available ({error}), item sent again in {delay}s")
+            yield task.deferLater(reactor, delay, lambda: None)
+            attempt += 1
+
+    @defer.inlineCallbacks
     def process_item(self, item, spider):
         """
+        returns a Deferred firing with the item once it is sent
         """
         ON_PROCESS_ITEM = spider.settings.get('ON_PROCESS_ITEM', None)
         ZONE = spider.settings.get('ZONE', '')
         CATALOG =  spider.name
 
         if ON_PROCESS_ITEM is not None:
-            headers = {'Content-Type': 'application/json'}
             try:
                 item = dict(item)
 
@@ -41,14 +103,23 @@ class HttpPipeline(object):
                     if bool(spider.settings.get('SKIP_DIRTY_ITEMS', False)):
                         raise ValueError(f"Skipping dirty item {item}")
 
-                r = requests.post(ON_PROCESS_ITEM,
-                                data=json.dumps({
+                r = yield self._post(ON_PROCESS_ITEM,
+                                json.dumps({
                                     'catalog': CATALOG,
                                     'zone': ZONE,
-                                    'item':dict(item)
+                                    'item':dict(item),
+                                    'trace': {
+                                        'id': uuid.uuid4().hex,
+                                        'scraped_at': time.time()
+                                        }
                                     }),
-                                headers=headers)
-                pipelineLogger.debug(f"Item {item.get('sku')} sent to {ON_PROCESS_ITEM}")
+                                spider)
+                if r.status_code >= 400:
+                    pipelineLogger.error(f"Item {item.get('sku')} rejected by {ON_PROCESS_ITEM}: HTTP {r.status_code} {r.text}")
+                else:
+                    pipelineLogger.debug(f"Item {item.get('sku')} sent to {ON_PROCESS_ITEM}")
+                    if self.stats is not None and 200 <= r.status_code < 300:
+                        self.stats.inc_value('http_pipeline/delivered', spider=spider)
 
             except Exception as e:
                 pipelineLogger.error(e)
@@ -82,18 +153,45 @@ class JsonSchemaValidatePipeline(object):
 
 class OnClosePipeline(object):
     """
-    sending a POST request to config.ENV.CLIENT_ON_CLOSE notifying the end of the crawling process
+    sending a POST request to config.ENV.ON_SPIDER_CLOSE notifying the end of the crawling process,
+    with the zone crawled and the stats of the crawl, so that the backend keeps track of the healthy crawls of each catalog
+
+    The request is sent on the signal spider_closed, once the finish_reason and the finish_time are set in the stats
     """
     def __init__(self, stats):
         self.stats = stats
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.stats)
-
-    def close_spider(self, spider):
+        pipeline = cls(crawler.stats)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def _serializable_stats(self, reason):
+        """the stats of the crawl, the dates being ISO formatted"""
+        stats = {}
+        for key, value in self.stats.get_stats().items():
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.isoformat()
+            stats[key] = value
+        stats.setdefault('finish_reason', reason)
+        return stats
+
+    def spider_closed(self, spider, reason):
         ON_SPIDER_CLOSE = spider.settings.get('ON_SPIDER_CLOSE', None)
         if ON_SPIDER_CLOSE is not None:
-            pipelineLogger.debug('closing spider {}'.format(self.stats.get_stats()))
+            stats = self._serializable_stats(reason)
+            pipelineLogger.debug('closing spider {}'.format(stats))
             headers = {'Content-Type': 'application/json'}
-            requests.post(ON_SPIDER_CLOSE, data=json.dumps({'spider':spider.name, 'stats':self.stats.get_stats()}), headers=headers)
+            try:
+                requests.post(
+                    ON_SPIDER_CLOSE,
+                    data=json.dumps({
+                        'spider': spider.name,
+                        'zone': spider.settings.get('ZONE', ''),
+                        'stats': stats
+                    }),
+                    headers=headers
+                )
+            except requests.exceptions.RequestException as e:
+                pipelineLogger.error(f"Unable to report the crawl to {ON_SPIDER_CLOSE}: {e}")
@@ -69,6 +69,19 @@ ITEM_PIPELINES = {
 # ON_PROCESS_ITEM = 'http://142.93.186.90:1378/products'
 ON_PROCESS_ITEM = os.getenv('ON_PROCESS_ITEM', default='http://127.0.0.1:8000/reps')
 
+# report the stats of the crawl to the following URL when the spider closes,
+# the ads of a catalog are only cleaned up by the backend after a successful crawl
+ON_SPIDER_CLOSE = os.getenv('ON_SPIDER_CLOSE', default='http://127.0.0.1:8000/crawls')
+
+# when the backend is late (HTTP 429 or 503) or not reachable, the item is sent again after a delay
+# doubling at each attempt (starting at ON_PROCESS_ITEM_BACKOFF seconds, max ON_PROCESS_ITEM_MAX_BACKOFF seconds),
+# the Retry-After header of the response is honoured.
+# The wait does not block the reactor, the crawl slows down as the items waiting fill the scraper,
+# the item is dropped after ON_PROCESS_ITEM_MAX_RETRIES attempts
+ON_PROCESS_ITEM_MAX_RETRIES = max([0, int('0' + os.getenv('ON_PROCESS_ITEM_MAX_RETRIES', default="8"))])
+ON_PROCESS_ITEM_BACKOFF = max([1, int('0' + os.getenv('ON_PROCESS_ITEM_BACKOFF', default="2"))])
+ON_PROCESS_ITEM_MAX_BACKOFF = max([1, int('0' + os.getenv('ON_PROCESS_ITEM_MAX_BACKOFF', default="300"))])
+
 # if set to True, items crawled and marked as "dirty" will not be sent to the URL 'ON_PROCESS_ITEM'
 # default is False
 SKIP_DIRTY_ITEMS = True
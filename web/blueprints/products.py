@@ -5,6 +5,7 @@ import urllib
 import itertools
 import operator
 import time
+import hashlib
 
 from elasticsearch import ElasticsearchException
 from jsonschema import validators, Draft4Validator
@@ -20,7 +21,7 @@ from sanic_babel import gettext
 from objects import User
 from services.user_service import UserService
 from services.data.data_meta import CatalogMeta
-from services.data.data_provider import ProductService
+from services.data.data_provider import AsyncProductService, RANGE_FIELDS
 from services.exceptions import ServiceError
 
 from . import products_blueprint
@@ -73,16 +74,53 @@ def _format_item_response(dict_item):
     return dict_item
 
 
+def _parse_ranges(args):
+    """
+    the ranges of typed attributes passed as query args '<field>_min' and '<field>_max'
+
+    :Example:
+    >>> _parse_ranges(request.args)  # ?bedrooms_min=3&energy_class_max=C
+    {'bedrooms': {'gte': '3'}, 'energy_class': {'lte': 'C'}}
+    """
+    ranges = {}
+    for field in RANGE_FIELDS:
+        for suffix, op in (('_min', 'gte'), ('_max', 'lte')):
+            value = args.get(f"{field}{suffix}")
+            if value is not None and str(value).strip():
+                ranges.setdefault(field, {})[op] = value
+    return ranges
+
+
+def _search_preference(request, user_id=''):
+    """
+    the preference of the searches of the user, a hash of the user id or of the session id when the user is anonymous,
+    so that the pages of a user are served by the same shard copies. None when the request has no session
+
+    :Example:
+    >>> _search_preference(request, 'a_user_id')
+    'b0b1d1c2...'
+    """
+    key = user_id.strip() if user_id else ''
+    if not key:
+        session = getattr(request.ctx, 'session', None) or {}
+        key = getattr(session.get('session'), 'sid', None) or ''
+    if not key:
+        return None
+    # the values starting with '_' are reserved by Elasticsearch
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
 @products_blueprint.route('/<id>', methods=["GET"])
 @parse_query_args
-async def get_product(request, id: str, zone: str = ''):
+async def get_product(request, id: str, zone: str = '', catalog: str = ''):
     """
+    the catalog of the product is optional, it routes the request to a single shard in a routed zone
     """
     if not zone or not zone.strip():
         raise InvalidUsage(f"zone must be set")
 
-    elastic_session = ProductService(zone)
-    result = elastic_session.get(id=id)
+    elastic_session = AsyncProductService(zone)
+    result = await elastic_session.get(id=id, catalog=catalog.strip() or None)
 
     if result is None:
         LOGGER.warning(f"document with id {id} not existing for zone '{zone}'")
@@ -122,7 +160,8 @@ async def list_products(
     max_price: str='',
     feature: fields.List[str]=None,
     catalog: str='',
-    tbv: bool=False):
+    tbv: bool=False,
+    explain_plan: bool=False):
     """
     the products of a given zone
 
@@ -134,7 +173,10 @@ async def list_products(
     :param max_price: float. When set to O, we consider the price should not be considered as a filter
     :param catalog: optional, the real estate agency on which the real estate property has been scraped. Ignored when void
     :param tbv: when set to True, only the properties marked "tbv" are listed. Defaults is False
+    :param explain_plan: debug mode, when set to True the response has a 'plan': the query sent to Elasticsearch and its 'took' time in ms
 
+    The typed attributes (bedrooms, rooms, land_area, floor, energy_class) can be filtered passing
+    '<field>_min' and/or '<field>_max', ex: bedrooms_min=3&energy_class_max=C
     """
 
     if not zone.strip():
@@ -169,15 +211,18 @@ async def list_products(
         exclude_items = user.deja_vu.get(zone)
 
     # query entries
-    service = ProductService(zone)
-    entries, count = service.find(
-        page=page,
-        city=city,
-        max_price=max_price,
-        exclude=exclude_items,
-        feature=feature,
-        catalog=catalog
-    )
+    service = AsyncProductService(zone)
+    search_params = {
+        'page': page,
+        'city': city,
+        'max_price': max_price,
+        'exclude': exclude_items,
+        'feature': feature,
+        'catalog': catalog,
+        'ranges': _parse_ranges(request.args),
+        'preference': _search_preference(request, user_id)
+    }
+    entries, count = await service.find(**search_params)
 
     # fetch meta to have the _id
     results = [_entry.to_json(include_meta=True) for _entry in entries]
@@ -257,14 +302,21 @@ async def list_products(
     rest = count%config.ES.RESULTS_PER_PAGE
     pages = count//config.ES.RESULTS_PER_PAGE if rest == 0 else count//config.ES.RESULTS_PER_PAGE + 1
 
-    return response.json({
+    result = {
         'success': True,
         'products': results,
         'catalogs': catalogs,
         'count': count,
         'pages': pages,
         'current_page': page,
-    })
+    }
+
+    if explain_plan:
+        # the same params give the same query body
+        result['plan'] = AsyncProductService(zone).explain(**search_params)
+        result['plan']['took'] = entries.took
+
+    return response.json(result)
 
 
 
@@ -11,7 +11,7 @@ from sanicargs import parse_query_args
 import ujson as json
 
 from services.exceptions import ServiceError
-from services.data.data_provider import ProductService
+from services.data.data_provider import AsyncProductService
 
 from . import terms_blueprint
 
@@ -42,8 +42,8 @@ async def get_terms(request, term: str, zone: str, q: str=None):
     if q:
         q = utils.safe_text(urllib.parse.unquote(q))
 
-    service = ProductService(zone)
-    results = service.get_term_facets(term, startswith=q)
+    service = AsyncProductService(zone)
+    results = await service.get_term_facets(term, startswith=q)
     # do not return doc_count, only values
     results = [f[0] for f in results]
 
@@ -26,6 +26,29 @@ class ElasticsearchConfig(object):
     # default : no replica on the cluster
     ES_REPLICAS = int('0' + os.getenv('ES_REPLICAS', default='0'))
 
+    # the Elasticsearch clients are kept per process (see elastic_client.py)
+    # ES_HOST may be a comma separated list of hosts
+    # max number of keep-alive connections per node
+    ES_POOL_MAXSIZE = max([1, int('0' + os.getenv('ES_POOL_MAXSIZE', default='10'))])
+
+    # requests timeout, in seconds
+    ES_TIMEOUT = max([1, int('0' + os.getenv('ES_TIMEOUT', default='10'))])
+
+    # compress the requests bodies (gzip), useful for bulk requests on a remote cluster
+    ES_HTTP_COMPRESS = bool(max([0, int('0' + os.getenv('ES_HTTP_COMPRESS', default='0'))]))
+
+    # discover the nodes of the cluster from the hosts passed, at startup and when a node fails
+    ES_SNIFF = bool(max([0, int('0' + os.getenv('ES_SNIFF', default='0'))]))
+    ES_SNIFFER_TIMEOUT = max([1, int('0' + os.getenv('ES_SNIFFER_TIMEOUT', default='60'))])
+
+    # the zones where the ads are routed by catalog, as configured in the backend, ex: "mel,paris"
+    # the searches of a single catalog only hit the shard of the catalog
+    ROUTED_ZONES = [z.strip() for z in os.getenv('ROUTED_ZONES', default='').split(',') if z.strip()]
+
+    # how the cities searched match the city of the ads: 'contains' (ex: "sainghin" matches "exclusivité sainghin xxx"),
+    # 'prefix' or 'exact', the cheaper the match, the cheaper the query (see _QueryPlanner in data_provider.py)
+    CITY_MATCH = os.getenv('CITY_MATCH', default='contains').strip().lower()
+
     # pagination in Elasticsearch
     # using max() ensures default value is 1000 if ES_PAGE_SIZE is set to ''
     # drawback: config lower than 100 will never be taken into account
@@ -16,6 +16,7 @@ from blueprints import (catalogs_blueprint, products_blueprint,
                         welcome_blueprint, login_blueprint)
 
 from objects import User
+from services.elastic_client import ElasticClientRegistry
 
 import config
 import settings
@@ -51,6 +52,11 @@ async def close_aiohttp_session(sanic_app, _loop) -> None:
     await sanic_app.async_session.close()
 
 
+@app.listener('after_server_stop')
+async def close_elastic_clients(sanic_app, loop) -> None:
+    await ElasticClientRegistry.close_async_clients(loop)
+
+
 
 """ Routes """
 
@@ -5,7 +5,8 @@ echo "$FIREBASE_SERVICE_KEY" | base64 --decode --ignore-garbage > "/app/conf/fir
 export FIREBASE_CONFIG=$(<"/app/conf/firebase-service-key.json")
 
 # wait for for Elastic to be started
-/app/scripts/wait-for-elastic.sh $ES_HOST -- echo "----- Starting gunicorn -----"
+# ES_HOST may be a comma separated list of hosts, wait for the first one
+/app/scripts/wait-for-elastic.sh ${ES_HOST%%,*} -- echo "----- Starting gunicorn -----"
 
 
 # start the server after data has been initialized
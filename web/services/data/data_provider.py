@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
 
 from elasticsearch_dsl import Search, Q
 
 import six
 
-from ..elastic_service import (ElasticSession, QueryBase, Product)
+from ..elastic_service import (ElasticSession, AsyncElasticSession, QueryBase, Product)
 
 from ..cache import *
 from objects import Catalog
@@ -14,91 +15,196 @@ import config
 import utils
 
 
-class _ObjectQuery():
+# the typed attributes which can be filtered on a range of values
+# the energy class is a letter, A being the best class
+RANGE_FIELDS = {
+    'bedrooms': int,
+    'rooms': int,
+    'land_area': float,
+    'floor': int,
+    'energy_class': lambda v: str(v).strip().upper(),
+}
+
+
+def _catalog_routing(zone, catalog):
     """
-    proxy class for fetching Review, Product or Training objects
+    the routing of the ads of a single catalog in a routed zone, as written by the backend (see search_index.catalog_routing),
+    None when the zone is not routed or when several catalogs are searched, the search then hits all the shards
+    """
+    if zone not in config.ES.ROUTED_ZONES or not catalog or utils.is_list(catalog):
+        return None
+    return catalog.strip().lower()
 
-    :Example:
-    >>> _ObjectQuery.find(catalog, Review, page=1)
-    [Review<1>, Review<2>], 2
 
+def _canonical(values):
+    """
+    the non blank values of a list, deduplicated and sorted, so that the same search gives the same query body
+    whatever the order of the values passed: Elasticsearch caches the results of a request by its body
     """
+    return sorted(set([v.strip() for v in values if v.strip()]))
 
-    def get(self, zone, cls, id=None, **kwargs):
-        """
-        Generic method for getting a unit object
 
-        :param cls: the type of object to be fetched
-        """
-        session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
-        return session.get(cls, id=id, **kwargs)
+# the characters of the Lucene regular expressions, escaped in the cities searched
+_REGEXP_RESERVED = set('.?+*|{}[]()"\\#@&<>~')
 
 
-    def _build_query(self, obj_type, zone=None, city=None, max_price=0, exclude=None, feature=None, catalog=None):
-        logger = logging.getLogger('app')
-        session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
-        es_query = session.search(obj_type)
+class _QueryPlanner():
+    """
+    plans the query of the products: the results are sorted by fields, the scores are not used,
+    so the constraints which do not search free text run in the filter context of a bool query,
+    where they are not scored and where Elasticsearch caches them, each filter using the cheapest clause:
+
+    - a single value is a term, several values are a terms when any of them matches, a term per value when all of them match
+    - the cities are a terms, a prefix or a regexp, according to how they match the city of the ads (see config.ES.CITY_MATCH)
+    - the ids excluded for a user are kept apart, in the last filter, so that the filters shared by all the users are cached whatever the exclusions
+
+    The values are sorted so that the same search gives the same query body, which is cached by Elasticsearch
+
+    :Example:
+    >>> planner = _QueryPlanner()
+    >>> planner.catalog(['glv', 'other'])
+    >>> planner.city(['lille'])
+    >>> planner.query().to_dict()
+    {'bool': {'filter': [{'terms': {'catalog': ['glv', 'other']}}, {'regexp': {'city': '.*(lille).*'}}]}}
+    """
 
-        #only 1 city among the list must match
-        if bool(city) and utils.is_list(city):
-            # transform the list of cities into a regexp
-            # and add wildwards to enable searches like "Exclusivité sainghin xxx"
-            rgxp = '|'.join([c for c in city if c.strip()!=''])
-            es_query = es_query.query("regexp", city='.*('+rgxp+').*')
+    def __init__(self):
+        # the clauses searching free text, which are scored, none of the params of the listing so far
+        self.scoring = []
+        # the filters shared by all the users
+        self.filters = []
+        # the filters specific to a user
+        self.user_filters = []
+        self.logger = logging.getLogger('app')
+
+
+    def catalog(self, catalog):
+        """a catalog term or a list of catalog terms, any of them matches"""
+        if bool(catalog) and utils.is_list(catalog) and _canonical(catalog):
+            values = _canonical(catalog)
+            self.filters.append(Q("term", catalog=values[0]) if len(values) == 1 else Q("terms", catalog=values))
+        elif bool(catalog) and not utils.is_list(catalog):
+            self.filters.append(Q("term", catalog=catalog))
         else:
-            logger.debug(f"ignored param city: {city}, must be a list")
+            self.logger.debug(f"ignored param catalog: {catalog}")
 
-        # all features in the list must match
+
+    def features(self, feature):
+        """all the features in the list must match"""
         if bool(feature) and utils.is_list(feature):
-            all_q = [Q("term", features=f) for f in feature]
-            q = Q('bool', must=all_q)  # minimum_should_match=len(feature)
-            es_query = es_query.query(q)
+            self.filters.extend([Q("term", features=f) for f in _canonical(feature)])
         else:
-            logger.debug(f"ignored param feature: {feature}, must be a list")
-
-        if bool(catalog):
-            q = Q("term", catalog=catalog)
-            es_query = es_query.query(q)
+            self.logger.debug(f"ignored param feature: {feature}, must be a list")
+
+
+    def city(self, city):
+        """only 1 city among the list must match"""
+        if not (bool(city) and utils.is_list(city) and _canonical(city)):
+            self.logger.debug(f"ignored param city: {city}, must be a list")
+            return
+
+        cities = _canonical(city)
+        if config.ES.CITY_MATCH == 'exact':
+            # the values searched are normalized by the normalizer of the field, as the values indexed
+            self.filters.append(Q("terms", city=cities))
+        elif config.ES.CITY_MATCH == 'prefix':
+            prefixes = [Q("prefix", city=c) for c in cities]
+            self.filters.append(prefixes[0] if len(prefixes) == 1 else Q('bool', should=prefixes, minimum_should_match=1))
         else:
-            logger.debug(f"ignored param catalog: {catalog}")
+            # wildcards enable searches like "Exclusivité sainghin xxx"
+            rgxp = '|'.join([''.join(['\\' + ch if ch in _REGEXP_RESERVED else ch for ch in c]) for c in cities])
+            self.filters.append(Q("regexp", city='.*('+rgxp+').*'))
+
 
+    def max_price(self, max_price):
         if max_price and max_price>0:
             try:
-                es_query = es_query.filter('range', price={'gte': 0.0, 'lte': float(max_price)})
+                self.filters.append(Q('range', price={'gte': 0.0, 'lte': float(max_price)}))
             except ValueError as ve:
                 # do not filter, fallback
-                logger.debug(f"ignore price param, failed to convert {max_price} to float")
+                self.logger.debug(f"ignore price param, failed to convert {max_price} to float")
+
+
+    def ranges(self, ranges):
+        """ranges of typed attributes, ex: {'bedrooms': {'gte': 3}, 'energy_class': {'lte': 'C'}}"""
+        for field, bounds in sorted((ranges or {}).items()):
+            if field not in RANGE_FIELDS or not isinstance(bounds, dict):
+                self.logger.debug(f"ignored range on {field}: {bounds}")
+                continue
+            try:
+                bounds = {op: RANGE_FIELDS[field](value) for op, value in sorted(bounds.items()) if op in ('gt', 'gte', 'lt', 'lte')}
+            except ValueError as ve:
+                self.logger.debug(f"ignored range on {field}, failed to convert {bounds}")
+                continue
+            if bounds:
+                self.filters.append(Q('range', **{field: bounds}))
+
 
-        # exclude ids passed
-        if bool(exclude) and utils.is_list(exclude):
+    def exclude(self, exclude):
+        """the ids excluded for a user"""
+        if bool(exclude) and utils.is_list(exclude) and _canonical(exclude):
             # prevent from querying blank ids which raises an error
-            exclude = [item for item in exclude if item.strip()!='']
-            q_exlude_ids = Q("ids", values=exclude)
-            q = Q('bool', should=[Q('bool', must_not=[q_exlude_ids])])
-            es_query = es_query.query(q)
+            self.user_filters.append(Q('bool', must_not=[Q("ids", values=_canonical(exclude))]))
         else:
-            logger.debug(f"ignored param exclude: {exclude}, must be a list")
+            self.logger.debug(f"ignored param exclude: {exclude}, must be a list")
 
-        return es_query
 
+    def query(self):
+        """the bool query planned, None when the search has no constraint"""
+        if not (self.scoring or self.filters or self.user_filters):
+            return None
+        return Q('bool', must=self.scoring, filter=self.filters + self.user_filters)
+
+
+class _ObjectQuery():
+    """
+    proxy class for fetching Review, Product or Training objects
+
+    :Example:
+    >>> _ObjectQuery.find(catalog, Review, page=1)
+    [Review<1>, Review<2>], 2
+
+    """
 
-    def find(self, zone, obj_type, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None):
+    def get(self, zone, cls, id=None, catalog=None, **kwargs):
         """
-        generic fetcher for objects
+        Generic method for getting a unit object
 
-        :param page: for pagination purpose (default is 1)
-        :param city: optional list of cities (default is None)
-        :param max_price: optional max price to filter results (0 means no price limit)
-        :param exclude: optional list of sku to exclude from the results (leave as None to include all SKU)
-        :param feature: optional list of features. A feature is a "term" (a search facet) for Elasticsearch
-        :param catalog: optional, a catalog term
+        :param cls: the type of object to be fetched
+        :param catalog: optional, the catalog of the object, the object is searched in all the shards of a routed zone if not passed
+        """
+        if _catalog_routing(zone, catalog):
+            kwargs['routing'] = _catalog_routing(zone, catalog)
+        session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+        return session.get(cls, id=id, **kwargs)
 
-        :return tuple: (list of results, count)
 
-        :Example:
-        >>> ObjectQuery.find(Product)
-        [Product<1>, Product<2>]
+    def _build_query(self, obj_type, zone=None, city=None, max_price=0, exclude=None, feature=None, catalog=None, ranges=None, session=None):
+        """
+        the search of the products matching the params, see _QueryPlanner
+        """
+        if session is None:
+            session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+        es_query = session.search(obj_type)
+
+        planner = _QueryPlanner()
+        planner.catalog(catalog)
+        planner.features(feature)
+        planner.city(city)
+        planner.max_price(max_price)
+        planner.ranges(ranges)
+        planner.exclude(exclude)
+
+        query = planner.query()
+        if query is not None:
+            es_query = es_query.query(query)
+
+        return es_query
 
+
+    def _prepare_find(self, zone, obj_type, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None, ranges=None, preference=None, session=None):
+        """
+        builds the queries of find(), returns a tuple (paginated query, count query)
         """
         logger = logging.getLogger('app')
 
@@ -109,18 +215,32 @@ class _ObjectQuery():
             max_price=max_price,
             exclude=exclude,
             feature=feature,
-            catalog=catalog
+            catalog=catalog,
+            ranges=ranges,
+            session=session
         )
 
+        # the search of a single catalog of a routed zone only hits the shard of the catalog
+        if _catalog_routing(zone, catalog):
+            es_query = es_query.params(routing=_catalog_routing(zone, catalog))
+
+        # the requests of a user session are sent to the same shard copies, which have the results cached
+        # and which give a consistent sort when paginating
+        if preference:
+            es_query = es_query.params(preference=preference)
+
         # new products come first, then order by quality_index
+        # the sort must match the index sort of the zone (see the backend search_index), missing values included,
+        # so that Elasticsearch stops collecting the documents of a segment once the page is full
         es_query = es_query.sort(
-                {"is_new" : {"order" : "desc"}}, # "T"rue comes before "F"alse
-                {"quality_index": {"order" : "desc"}} # the highest quality is the best
+                {"is_new" : {"order" : "desc", "missing": "_last"}}, # "T"rue comes before "F"alse
+                {"quality_index": {"order" : "desc", "missing": "_last"}} # the highest quality is the best
             )
 
         # only query business fields, tech fields should not be shown
         es_query = es_query.source([
-            'sku', 'title', 'description', 'city', 'features', 'price', 'media', 'url', 'catalog', 'is_new', 'area'
+            'sku', 'title', 'description', 'city', 'features', 'price', 'media', 'url', 'catalog', 'is_new', 'area',
+            'bedrooms', 'rooms', 'land_area', 'energy_class', 'floor'
         ])
 
         # paginate, need to think soon of scrolling
@@ -129,13 +249,70 @@ class _ObjectQuery():
 
         count_query = es_query
 
-        es_query = es_query[paginate_start:paginate_end]
+        # the total is given by the count query, the page query does not count the hits
+        # which enables the early termination on the sorted indices
+        es_query = es_query[paginate_start:paginate_end].extra(track_total_hits=False)
+
+        # Elasticsearch only caches the results of the requests not returning hits by default,
+        # the pages are cached as well unless they depend on the exclusions of a user
+        if not (bool(exclude) and utils.is_list(exclude) and _canonical(exclude)):
+            es_query = es_query.params(request_cache=True)
 
         logger.debug(f"Find query: {es_query.to_dict()}")
 
+        return es_query, count_query
+
+
+    def find(self, zone, obj_type, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None, ranges=None, preference=None):
+        """
+        generic fetcher for objects
+
+        :param page: for pagination purpose (default is 1)
+        :param city: optional list of cities (default is None)
+        :param max_price: optional max price to filter results (0 means no price limit)
+        :param exclude: optional list of sku to exclude from the results (leave as None to include all SKU)
+        :param feature: optional list of features. A feature is a "term" (a search facet) for Elasticsearch
+        :param catalog: optional, a catalog term or a list of catalog terms
+        :param ranges: optional ranges of typed attributes (see RANGE_FIELDS), ex: {'bedrooms': {'gte': 3}}
+        :param preference: optional, a key of the user session, the requests of the session are sent to the same shard copies
+
+        :return tuple: (list of results, count)
+
+        :Example:
+        >>> ObjectQuery.find(Product)
+        [Product<1>, Product<2>]
+
+        """
+        es_query, count_query = self._prepare_find(
+            zone,
+            obj_type,
+            page=page,
+            city=city,
+            max_price=max_price,
+            exclude=exclude,
+            feature=feature,
+            catalog=catalog,
+            ranges=ranges,
+            preference=preference
+        )
+
         return es_query.execute(), count_query.count()
 
 
+    def explain(self, zone, obj_type, **kwargs):
+        """
+        the page query of find() and its params, as sent to Elasticsearch, the query is not executed
+
+        :param kwargs: the params of find()
+
+        :Example:
+        >>> ObjectQuery.explain(zone, Product, city=['lille'])
+        {'query': {'query': {'bool': {'filter': [...]}}, 'sort': [...], ...}, 'params': {'request_cache': True}}
+        """
+        es_query, _ = self._prepare_find(zone, obj_type, **kwargs)
+        return {'query': es_query.to_dict(), 'params': dict(es_query._params)}
+
+
     def search(self, zone, obj_type):
         """returns an elasticsearch-py Search object pre-filtered on catalog"""
 
@@ -143,30 +320,105 @@ class _ObjectQuery():
         return session.search(obj_type)
 
 
+    def _term_facets_query(self, session, obj_type, term, startswith):
+        """the aggregation query of the facets of a term starting with 'startswith'"""
+        logger = logging.getLogger('app')
+        # see https://github.com/elastic/elasticsearch-dsl-py/issues/482
+        # need to use the update_from_dict instead of from_dict
+        s = session.search(obj_type).update_from_dict({
+            "size": 0,
+            "aggs" : {
+                "facets" : {
+                  "terms": {
+                      "field": term,
+                      "size": 20,
+                      "order" : { "_term" : "asc" },
+                      "script": "if (_value.startsWith(\""+startswith+"\")) {return _value} else {return \"\"}"
+                    }
+                  }
+                }
+            })
+        logger.debug(f"query: {s.to_dict()}")
+        return s
+
+
     def get_term_facets(self, zone, obj_type, term, startswith=None):
         """"""
         session = ElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
         if not startswith:
             return session.get_term_facets(obj_type, term)
         else:
-            logger = logging.getLogger('app')
-            # see https://github.com/elastic/elasticsearch-dsl-py/issues/482
-            # need to use the update_from_dict instead of from_dict
-            s = session.search(obj_type).update_from_dict({
-                "size": 0,
-                "aggs" : {
-                    "facets" : {
-                      "terms": {
-                          "field": term,
-                          "size": 20,
-                          "order" : { "_term" : "asc" },
-                          "script": "if (_value.startsWith(\""+startswith+"\")) {return _value} else {return \"\"}"
-                        }
-                      }
-                    }
-                })
-            logger.debug(f"query: {s.to_dict()}")
-            results = s.execute()
+            results = self._term_facets_query(session, obj_type, term, startswith).execute()
+            buckets = []
+            for hit in results.aggregations.facets.buckets:
+                buckets.append((hit['key'], hit['doc_count']))
+            return buckets
+
+
+class _AsyncObjectQuery(_ObjectQuery):
+    """
+    asyncio counterpart of _ObjectQuery, the queries are the same
+    but they are executed without blocking the event loop
+
+    :Example:
+    >>> await _AsyncObjectQuery().find(zone, Product, page=1)
+    [Product<1>, Product<2>], 2
+
+    """
+
+    async def get(self, zone, cls, id=None, catalog=None, **kwargs):
+        """
+        see _ObjectQuery.get()
+        """
+        if _catalog_routing(zone, catalog):
+            kwargs['routing'] = _catalog_routing(zone, catalog)
+        session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+        return await session.get(cls, id=id, **kwargs)
+
+
+    async def find(self, zone, obj_type, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None, ranges=None, preference=None):
+        """
+        see _ObjectQuery.find()
+
+        :return tuple: (list of results, count)
+        """
+        session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+        es_query, count_query = self._prepare_find(
+            zone,
+            obj_type,
+            page=page,
+            city=city,
+            max_price=max_price,
+            exclude=exclude,
+            feature=feature,
+            catalog=catalog,
+            ranges=ranges,
+            preference=preference,
+            session=session
+        )
+
+        # both requests are in flight at the same time
+        results, count = await asyncio.gather(
+            session.execute(es_query),
+            session.count(count_query)
+        )
+        return results, count
+
+
+    def search(self, zone, obj_type):
+        """returns an elasticsearch_dsl Search, to be executed by an AsyncElasticSession"""
+
+        session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+        return session.search(obj_type)
+
+
+    async def get_term_facets(self, zone, obj_type, term, startswith=None):
+        """"""
+        session = AsyncElasticSession(hosts=[config.ES.ES_HOST], zone=zone)
+        if not startswith:
+            return await session.get_term_facets(obj_type, term)
+        else:
+            results = await session.execute(self._term_facets_query(session, obj_type, term, startswith))
             buckets = []
             for hit in results.aggregations.facets.buckets:
                 buckets.append((hit['key'], hit['doc_count']))
@@ -183,20 +435,24 @@ class ProductService():
         self.zone = zone
 
 
-    def get(self, id=None, **kwargs):
+    def get(self, id=None, catalog=None, **kwargs):
         """
         shortcut to ElasticSession.get(Product, id)
+
+        :param catalog: optional, the catalog of the product, which routes the get in a routed zone
         """
-        return _ObjectQuery().get(self.zone, Product, id=id, **kwargs)
+        return _ObjectQuery().get(self.zone, Product, id=id, catalog=catalog, **kwargs)
 
 
-    def find(self, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None):
+    def find(self, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None, ranges=None, preference=None):
         """
         returns a tuple : (paged list of Product filtered on catalog, count)
 
         :param city: optional list of cities
         :param max_price: optional max price to filter results
-        :param catalog: a catalog term
+        :param catalog: a catalog term, or a list of catalog terms
+        :param ranges: optional ranges of typed attributes, ex: {'bedrooms': {'gte': 3}}
+        :param preference: optional, a key of the user session (see _ObjectQuery.find)
         """
         return _ObjectQuery().find(
             self.zone,
@@ -206,7 +462,9 @@ class ProductService():
             page=page,
             exclude=exclude,
             feature=feature,
-            catalog=catalog)
+            catalog=catalog,
+            ranges=ranges,
+            preference=preference)
 
 
     def search(self):
@@ -216,8 +474,72 @@ class ProductService():
         return _ObjectQuery().search(self.zone, Product)
 
 
+    def explain(self, **kwargs):
+        """
+        the query of find() with the same params, not executed (see _ObjectQuery.explain)
+        """
+        return _ObjectQuery().explain(self.zone, Product, **kwargs)
+
+
     def get_term_facets(self, term, startswith=None):
         """
         fetches the facets of a given term in the catalog
         """
         return _ObjectQuery().get_term_facets(self.zone, Product, term, startswith=startswith)
+
+
+class AsyncProductService():
+    """
+    asyncio counterpart of ProductService, to be used in the Sanic handlers
+    """
+
+    def __init__(self, zone):
+        """
+        """
+        self.zone = zone
+
+
+    async def get(self, id=None, catalog=None, **kwargs):
+        """
+        shortcut to AsyncElasticSession.get(Product, id)
+
+        :param catalog: optional, the catalog of the product, which routes the get in a routed zone
+        """
+        return await _AsyncObjectQuery().get(self.zone, Product, id=id, catalog=catalog, **kwargs)
+
+
+    async def find(self, page=1, city=None, max_price=0, exclude=None, feature=None, catalog=None, ranges=None, preference=None):
+        """
+        returns a tuple : (paged list of Product filtered on catalog, count)
+
+        :param city: optional list of cities
+        :param max_price: optional max price to filter results
+        :param catalog: a catalog term, or a list of catalog terms
+        :param ranges: optional ranges of typed attributes, ex: {'bedrooms': {'gte': 3}}
+        :param preference: optional, a key of the user session (see _ObjectQuery.find)
+        """
+        return await _AsyncObjectQuery().find(
+            self.zone,
+            Product,
+            city=city,
+            max_price=max_price,
+            page=page,
+            exclude=exclude,
+            feature=feature,
+            catalog=catalog,
+            ranges=ranges,
+            preference=preference)
+
+
+    def explain(self, **kwargs):
+        """
+        the query of find() with the same params, not executed (see _ObjectQuery.explain)
+        """
+        return _AsyncObjectQuery().explain(self.zone, Product, **kwargs)
+
+
+    async def get_term_facets(self, term, startswith=None):
+        """
+        fetches the facets of a given term in the catalog
+        """
+        return await _AsyncObjectQuery().get_term_facets(self.zone, Product, term, startswith=startswith)
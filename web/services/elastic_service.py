@@ -5,7 +5,7 @@ import logging
 import collections
 from datetime import datetime
 
-from elasticsearch import Elasticsearch, NotFoundError, ElasticsearchException
+from elasticsearch import Elasticsearch, NotFoundError, ElasticsearchException, RequestError
 import elasticsearch.helpers as helpers
 
 from elasticsearch_dsl import (Search, Index, Document, Date, Boolean, Byte, Integer,
@@ -21,6 +21,7 @@ import utils
 import config
 
 from .exceptions import ServiceError, InitializationError
+from .elastic_client import ElasticClientRegistry
 
 logger = logging.getLogger('app')
 
@@ -61,7 +62,8 @@ class ElasticSession(QueryBase):
 
         self.catalogs_index = zone
 
-        self.es = Elasticsearch(hosts=hosts)
+        # clients are shared per process, to reuse the keep-alive connections
+        self.es = ElasticClientRegistry.get_client(hosts)
         self.logger.debug(f"Initiated Session on {hosts} for index '{self.catalogs_index}'")
 
 
@@ -76,14 +78,21 @@ class ElasticSession(QueryBase):
         # NB: doc_types are deprecated in ES7.0, no way to insert it at the object level (through the Meta and Index class) it's not taken into account anymore
         # however, our current elasticsearch is a 6.x and requires a doc_type
         # passing the kwarg doc_type makes it compliant with both Elastic 7.x and Elastic 6.x
-        return cls.get(
-            index=self.get_catalogs_index(),
-            using=self.get_client(),
-            id=id,
-            doc_type='_doc',
-            ignore=404,
-            **kwargs
-        )
+        try:
+            return cls.get(
+                index=self.get_catalogs_index(),
+                using=self.get_client(),
+                id=id,
+                doc_type='_doc',
+                ignore=404,
+                **kwargs
+            )
+        except RequestError as re:
+            # the zone is an alias of several indices (partitioned zone), or the zone is routed and no routing was passed,
+            # a get is not possible
+            self.logger.debug(f"Get not possible on '{self.catalogs_index}', searching for id {id}: {re}")
+            hits = self.search(cls).filter('ids', values=[id])[:1].execute()
+            return hits[0] if len(hits) > 0 else None
 
 
     def find(self, *args, **kwargs):
@@ -143,6 +152,119 @@ class ElasticSession(QueryBase):
         ))
 
 
+class AsyncElasticSession(QueryBase):
+    """
+    asyncio counterpart of ElasticSession, the requests are sent with an async client
+    so that the event loop is not blocked while Elasticsearch is processing them
+
+    the queries are built with elasticsearch_dsl as for ElasticSession, only their execution differs
+    """
+    def __init__(self, hosts=None, zone=None):
+        """
+        """
+        if hosts is None or not utils.is_list(hosts):
+            raise InitializationError("Bad parameter 'hosts'")
+
+        self.logger = logging.getLogger('app')
+
+        if not zone or zone.strip()=='':
+            raise ValueError("Cannot init session without a zone")
+
+        self.catalogs_index = zone
+
+        # clients are shared per process and event loop, to reuse the keep-alive connections
+        self.es = ElasticClientRegistry.get_async_client(hosts)
+        self.logger.debug(f"Initiated async Session on {hosts} for index '{self.catalogs_index}'")
+
+
+    async def get(self, cls, id=None, **kwargs):
+        """
+        retrieves an object of type cls, returns None if not found
+        """
+        try:
+            doc = await self.es.get(
+                index=self.get_catalogs_index(),
+                id=id,
+                doc_type='_doc',
+                ignore=404,
+                **kwargs
+            )
+        except RequestError as re:
+            # the zone is an alias of several indices (partitioned zone), or the zone is routed and no routing was passed,
+            # a get is not possible
+            self.logger.debug(f"Get not possible on '{self.catalogs_index}', searching for id {id}: {re}")
+            hits = await self.execute(self.search(cls).filter('ids', values=[id])[:1])
+            return hits[0] if len(hits) > 0 else None
+
+        if not doc or not doc.get('found', False):
+            return None
+        return cls.from_es(doc)
+
+
+    def find(self, *args, **kwargs):
+        raise NotImplementedError("prefer calling the search()")
+
+
+    def get_client(self):
+        return self.es
+
+
+    def get_catalogs_index(self):
+        """
+        this is the name of the index where Product and Review objects
+        are indexed
+        """
+        return self.catalogs_index
+
+
+    async def health(self):
+        """
+        checks the indices health with a timeout of 1 second
+        """
+        return await self.es.cluster.health(level='indices', request_timeout=1)
+
+
+    def search(self, cls):
+        """
+        returns a search on the index, to be executed with execute() or count()
+        """
+        return cls.search(index=self.get_catalogs_index())
+
+
+    async def execute(self, search):
+        """
+        executes the search, returns a elasticsearch_dsl Response as Search.execute() does
+        """
+        raw = await self.es.search(
+            index=self.get_catalogs_index(),
+            body=search.to_dict(),
+            **search._params
+        )
+        return search._response_class(search, raw)
+
+
+    async def count(self, search):
+        """
+        counts the documents matching the search, as Search.count() does
+        """
+        raw = await self.es.count(
+            index=self.get_catalogs_index(),
+            body=search.to_dict(count=True),
+            **search._params
+        )
+        return raw['count']
+
+
+    async def get_term_facets(self, cls, term):
+        """
+        the facets of a term, as a list of tuples (term, count)
+        """
+        s = self.search(cls).extra(size=0)
+        s.aggs.bucket('term', 'terms', field=term)
+        results = await self.execute(s)
+        return [(bucket['key'], bucket['doc_count']) for bucket in results.aggregations.term.buckets]
+
+
 class Serializable(Document):
 
     def to_json(self, include_meta=False):
@@ -257,6 +379,14 @@ class Product(CatalogItem):
     # area is the surface
     area = ScaledFloat(100, index=True, required=True)
 
+    # typed attributes extracted from the title and the description at ingest
+    bedrooms = Short(index=True, required=False)
+    rooms = Short(index=True, required=False)
+    land_area = ScaledFloat(100, index=True, required=False)
+    # A to G
+    energy_class = Keyword(index=True, required=False)
+    floor = Short(index=True, required=False)
+
     # this list of media URI (video, images, ...)
     media = Text(index=False, multi=True, required=True)
     url = Text(index=False, required=True)
@@ -21,6 +21,7 @@ import config
 
 from tests.data.base_data import ZONE
 from tests.data.products import get_product_id
+from tests.conftest import mock_coro
 
 
 ITEM_SCHEMA = {
@@ -72,8 +73,8 @@ async def test_get_jsonschema_error(test_cli, mocker, dataset):
     # delete the sku which will cause the json schema validation error
     del training_dataset[0]['sku']
 
-    mock_es = mocker.patch("services.data.data_provider.ProductService.get")
-    mock_es.return_value = Product.from_dict(training_dataset[0])
+    mock_es = mocker.patch("services.data.data_provider.AsyncProductService.get")
+    mock_es.return_value = mock_coro(Product.from_dict(training_dataset[0]))
 
     response = await test_cli.get(f"/products/{id}?zone={ZONE}")
 
@@ -180,8 +181,8 @@ async def test_list_products_jsonschema_error(test_cli, mocker, dataset):
     a_product = training_dataset[0]
     del a_product['sku']
 
-    mock_find = mocker.patch("services.data.data_provider.ProductService.find")
-    mock_find.return_value = [Product.from_dict(p) for p in training_dataset], len(training_dataset)
+    mock_find = mocker.patch("services.data.data_provider.AsyncProductService.find")
+    mock_find.return_value = mock_coro(([Product.from_dict(p) for p in training_dataset], len(training_dataset)))
 
     response = await test_cli.get(f"/products?zone={ZONE}&user_id={users_dataset[0]['id']}")
 
@@ -317,7 +318,8 @@ async def test_list_override_city(test_cli, mocker, dataset):
 
     cities = ['test1', 'test2']
 
-    mock_find = mocker.patch("services.data.data_provider.ProductService.find")
+    mock_find = mocker.patch("services.data.data_provider.AsyncProductService.find")
+    mock_find.return_value = mock_coro(([], 0))
     # mock_count = mocker.patch("services.data.data_provider.ProductService.count")
 
     response = await test_cli.get(f"/products?zone={ZONE}&user_id={users_dataset[1]['id']}&city={','.join(cities)}")
@@ -337,7 +339,8 @@ async def test_list_override_max_price(test_cli, mocker, dataset):
 
     max_price = 1
 
-    mock_find = mocker.patch("services.data.data_provider.ProductService.find")
+    mock_find = mocker.patch("services.data.data_provider.AsyncProductService.find")
+    mock_find.return_value = mock_coro(([], 0))
     # mock_count = mocker.patch("services.data.data_provider.ProductService.count")
 
     response = await test_cli.get(f"/products?zone={ZONE}&user_id={users_dataset[1]['id']}&max_price={max_price}")
@@ -348,3 +351,36 @@ async def test_list_override_max_price(test_cli, mocker, dataset):
 
     assert find_kwargs['max_price'] == max_price
     # assert count_kwargs['max_price'] == max_price
+
+
+async def test_list_ranges(test_cli, mocker, dataset):
+    """The typed attributes are filtered on ranges"""
+
+    mock_find = mocker.patch("services.data.data_provider.AsyncProductService.find")
+    mock_find.return_value = mock_coro(([], 0))
+
+    response = await test_cli.get(f"/products?zone={ZONE}&bedrooms_min=3&land_area_max=500&energy_class_max=C&unknown_min=1")
+
+    find_args, find_kwargs = mock_find.call_args
+
+    assert find_kwargs['ranges'] == {
+        'bedrooms': {'gte': '3'},
+        'land_area': {'lte': '500'},
+        'energy_class': {'lte': 'C'}
+    }
+
+
+async def test_list_explain_plan(test_cli, mocker, dataset):
+    """the debug mode returns the query sent to Elasticsearch and its took time"""
+
+    response = await test_cli.get(f"/products?zone={ZONE}&max_price=1000000&explain_plan=1")
+    jay = await response.json()
+
+    plan = jay.get('plan')
+    assert plan['query']['query']['bool']['filter'] == [{'range': {'price': {'gte': 0.0, 'lte': 1000000.0}}}]
+    assert plan['params']['request_cache']
+    assert plan['took'] >= 0
+
+    response = await test_cli.get(f"/products?zone={ZONE}")
+    jay = await response.json()
+    assert 'plan' not in jay
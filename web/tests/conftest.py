@@ -70,6 +70,11 @@ _MAPPING = {
             "area" : {"type" : "scaled_float", "scaling_factor": 100},
             "media" :  {"type" : "text", "index": "false"},
             "url" : {"type" : "text", "index": "false"},
+            "bedrooms" : {"type" : "short"},
+            "rooms" : {"type" : "short"},
+            "land_area" : {"type" : "scaled_float", "scaling_factor": 100},
+            "energy_class" : {"type" : "keyword"},
+            "floor" : {"type" : "short"},
             "quality_index": {"type" : "float"}, # computed, used for ranking & highlights
         }
     }
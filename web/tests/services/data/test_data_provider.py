@@ -4,6 +4,7 @@ import copy
 import pytest
 import random
 import time
+import json
 
 from pytest import raises
 
@@ -14,7 +15,7 @@ from elasticsearch_dsl import Search
 
 from services.elastic_service import ElasticSession, Product
 from services.data.data_meta import CatalogMeta
-from services.data.data_provider import ProductService
+from services.data.data_provider import ProductService, AsyncProductService, _ObjectQuery
 
 from tests.data.base_data import ZONE
 from tests.data.products import get_product_id
@@ -28,6 +29,111 @@ class TestProductService(object):
     The search method returns Review type objects
     """
 
+    async def test_find_product_by_ranges(self, monkeypatch, mocker, dataset):
+        """
+        the ranges of typed attributes are run in filter context, invalid ranges are ignored
+        """
+        query = _ObjectQuery()._build_query(
+            Product,
+            zone=ZONE,
+            ranges={
+                'bedrooms': {'gte': '3'},
+                'energy_class': {'lte': 'c'},
+                'floor': {'lte': 'not a number'},
+                'price': {'lte': 100}
+            }
+        ).to_dict()
+
+        assert query['query']['bool']['filter'] == [
+            {'range': {'bedrooms': {'gte': 3}}},
+            {'range': {'energy_class': {'lte': 'C'}}}
+        ]
+
+
+    async def test_find_early_termination(self, monkeypatch, mocker, dataset):
+        """
+        the page query follows the index sort and does not count the hits, the count query still does
+        """
+        es_query, count_query = _ObjectQuery()._prepare_find(ZONE, Product, page=2, max_price=100)
+
+        query = es_query.to_dict()
+        assert query['track_total_hits'] == False
+        assert query['sort'] == [
+            {'is_new': {'order': 'desc', 'missing': '_last'}},
+            {'quality_index': {'order': 'desc', 'missing': '_last'}}
+        ]
+        assert query['from'] == config.ES.RESULTS_PER_PAGE
+        assert 'track_total_hits' not in count_query.to_dict()
+
+
+    async def test_find_routing(self, monkeypatch, mocker, dataset):
+        """
+        the search of a single catalog of a routed zone is routed to the shard of the catalog,
+        the search of several catalogs hits all the shards
+        """
+        monkeypatch.setattr('config.ES.ROUTED_ZONES', [ZONE])
+
+        es_query, count_query = _ObjectQuery()._prepare_find(ZONE, Product, catalog="GLV ")
+        assert es_query._params == {'routing': "glv", 'request_cache': True}
+        assert count_query._params == {'routing': "glv"}
+
+        es_query, count_query = _ObjectQuery()._prepare_find(ZONE, Product, catalog=["glv", "other"])
+        assert es_query._params == {'request_cache': True}
+        assert es_query.to_dict()['query']['bool']['filter'] == [{'terms': {'catalog': ["glv", "other"]}}]
+
+        monkeypatch.setattr('config.ES.ROUTED_ZONES', [])
+        es_query, count_query = _ObjectQuery()._prepare_find(ZONE, Product, catalog="glv")
+        assert es_query._params == {'request_cache': True}
+
+
+    async def test_find_cacheable(self, monkeypatch, mocker, dataset):
+        """
+        the same search gives the same query body whatever the order of the values passed,
+        the exclusions of the user are kept in the last filter and the page is not cached when the user has exclusions
+        """
+        es_query, count_query = _ObjectQuery()._prepare_find(
+            ZONE, Product, city=["roubaix", "lille", " "], feature=["jardin", "garage"], catalog=["other", "glv"],
+            ranges={'energy_class': {'lte': 'C'}, 'bedrooms': {'lte': 5, 'gte': 3}}, preference="abc")
+        same_query, _ = _ObjectQuery()._prepare_find(
+            ZONE, Product, city=["lille", "roubaix", "lille"], feature=["garage", "jardin"], catalog=["glv", "other"],
+            ranges={'bedrooms': {'gte': 3, 'lte': 5}, 'energy_class': {'lte': 'C'}}, preference="abc")
+
+        assert json.dumps(es_query.to_dict()) == json.dumps(same_query.to_dict())
+        assert es_query._params == {'preference': "abc", 'request_cache': True}
+        assert count_query._params == {'preference': "abc"}
+
+        es_query, count_query = _ObjectQuery()._prepare_find(ZONE, Product, city=["lille"], exclude=["b", "a", " "])
+        query = es_query.to_dict()
+        assert query['query']['bool']['filter'][0] == {'regexp': {'city': '.*(lille).*'}}
+        assert query['query']['bool']['filter'][-1] == {'bool': {'must_not': [{'ids': {'values': ["a", "b"]}}]}}
+        assert 'request_cache' not in es_query._params
+
+
+    async def test_query_planner(self, monkeypatch, mocker, dataset):
+        """
+        the constraints run in filter context, the clause of the cities depends on how they match the city of the ads
+        """
+        query = _ObjectQuery()._build_query(
+            Product, zone=ZONE, city=["roubaix", "st-andré (59)"], feature=["jardin", "garage"], catalog=["glv"]).to_dict()
+
+        assert query['query'] == {'bool': {'filter': [
+            {'term': {'catalog': "glv"}},
+            {'term': {'features': "garage"}},
+            {'term': {'features': "jardin"}},
+            {'regexp': {'city': '.*(roubaix|st-andré \\(59\\)).*'}}
+        ]}}
+
+        monkeypatch.setattr('config.ES.CITY_MATCH', 'exact')
+        query = _ObjectQuery()._build_query(Product, zone=ZONE, city=["roubaix", "lille"]).to_dict()
+        assert query['query']['bool']['filter'] == [{'terms': {'city': ["lille", "roubaix"]}}]
+
+        monkeypatch.setattr('config.ES.CITY_MATCH', 'prefix')
+        query = _ObjectQuery()._build_query(Product, zone=ZONE, city=["lille"]).to_dict()
+        assert query['query']['bool']['filter'] == [{'prefix': {'city': "lille"}}]
+
+        assert _ObjectQuery()._build_query(Product, zone=ZONE).to_dict() == {}
+
+
     async def test_get_product(self, monkeypatch, mocker, dataset):
         """
         """
@@ -165,3 +271,49 @@ class TestProductService(object):
         assert all([e.city == a_product['city'] for e in ps])
         assert all([e.price <= a_product['price'] for e in ps])
         assert all([e.catalog == catalog.short_name for e in ps])
+
+
+@pytest.mark.usefixtures("monkeypatch", "mocker", "dataset")
+class TestAsyncProductService(object):
+    """
+    The async service returns the same results as the sync one
+    """
+
+    async def test_get_product(self, monkeypatch, mocker, dataset):
+        """
+        """
+        a_product = copy.deepcopy(dataset['products']['valid'][0])
+
+        data_provider = AsyncProductService(ZONE)
+        p = await data_provider.get(id=get_product_id(a_product))
+
+        assert isinstance(p, Product)
+        assert p.meta.id == get_product_id(a_product)
+
+
+    async def test_get_product_not_found(self, monkeypatch, mocker, dataset):
+        """
+        """
+        data_provider = AsyncProductService(ZONE)
+        p = await data_provider.get(id="not_existing")
+
+        assert p is None
+
+
+    async def test_find(self, monkeypatch, mocker, dataset):
+        """
+        """
+        ps, count = ProductService(ZONE).find()
+        async_ps, async_count = await AsyncProductService(ZONE).find()
+
+        assert async_count == count
+        assert [p.meta.id for p in async_ps] == [p.meta.id for p in ps]
+
+
+    async def test_get_term_facets(self, monkeypatch, mocker, dataset):
+        """
+        """
+        facets = ProductService(ZONE).get_term_facets('city')
+        async_facets = await AsyncProductService(ZONE).get_term_facets('city')
+
+        assert sorted(async_facets) == sorted(facets)
@@ -7,6 +7,7 @@ import pytest
 
 import ujson as json
 
+from elasticsearch import RequestError
 from elasticsearch_dsl import Document
 from services.elastic_service import ElasticSession, Serializable
 
@@ -32,6 +33,21 @@ class TestElasticSession(object):
         assert kwargs['ignore'] == 404
 
 
+    async def test_get_alias_of_several_indices(test_cli, mocker, dataset):
+        """an ids search is performed when the zone is an alias of several indices
+        """
+        mock_get = mocker.patch("elasticsearch_dsl.Document.get")
+        mock_get.side_effect = RequestError(400, 'illegal_argument_exception', {})
+        mock_search = mocker.patch("elasticsearch_dsl.Search.execute")
+        mock_search.return_value = []
+
+        session = ElasticSession(hosts=[os.getenv('ES_HOST')], zone=ZONE)
+        obj = session.get(Document, id="1")
+
+        assert obj is None
+        assert mock_search.called
+
+
     async def test_search(test_cli, mocker, dataset):
         mock_search = mocker.patch("elasticsearch_dsl.Document.search")
 